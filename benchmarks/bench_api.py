@@ -0,0 +1,326 @@
+"""Benchmark of the v2 API against the local triplestore stand-in (benchmarks/triplestore.py).
+
+Starts the stand-in and the app (uvicorn, in this process) and runs one scenario per v2 route:
+`--requests` requests with `--concurrency` clients, for at most `--max-seconds` per scenario.
+Reports latency percentiles (p50/p95/p99), throughput, the time spent in the stand-in per
+request and the peak of the memory allocated while serving one (cold) request, measured with
+tracemalloc in a separate pass so it does not slow down the timed requests. The report is
+written as JSON; with `--compare` the p50 / p95 of a previous report are compared and the
+script exits with 1 if a scenario got slower by more than `--threshold`.
+
+The response cache is off by default, so every request goes through render -> query ->
+flatten -> model. `--cache memory` uses fastapi-cache's InMemoryBackend instead of redis.
+The recon index, the precomputed statistics, sentry and the coalescing of identical queries
+(SPARQL_SINGLE_FLIGHT) are disabled, the ID sets are kept locally.
+
+    PYTHONPATH=. python benchmarks/bench_api.py --requests 20 --concurrency 4 --output bench_api.json
+"""
+import argparse
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import requests
+
+sys.path.insert(0, os.path.dirname(__file__))
+import triplestore  # noqa: E402
+
+PERSON_PROXY = "http://www.intavia.eu/apis/personproxy/{}"
+
+
+def b64(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode("utf-8")).decode("utf-8")
+
+
+def sample_ids(stand_in: triplestore.StandIn, query: str, limit: int) -> list[str]:
+    res = json.loads(stand_in.query(f"{query} LIMIT {limit}"))
+    return [binding["id"]["value"] for binding in res["results"]["bindings"]]
+
+
+def scenarios(stand_in: triplestore.StandIn) -> dict[str, dict]:
+    """One request template per v2 route, with IDs taken from the fixtures."""
+    prefixes = "PREFIX idmcore: <http://www.intavia.eu/idm-core/> PREFIX bioc: <http://ldf.fi/schema/bioc/> "
+    entities = sample_ids(
+        stand_in, prefixes + "SELECT DISTINCT ?id WHERE { ?p idmcore:proxy_for ?id } ORDER BY ?id", 50
+    )
+    # only the careers of the fixtures have participants (births and deaths are linked with crm:P98 / P100)
+    events = sample_ids(
+        stand_in,
+        prefixes + "SELECT DISTINCT ?id WHERE { ?id bioc:had_participant_in_role/^bioc:bearer_of ?p } ORDER BY ?id",
+        50,
+    )
+    occupations = sample_ids(
+        stand_in, prefixes + "SELECT DISTINCT ?id WHERE { ?p bioc:has_occupation ?id } ORDER BY ?id", 20
+    )
+    roles = ["http://www.intavia.eu/idm-role/born_person", "http://www.intavia.eu/idm-role/deceased_person"]
+    kinds = ["http://www.intavia.eu/idm-core/Career", "http://www.cidoc-crm.org/cidoc-crm/E67_Birth"]
+    body = lambda ids: {"id": [b64(i) for i in ids]}  # noqa: E731
+    return {
+        "entities_search": {"path": "/v2/api/entities/search", "params": {"limit": 50}},
+        "entities_search_q": {"path": "/v2/api/entities/search", "params": {"q": "thor", "limit": 50}},
+        "entities_export": {"path": "/v2/api/entities/export", "params": {"q": "thor"}},
+        "entities_retrieve": {"method": "POST", "path": "/v2/api/entities/retrieve", "json": body(entities)},
+        "entity": {"path": f"/v2/api/entities/{b64(entities[0])}"},
+        "events_search": {"path": "/v2/api/events/search", "params": {"limit": 50}},
+        "events_export": {"path": "/v2/api/events/export", "params": {"q": "birth"}},
+        "events_retrieve": {"method": "POST", "path": "/v2/api/events/retrieve", "json": body(events)},
+        "event": {"path": f"/v2/api/events/{b64(events[0])}"},
+        "media_retrieve": {"method": "POST", "path": "/v2/api/media/retrieve", "json": body(entities[:5])},
+        "media": {"path": f"/v2/api/media/{b64(entities[0])}"},
+        "biography_retrieve": {"method": "POST", "path": "/v2/api/biography/retrieve", "json": body(entities[:5])},
+        "biography": {"path": f"/v2/api/biography/{b64(entities[0])}"},
+        "occupations_search": {"path": "/v2/api/vocabularies/occupations/search", "params": {"limit": 50}},
+        "occupation": {"path": f"/v2/api/vocabularies/occupations/{b64(occupations[0])}"},
+        "occupations_retrieve": {
+            "method": "POST",
+            "path": "/v2/api/vocabularies/occupations/retrieve",
+            "json": body(occupations),
+        },
+        "roles_search": {"path": "/v2/api/vocabularies/roles/search", "params": {"limit": 50}},
+        "role": {"path": f"/v2/api/vocabularies/roles/{b64(roles[0])}"},
+        "roles_retrieve": {"method": "POST", "path": "/v2/api/vocabularies/roles/retrieve", "json": body(roles)},
+        "event_kinds_search": {"path": "/v2/api/vocabularies/event_kinds/search", "params": {"limit": 50}},
+        "event_kind": {"path": f"/v2/api/vocabularies/event_kinds/{b64(kinds[0])}"},
+        "event_kinds_retrieve": {
+            "method": "POST",
+            "path": "/v2/api/vocabularies/event_kinds/retrieve",
+            "json": body(kinds),
+        },
+        "statistics": {"path": "/v2/api/statistics/search"},
+        "statistics_bulk": {"method": "POST", "path": "/v2/api/statistics/bulk", "json": body(entities)},
+        "statistics_occupations": {"path": "/v2/api/statistics/occupations/search"},
+        "statistics_occupations_bulk": {
+            "method": "POST",
+            "path": "/v2/api/statistics/occupations/bulk",
+            "json": body(entities),
+        },
+        "statistics_birth_dates": {"path": "/v2/api/statistics/birth_dates/search"},
+        "statistics_birth_dates_bulk": {
+            "method": "POST",
+            "path": "/v2/api/statistics/birth_dates/bulk",
+            "json": body(entities),
+        },
+        "statistics_death_dates": {"path": "/v2/api/statistics/death_dates/search"},
+        "statistics_death_dates_bulk": {
+            "method": "POST",
+            "path": "/v2/api/statistics/death_dates/bulk",
+            "json": body(entities),
+        },
+        "statistics_entity_types": {"path": "/v2/api/statistics/entity_types/search"},
+        "statistics_entity_types_bulk": {
+            "method": "POST",
+            "path": "/v2/api/statistics/entity_types/bulk",
+            "json": body(entities),
+        },
+        "idsets_register": {"method": "POST", "path": "/v2/api/idsets", "json": body(entities)},
+    }
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+class Runner:
+    def __init__(self, base_url: str, stand_in: triplestore.StandIn, timeout: float):
+        self.base_url = base_url
+        self.stand_in = stand_in
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, scenario: dict) -> tuple[float, int]:
+        started = time.perf_counter()
+        try:
+            res = self.session().request(
+                scenario.get("method", "GET"),
+                self.base_url + scenario["path"],
+                params=scenario.get("params"),
+                json=scenario.get("json"),
+                timeout=self.timeout,
+            )
+            _ = res.content
+            status = res.status_code
+        except requests.RequestException:
+            status = 0
+        return time.perf_counter() - started, status
+
+    def peak_memory(self, scenario: dict) -> int:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        self.request(scenario)
+        return tracemalloc.get_traced_memory()[1] - baseline
+
+    def run(self, scenario: dict, requests_: int, concurrency: int, max_seconds: float) -> dict:
+        deadline = time.perf_counter() + max_seconds
+        results = []
+        before = self.stand_in.snapshot()
+
+        def worker(n: int):
+            for _ in range(n):
+                if time.perf_counter() > deadline:
+                    return
+                results.append(self.request(scenario))
+
+        started = time.perf_counter()
+        shares = [requests_ // concurrency + (1 if i < requests_ % concurrency else 0) for i in range(concurrency)]
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(worker, shares))
+        wall = time.perf_counter() - started
+        after = self.stand_in.snapshot()
+        latencies = sorted(latency * 1e3 for latency, _ in results)
+        statuses = {}
+        for _, status in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            "requests": len(results),
+            "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+            "statuses": statuses,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": sum(latencies) / len(latencies) if latencies else float("nan"),
+            "throughput_rps": len(results) / wall if wall > 0 else float("nan"),
+            "triplestore_queries_per_request": (after["queries"] - before["queries"]) / max(1, len(results)),
+            "triplestore_ms_per_request": (after["seconds"] - before["seconds"]) * 1e3 / max(1, len(results)),
+            "triplestore_errors": after["errors"] - before["errors"],
+        }
+
+
+def start_app(endpoint: str, cache: str):
+    os.environ["SPARQL_ENDPOINT"] = endpoint
+    os.environ.setdefault("RECON_INDEX_ENABLED", "False")
+    os.environ.setdefault("STATISTICS_STORE_ENABLED", "False")
+    os.environ.setdefault("ID_SET_STORAGE", "local")
+    os.environ.setdefault("METRICS_STORAGE", "local")
+    # results of coalesced queries are reused for some seconds, every request should query the stand-in
+    os.environ.setdefault("SPARQL_SINGLE_FLIGHT", "off")
+    os.environ["APIS_REDIS_CACHING"] = "False" if cache == "off" else "True"
+    import sentry_sdk
+    import uvicorn
+    from fastapi_cache import FastAPICache
+    from fastapi_cache.backends.inmemory import InMemoryBackend
+
+    from intavia_backend.cache_keys import canonical_key_builder
+    from intavia_backend.main import app
+
+    sentry_sdk.init()  # main initializes sentry with the DSN of the deployment
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, name="app", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    # no redis: stop the invalidation listener and cache in memory
+    listener = app.state.cache_listener
+    listener.get_loop().call_soon_threadsafe(listener.cancel)
+    # init is a no-op once the startup event initialized the redis backend
+    FastAPICache.reset()
+    FastAPICache.init(InMemoryBackend(), prefix="api-cache", key_builder=canonical_key_builder)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}"
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline_path: str, threshold: float) -> list[str]:
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    regressions = []
+    for name, result in report["scenarios"].items():
+        if name not in baseline:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            before, after = baseline[name][key], result[key]
+            change = (after - before) / before if before else 0.0
+            print(f"{name:32} {key:7} {before:9.1f} -> {after:9.1f} ms ({change:+.0%})")
+            if change > threshold:
+                regressions.append(f"{name} {key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-seconds", type=float, default=60, help="time budget per scenario")
+    parser.add_argument("--timeout", type=float, default=120, help="timeout per request in seconds")
+    parser.add_argument("--cache", choices=["off", "memory"], default="off")
+    parser.add_argument("--scenarios", nargs="*", help="run only these scenarios")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory pass")
+    parser.add_argument("--output", default="bench_api.json")
+    parser.add_argument("--compare", help="report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown with --compare")
+    args = parser.parse_args()
+
+    store, stand_in = triplestore.serve()
+    endpoint = f"http://127.0.0.1:{store.server_port}/sparql"
+    server, base_url = start_app(endpoint, args.cache)
+    runner = Runner(base_url, stand_in, args.timeout)
+    selected = {
+        name: scenario for name, scenario in scenarios(stand_in).items() if not args.scenarios or name in args.scenarios
+    }
+
+    memory = {}
+    if not args.no_memory:
+        tracemalloc.start()
+        for name, scenario in selected.items():
+            memory[name] = runner.peak_memory(scenario)
+        tracemalloc.stop()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "cache": args.cache,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": {},
+    }
+    print(
+        f"{'scenario':32} {'n':>4} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>7} {'store':>9} {'peak KiB':>9}"
+    )
+    for name, scenario in selected.items():
+        runner.request(scenario)  # warm up
+        result = runner.run(scenario, args.requests, args.concurrency, args.max_seconds)
+        if name in memory:
+            result["peak_memory_bytes"] = memory[name]
+        report["scenarios"][name] = result
+        print(
+            f"{name:32} {result['requests']:4d} {result['errors']:4d} {result['p50_ms']:9.1f} {result['p95_ms']:9.1f} "
+            f"{result['p99_ms']:9.1f} {result['throughput_rps']:7.1f} {result['triplestore_ms_per_request']:9.1f} "
+            f"{memory.get(name, 0) / 1024:9.0f}"
+        )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+    server.should_exit = True
+    store.shutdown()
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark of decoding SPARQL JSON bindings (flatten_rdf_data).
+
+The bindings are synthesized from the events of the debug_5-10_22.json fixture, one row
+per event with the variables of the entity / event queries. Compares the former
+flatten_rdf_data with decode_bindings.
+
+    PYTHONPATH=. python benchmarks/bench_bindings.py
+"""
+import copy
+import datetime
+import json
+import os
+import timeit
+
+from intavia_backend.binding_decoder import decode_bindings
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "intavia_backend", "debug_5-10_22.json")
+XSD = "http://www.w3.org/2001/XMLSchema#"
+REPEAT = 20
+
+
+def literal(value, datatype=None):
+    term = {"type": "literal", "value": str(value)}
+    if datatype is not None:
+        term["datatype"] = XSD + datatype
+    return term
+
+
+def uri(value):
+    return {"type": "uri", "value": value}
+
+
+def synthesize_bindings() -> list:
+    with open(FIXTURE) as fixture:
+        entity = json.load(fixture)
+    rows = []
+    for idx, event in enumerate(entity["events"]):
+        row = {
+            "entity": uri(entity["id"]),
+            "entityLabel": literal(entity["label"][0]["default"]),
+            "gender": uri(entity["gender"]["id"]),
+            "count": literal(entity["_count"], "integer"),
+            "event": uri(event["id"]),
+            "event_label": literal(event["label"]["default"]),
+            "role_type": uri(event["_source_entity_role"]["id"]),
+            "linkedIds": uri(entity["_linkedIds"][idx % len(entity["_linkedIds"])]),
+        }
+        if "startDate" in event:
+            row["begin"] = literal(event["startDate"], "dateTime")
+            row["end"] = literal(event["endDate"], "dateTime")
+        if "place" in event:
+            row["place"] = uri(event["place"]["id"])
+            row["geometry"] = literal(event["place"]["_lat_long"])
+        rows.append(row)
+    return rows * REPEAT
+
+
+def flatten_rdf_data_before(data: dict) -> list:
+    flattened_data = []
+    for ent in data:
+        d_res = {}
+        for k, v in ent.items():
+            if isinstance(v, dict):
+                if "value" in v:
+                    if "datatype" in v:
+                        if v["datatype"] == "http://www.w3.org/2001/XMLSchema#dateTime":
+                            try:
+                                v["value"] = datetime.datetime.fromisoformat(str(v["value"]).replace("Z", "+00:00"))
+                            except ValueError:
+                                continue
+                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#integer":
+                            v["value"] = int(v["value"])
+                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#boolean":
+                            v["value"] = bool(v["value"])
+                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#float":
+                            v["value"] = float(v["value"])
+                    d_res[k] = v["value"]
+                else:
+                    d_res[k] = v
+            else:
+                d_res[k] = v
+        flattened_data.append(d_res)
+    return flattened_data
+
+
+def main():
+    bindings = synthesize_bindings()
+    print(f"{len(bindings)} rows")
+    # the former implementation converts the values in place, every run needs fresh bindings
+    copies = [copy.deepcopy(bindings) for _ in range(5)]
+    before = min(timeit.repeat(lambda: flatten_rdf_data_before(copies.pop()), number=1, repeat=5))
+    after = min(timeit.repeat(lambda: decode_bindings(bindings), number=1, repeat=5))
+    for name, seconds in (("before (flatten_rdf_data)", before), ("decode_bindings", after)):
+        print(f"{name:28} {seconds * 1e3:8.1f} ms {seconds / len(bindings) * 1e6:6.2f} µs/row")
+
+
+if __name__ == "__main__":
+    main()
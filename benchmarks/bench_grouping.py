@@ -0,0 +1,71 @@
+"""Benchmark of mapping flat result rows to PaginatedResponseEntities.
+
+A result set of 1000 entities is synthesized from the debug_5-10_22.json fixture in the shape
+of search_v2_1.sparql: every entity has 2 labels, 2 occupations, 2 linked ids and 8 events,
+which fan out to 64 rows per entity. Compares the mapping of rdf_fastapi_utils with the
+compiled mapping (rdf_grouping) and checks that both produce the same response.
+
+    PYTHONPATH=. python benchmarks/bench_grouping.py
+"""
+import functools
+import itertools
+import json
+import os
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from intavia_backend import models_v2
+from intavia_backend.models_v2 import PaginatedResponseEntities
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "intavia_backend", "debug_5-10_22.json")
+ENTITIES = 1000
+
+
+def synthesize_rows() -> list:
+    with open(FIXTURE) as fixture:
+        entity = json.load(fixture)
+    labels = [label["default"] for label in entity["label"]]
+    events = entity["events"][:8]
+    rows = []
+    for idx in range(ENTITIES):
+        entity_id = f"{entity['id']}-{idx}"
+        occupations = [f"http://www.intavia.eu/bs/occupation/{idx % 50 + i}" for i in range(2)]
+        linked_ids = [f"{linked_id}-{idx}" for linked_id in entity["_linkedIds"]]
+        for label, occupation, linked_id, event in itertools.product(labels, occupations, linked_ids, events):
+            rows.append(
+                {
+                    "entity": entity_id,
+                    "entityTypeLabel": "person",
+                    "entityLabel": label,
+                    "gender": entity["gender"]["id"],
+                    "occupation": occupation,
+                    "occupationLabel": occupation.rsplit("/", 1)[-1],
+                    "linkedIds": linked_id,
+                    "source": entity_id,
+                    "count": ENTITIES,
+                    "event": f"{event['id']}-{idx}",
+                    "role_type": event["_source_entity_role"]["id"],
+                }
+            )
+    return rows
+
+
+def build(engine: str, rows: list) -> dict:
+    models_v2.RDF_GROUPING_ENGINE = engine
+    return PaginatedResponseEntities(**{"page": 1, "count": ENTITIES, "pages": 1, "results": rows})
+
+
+def main():
+    rows = synthesize_rows()
+    print(f"{ENTITIES} entities, {len(rows)} rows")
+    library = jsonable_encoder(build("library", rows), exclude_none=True, by_alias=True)
+    compiled = jsonable_encoder(build("compiled", rows), exclude_none=True, by_alias=True)
+    assert library == compiled, "the compiled mapping differs from rdf_fastapi_utils"
+    for engine in ("library", "compiled"):
+        seconds = min(timeit.repeat(functools.partial(build, engine, rows), number=1, repeat=3))
+        print(f"{engine:10} {seconds * 1e3:8.1f} ms {seconds / len(rows) * 1e6:6.2f} µs/row")
+
+
+if __name__ == "__main__":
+    main()
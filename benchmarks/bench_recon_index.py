@@ -0,0 +1,58 @@
+"""Benchmark of the reconciliation name index (suggest and match latency).
+
+Builds the index from 300000 synthetic persons with 1-3 names each.
+
+    PYTHONPATH=. python benchmarks/bench_recon_index.py
+"""
+import random
+import time
+
+from intavia_backend.recon import IndexEntry, NameIndex
+
+PERSONS = 300000
+SYLLABLES = ["ma", "ri", "an", "to", "ber", "gel", "lin", "son", "ka", "ne", "ur", "sch", "mi", "der", "hof", "vo"]
+
+
+def word() -> str:
+    return "".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))).capitalize()
+
+
+def synthesize_entries() -> list[IndexEntry]:
+    first = [word() for _ in range(3000)]
+    last = [word() for _ in range(30000)]
+    return [
+        IndexEntry(
+            id=f"http://example.org/person/{idx}",
+            type="Person",
+            names=[f"{random.choice(last)}, {random.choice(first)}" for _ in range(random.randint(1, 3))],
+        )
+        for idx in range(PERSONS)
+    ]
+
+
+def latencies(fn, queries: list[str]) -> str:
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1e3)
+    timings.sort()
+    return f"p50 {timings[len(timings) // 2]:6.2f} ms  p95 {timings[int(len(timings) * 0.95)]:6.2f} ms"
+
+
+def main():
+    random.seed(1)
+    entries = synthesize_entries()
+    start = time.perf_counter()
+    index = NameIndex(entries)
+    print(f"build {time.perf_counter() - start:.1f} s, {len(index.names)} names")
+    names = [random.choice(entries).names[0] for _ in range(200)]
+    print("suggest (prefix) ", latencies(lambda name: index.suggest(name[: random.randint(2, 6)]), names))
+    print(
+        "suggest (2 tokens)", latencies(lambda name: index.suggest(name.replace(",", "")[: name.index(",") + 3]), names)
+    )
+    print("match             ", latencies(lambda name: index.match(name, 5), names))
+
+
+if __name__ == "__main__":
+    main()
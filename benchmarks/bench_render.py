@@ -0,0 +1,53 @@
+"""Micro-benchmark of the per request cost of rendering a SPARQL query.
+
+Compares the former rendering (jinja environment with auto reload and
+dataclasses.asdict) with the QueryBuilder, once without and once with a hit in the
+rendered query cache.
+
+    PYTHONPATH=. python benchmarks/bench_render.py
+"""
+from dataclasses import asdict
+import dataclasses
+import os
+import timeit
+
+from jinja2 import Environment, FileSystemLoader
+
+from intavia_backend.query_builder import QueryBuilder, query_params
+from intavia_backend.query_parameters_v2 import DatasetsEnum, Search
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "..", "intavia_backend", "sparql")
+TEMPLATE = "search_v2_1.sparql"
+NUMBER = 2000
+
+
+def make_search(q: str) -> Search:
+    params = {}
+    for field in dataclasses.fields(Search):
+        default = getattr(field.default, "default", field.default)
+        params[field.name] = None if default is dataclasses.MISSING or default is Ellipsis else default
+    params.update({"q": q, "datasets": [DatasetsEnum.APIS, DatasetsEnum.SBI], "limit": 50, "page": 2})
+    return Search(**params)
+
+
+def main():
+    search = make_search("Mozart")
+    old_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=False)
+    uncached = QueryBuilder(TEMPLATE_DIR, cache_size=0)
+    uncached.preload()
+    cached = QueryBuilder(TEMPLATE_DIR, cache_size=1024)
+    cached.preload()
+    assert old_env.get_template(TEMPLATE).render(**asdict(search)) == cached.render(TEMPLATE, query_params(search))
+
+    cases = {
+        "before (get_template + asdict)": lambda: old_env.get_template(TEMPLATE).render(**asdict(search)),
+        "precompiled, cache miss": lambda: uncached.render(TEMPLATE, query_params(search)),
+        "precompiled, cache hit": lambda: cached.render(TEMPLATE, query_params(search)),
+    }
+    for name, func in cases.items():
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER
+        print(f"{name:32} {seconds * 1e6:8.1f} µs/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Load test driven by captured access logs, for a backend replaying a SPARQL recording.
+
+Record the responses of the triplestore while the production traffic (or the access log of
+it, replayed with this script) hits a backend running with SPARQL_RECORDING_MODE=record, then
+run the backend with SPARQL_RECORDING_MODE=replay (SPARQL_ENDPOINT can be left out) and replay
+the log against it. With SPARQL_REPLAY_LATENCY=none the timings are the cost of the Python
+side only (render -> flatten -> model), with `recorded` the triplestore latency is included.
+
+The log lines are parsed for `"METHOD /path?query HTTP/x"` (the access log formats of
+gunicorn, uvicorn and nginx), requests to other paths than /v1 and /v2 are skipped. Access logs
+hold no request bodies, POST requests are only replayed from JSON lines
+(`{"method": "POST", "path": "/v2/api/entities/retrieve", "body": {...}}`).
+
+`--concurrency` clients send the requests in the order of the log as fast as possible, with
+`--rate` the requests are started at a fixed rate instead (open loop, requests per second).
+Latency percentiles per route and overall are written as JSON.
+
+    SPARQL_RECORDING_MODE=replay APIS_REDIS_CACHING=False \
+        gunicorn intavia_backend.main:app -w 4 -k uvicorn.workers.UvicornWorker
+    python benchmarks/replay_traffic.py access.log --base-url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import queue
+import re
+import sys
+import threading
+import time
+
+import requests
+
+REQUEST_LINE = re.compile(r'"(GET|POST|HEAD) (/v\d+/\S*) HTTP/[\d.]+"')
+# path segments that are IDs (base64 of URLs) are replaced to group the routes
+ID_SEGMENT = re.compile(r"/[A-Za-z0-9_\-]{24,}={0,2}(?=/|$)")
+
+
+def parse_log(lines) -> tuple[list[dict], int]:
+    """Returns the requests of the log and the number of skipped lines."""
+    parsed, skipped = [], 0
+    for line in lines:
+        line = line.strip()
+        if line.startswith("{"):
+            request = json.loads(line)
+            request.setdefault("method", "GET")
+            parsed.append({"method": request["method"], "path": request["path"], "body": request.get("body")})
+            continue
+        match = REQUEST_LINE.search(line)
+        if match is None or match.group(1) == "POST":
+            skipped += 1
+            continue
+        parsed.append({"method": match.group(1), "path": match.group(2), "body": None})
+    return parsed, skipped
+
+
+def route(path: str) -> str:
+    return ID_SEGMENT.sub("/{id}", path.split("?", 1)[0])
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def summary(results: list[tuple[float, int]], wall: float | None = None) -> dict:
+    latencies = sorted(latency * 1e3 for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    res = {
+        "requests": len(results),
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else float("nan"),
+    }
+    if wall is not None:
+        res["throughput_rps"] = len(results) / wall if wall > 0 else float("nan")
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="access log or JSON lines, - for stdin")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, help="start the requests at this rate (requests per second)")
+    parser.add_argument("--limit", type=int, help="replay only the first requests of the log")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the log this many times")
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--output", default="replay_traffic.json")
+    args = parser.parse_args()
+
+    with sys.stdin if args.log == "-" else open(args.log, encoding="utf-8") as f:
+        log, skipped = parse_log(f)
+    log = log[: args.limit] * args.repeat
+    print(f"{len(log)} requests, {skipped} lines skipped")
+
+    local = threading.local()
+    results: dict[str, list[tuple[float, int]]] = {}
+    lock = threading.Lock()
+
+    def send(request: dict):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            res = local.session.request(
+                request["method"], args.base_url + request["path"], json=request["body"], timeout=args.timeout
+            )
+            _ = res.content
+            status = res.status_code
+        except requests.RequestException:
+            status = 0
+        with lock:
+            results.setdefault(route(request["path"]), []).append((time.perf_counter() - started, status))
+
+    pending = queue.Queue()
+    for request in log:
+        pending.put(request)
+
+    def worker():
+        while True:
+            try:
+                request = pending.get_nowait()
+            except queue.Empty:
+                return
+            send(request)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        if args.rate:
+            for idx, request in enumerate(log):
+                delay = started + idx / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, request)
+        else:
+            for _ in range(args.concurrency):
+                pool.submit(worker)
+    wall = time.perf_counter() - started
+
+    report = {
+        "meta": {"log": args.log, "base_url": args.base_url, "concurrency": args.concurrency, "rate": args.rate},
+        "total": summary([result for res in results.values() for result in res], wall),
+        "routes": {name: summary(res) for name, res in sorted(results.items())},
+    }
+    print(f"{'route':60} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, res in [("total", report["total"])] + list(report["routes"].items()):
+        print(f"{name[:60]:60} {res['requests']:6d} {res['p50_ms']:9.1f} {res['p95_ms']:9.1f} {res['p99_ms']:9.1f}")
+    print(f"{report['total']['throughput_rps']:.1f} requests per second, statuses {report['total']['statuses']}")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
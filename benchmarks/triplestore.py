@@ -0,0 +1,213 @@
+"""Local SPARQL endpoint standing in for the Blazegraph triplestore in the benchmarks.
+
+The TTL fixtures of intavia_backend are loaded into an in-memory rdflib dataset. They predate
+the current data model, so a few triples are added to make the v2 templates match:
+
+- the bioc namespace is rewritten from `http://www.ldf.fi/schema/bioc/` to `http://ldf.fi/schema/bioc/`
+- every person / group / place proxy gets its type (idmcore:Person_Proxy, ...) and a provided
+  entity (`idmcore:proxy_for`, `idmcore:person_proxy_for`)
+- `?proxy bioc:inheres_in ?role` is added as `?proxy bioc:bearer_of ?role`
+
+The queries are translated from the Blazegraph dialect before they are evaluated: FROM clauses
+are dropped (the default graph is the union of all graphs), named subqueries (`WITH { } AS %x`
+and `INCLUDE %x`) are inlined and the full text search (`bds:search`) is replaced by a
+case-insensitive substring filter on all search terms with a constant rank.
+
+    PYTHONPATH=. python benchmarks/triplestore.py --port 8089
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from rdflib import RDF, Dataset, Namespace, URIRef
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "..", "intavia_backend")
+# fixture file -> graph (dataset) it is loaded into
+FIXTURES = {
+    "apisdata_05-07-2022.ttl": "http://apis.acdh.oeaw.ac.at/data/v5",
+    "apisdata_07-07-2022_0-200.ttl": "http://apis.acdh.oeaw.ac.at/data/v5",
+    # the same persons in a different namespace, stands in for a second dataset
+    "apisdata_05-07-2022_edited_test.ttl": "http://www.intavia.eu/sbi",
+}
+
+BIOC = Namespace("http://ldf.fi/schema/bioc/")
+CRM = Namespace("http://www.cidoc-crm.org/cidoc-crm/")
+IDMCORE = Namespace("http://www.intavia.eu/idm-core/")
+PROVIDED = {
+    CRM.E21_Person: (IDMCORE.Person_Proxy, IDMCORE.Provided_Person, "http://www.intavia.eu/provided_person/"),
+    CRM.E74_Group: (CRM.E74_Group, IDMCORE.Provided_Group, "http://www.intavia.eu/provided_group/"),
+    CRM.E53_Place: (CRM.E53_Place, IDMCORE.Provided_Place, "http://www.intavia.eu/provided_place/"),
+}
+PROVIDED_GRAPH = "http://www.intavia.eu/graphs/provided_persons"
+
+
+def load_dataset(fixtures: dict[str, str] | None = None) -> Dataset:
+    """Loads the TTL fixtures (file name or path -> graph) and adds the triples of the current model."""
+    dataset = Dataset(default_union=True)
+    provided = dataset.graph(URIRef(PROVIDED_GRAPH))
+    for path, graph_name in (fixtures or FIXTURES).items():
+        if not os.path.isabs(path):
+            path = os.path.join(FIXTURE_DIR, path)
+        with open(path, encoding="utf-8") as f:
+            data = f.read().replace("http://www.ldf.fi/schema/bioc/", str(BIOC))
+        graph = dataset.graph(URIRef(graph_name))
+        graph.parse(data=data, format="turtle")
+        for crm_type, (proxy_type, provided_type, base) in PROVIDED.items():
+            for proxy in set(graph.subjects(RDF.type, crm_type)):
+                entity = URIRef(base + proxy.rstrip("/").rsplit("/", 1)[-1])
+                graph.add((proxy, RDF.type, proxy_type))
+                graph.add((proxy, IDMCORE.proxy_for, entity))
+                if crm_type == CRM.E21_Person:
+                    graph.add((proxy, IDMCORE.person_proxy_for, entity))
+                provided.add((entity, RDF.type, provided_type))
+        for proxy, role in list(graph.subject_objects(BIOC.inheres_in)):
+            graph.add((proxy, BIOC.bearer_of, role))
+    return dataset
+
+
+def _closing_brace(text: str, start: int) -> int:
+    """Index of the brace closing the one at `start`."""
+    depth = 0
+    in_string = False
+    for idx in range(start, len(text)):
+        char = text[idx]
+        if char == '"' and text[idx - 1] != "\\":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise ValueError("unbalanced braces")
+
+
+def _search_filter(match: re.Match) -> str:
+    variable, terms = match.group(1), match.group(2).lower().split()
+    if not terms:
+        return ""
+    return "FILTER(" + " && ".join(f'CONTAINS(LCASE(STR({variable})), "{term}")' for term in terms) + ")"
+
+
+def translate(query: str) -> str:
+    """Translates a query of the Blazegraph dialect used by the templates to SPARQL 1.1."""
+    query = re.sub(r"FROM\s+(NAMED\s+)?<[^>]*>", "", query)
+    subqueries = {}
+    while True:
+        match = re.search(r"WITH\s*\{", query)
+        if match is None:
+            break
+        end = _closing_brace(query, match.end() - 1)
+        name = re.match(r"\s*AS\s+%(\w+)", query[end + 1 :])
+        subqueries[name.group(1)] = query[match.end() : end]
+        query = query[: match.start()] + query[end + 1 + name.end() :]
+    for _ in range(len(subqueries) + 1):
+        query = re.sub(r"INCLUDE\s+%(\w+)", lambda m: "{ " + subqueries[m.group(1)] + " }", query)
+    query = re.sub(r'(\?\w+)\s+bds:search\s+"([^"]*)"\s*\.?', _search_filter, query)
+    query = re.sub(r"(\?\w+)\s+bds:(?:rank|relevance)\s+(\?\w+)\s*\.?", r"BIND(1 AS \2)", query)
+    query = re.sub(r'\?\w+\s+bds:(?:matchAllTerms|minRelevance)\s+"[^"]*"\s*\.?', "", query)
+    return query
+
+
+class StandIn:
+    """Evaluates the queries on the dataset, one at a time, and keeps count of them.
+
+    Args:
+        dataset (Dataset): the loaded fixtures
+    """
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def query(self, query: str) -> bytes:
+        with self.lock:
+            started = time.perf_counter()
+            try:
+                result = self.dataset.query(translate(query))
+                return result.serialize(format="json")
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.queries += 1
+                self.seconds += time.perf_counter() - started
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"queries": self.queries, "errors": self.errors, "seconds": self.seconds}
+
+
+def make_handler(stand_in: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _answer(self, query: str | None):
+            if not query:
+                status, body, content_type = 400, b"query missing", "text/plain"
+            else:
+                try:
+                    status, body, content_type = 200, stand_in.query(query), "application/sparql-results+json"
+                except Exception as e:
+                    logger.warning("query failed: %r", e)
+                    status, body, content_type = 400, str(e).encode("utf-8"), "text/plain"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._answer(parse_qs(urlparse(self.path).query).get("query", [None])[0])
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+            if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+                self._answer(body)
+            else:
+                self._answer(parse_qs(body).get("query", [None])[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 0, fixtures: dict[str, str] | None = None) -> tuple[ThreadingHTTPServer, StandIn]:
+    """Loads the fixtures and serves them on 127.0.0.1:`port` (0 picks a free port) in a thread.
+    The endpoint is `http://127.0.0.1:<server.server_port>/sparql`."""
+    stand_in = StandIn(load_dataset(fixtures))
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(stand_in))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="triplestore", daemon=True).start()
+    return server, stand_in
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server, stand_in = serve(args.port)
+    triples = sum(len(graph) for graph in stand_in.dataset.graphs())
+    print(f"{triples} triples, endpoint http://127.0.0.1:{server.server_port}/sparql")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Decodes the bindings of SPARQL JSON results to plain python values"""
+import datetime
+from typing import Callable
+
+from .date_bins import decimal_year
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+
+class AstronomicalDate(str):
+    """xsd:dateTime / xsd:date value that keeps its lexical form.
+
+    Other than datetime it can represent years before 1 (astronomical years, the year 0
+    is 1 BCE). The components are parsed on first access.
+    """
+
+    def _split(self) -> tuple[int, int, int]:
+        try:
+            return self._parts
+        except AttributeError:
+            pass
+        value, sign = str(self), 1
+        if value.startswith("-"):
+            value, sign = value[1:], -1
+        year, _, rest = value.partition("-")
+        self._parts = (
+            sign * int(year),
+            int(rest[0:2]) if len(rest) >= 2 else 1,
+            int(rest[3:5]) if len(rest) >= 5 else 1,
+        )
+        return self._parts
+
+    @property
+    def year(self) -> int:
+        return self._split()[0]
+
+    @property
+    def month(self) -> int:
+        return self._split()[1]
+
+    @property
+    def day(self) -> int:
+        return self._split()[2]
+
+    def iso_date(self) -> str:
+        """Returns the date part, e.g. 1756-01-27 or -0500-03-01"""
+        year, month, day = self._split()
+        return f"{'-' if year < 0 else ''}{abs(year):04d}-{month:02d}-{day:02d}"
+
+    def decimal_year(self) -> float | None:
+        return decimal_year(str(self))
+
+    def to_datetime(self) -> datetime.datetime | None:
+        """Returns the date as datetime, None if python can't represent it."""
+        if not datetime.MINYEAR <= self.year <= datetime.MAXYEAR:
+            return None
+        try:
+            return datetime.datetime.fromisoformat(str(self).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+
+
+def _to_bool(value: str) -> bool:
+    return value in ("true", "1")
+
+
+CONVERTERS: dict[str, Callable[[str], object]] = {
+    XSD + "dateTime": AstronomicalDate,
+    XSD + "date": AstronomicalDate,
+    XSD + "dateTimeStamp": AstronomicalDate,
+    XSD + "integer": int,
+    XSD + "int": int,
+    XSD + "long": int,
+    XSD + "short": int,
+    XSD + "nonNegativeInteger": int,
+    XSD + "positiveInteger": int,
+    XSD + "boolean": _to_bool,
+    XSD + "float": float,
+    XSD + "double": float,
+    XSD + "decimal": float,
+}
+
+
+def _convert(converter: Callable, value: str):
+    try:
+        return converter(value)
+    except ValueError:
+        return value
+
+
+def decode_bindings(bindings: list) -> list:
+    """Converts SPARQL JSON bindings to dicts of python values, the bindings are not modified.
+
+    Typed literals are converted by a lookup of their datatype in CONVERTERS, literals of
+    other datatypes, plain literals and IRIs are returned as string.
+    """
+    get_converter = CONVERTERS.get
+    rows = []
+    for binding in bindings:
+        row = {}
+        for variable, term in binding.items():
+            if type(term) is dict and "datatype" in term:
+                converter = get_converter(term["datatype"])
+                row[variable] = _convert(converter, term["value"]) if converter is not None else term["value"]
+            elif type(term) is dict and "value" in term:
+                row[variable] = term["value"]
+            else:
+                row[variable] = term
+        rows.append(row)
+    return rows
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from .binding_decoder import XSD, AstronomicalDate, decode_bindings
+
+
+def literal(value: str, datatype: str | None = None) -> dict:
+    res = {"type": "literal", "value": value}
+    if datatype is not None:
+        res["datatype"] = XSD + datatype
+    return res
+
+
+def test_decode_bindings():
+    bindings = [
+        {
+            "entity": {"type": "uri", "value": "http://example.org/a"},
+            "label": {"type": "literal", "value": "A", "xml:lang": "en"},
+            "count": literal("12", "integer"),
+            "score": literal("0.5", "double"),
+            "flag": literal("true", "boolean"),
+            "other": literal("x", "string"),
+            "broken": literal("n/a", "integer"),
+        }
+    ]
+    assert decode_bindings(bindings) == [
+        {
+            "entity": "http://example.org/a",
+            "label": "A",
+            "count": 12,
+            "score": 0.5,
+            "flag": True,
+            "other": "x",
+            "broken": "n/a",
+        }
+    ]
+    # the bindings are not modified
+    assert bindings[0]["count"] == literal("12", "integer")
+
+
+def test_dates():
+    date = decode_bindings([{"date": literal("1756-01-27T00:00:00Z", "dateTime")}])[0]["date"]
+    assert isinstance(date, AstronomicalDate)
+    assert date == "1756-01-27T00:00:00Z"
+    assert (date.year, date.month, date.day) == (1756, 1, 27)
+    assert date.to_datetime() == datetime.datetime(1756, 1, 27, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "value, year, iso_date",
+    [("-0500-03-01", -500, "-0500-03-01"), ("0000-01-01", 0, "0000-01-01"), ("-12000", -12000, "-12000-01-01")],
+)
+def test_bce_dates(value, year, iso_date):
+    date = AstronomicalDate(value)
+    assert date.year == year
+    assert date.iso_date() == iso_date
+    assert date.to_datetime() is None
+    assert date.decimal_year() == pytest.approx(year, abs=1)
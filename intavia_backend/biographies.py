@@ -0,0 +1,115 @@
+"""Fetches biography texts linked from the biography objects"""
+import asyncio
+from collections import OrderedDict
+import dataclasses
+import os
+import time
+
+import requests
+
+from .http_client import AsyncSession
+
+
+@dataclasses.dataclass
+class CachedText:
+    text: str
+    fetched_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class BiographyFetcher:
+    """Concurrent fetcher for biography texts with a local content cache.
+
+    Texts are cached per URL. Within `cache_ttl` seconds a cached text is served without
+    any request, afterwards it is revalidated with `If-None-Match` / `If-Modified-Since`.
+    URLs that fail or time out are returned as None, so callers get partial results.
+    The timeout is passed to requests itself, so a timed out fetch also frees its worker
+    thread and pooled connection instead of only abandoning the awaiting coroutine.
+
+    Args:
+        max_concurrency (int): maximum number of fetches in flight
+        timeout (float): timeout per URL in seconds
+        cache_ttl (float): seconds a cached text is used without revalidation
+        cache_size (int): maximum number of texts kept in the cache
+    """
+
+    def __init__(self, max_concurrency: int = 16, timeout: float = 10, cache_ttl: float = 3600, cache_size: int = 4096):
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.session = AsyncSession(
+            max_connections=max_concurrency,
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+            thread_name_prefix="biography",
+        )
+        self._cache: OrderedDict[str, CachedText] = OrderedDict()
+
+    def _cache_get(self, url: str) -> CachedText | None:
+        entry = self._cache.get(url)
+        if entry is not None:
+            self._cache.move_to_end(url)
+        return entry
+
+    def _cache_set(self, url: str, entry: CachedText):
+        self._cache[url] = entry
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def fetch(self, url: str) -> str | None:
+        """Returns the text behind `url` or None if it could not be retrieved."""
+        cached = self._cache_get(url)
+        if cached is not None and time.monotonic() - cached.fetched_at < self.cache_ttl:
+            return cached.text
+        headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+        try:
+            res = await self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            return cached.text if cached is not None else None
+        if res.status_code == 304 and cached is not None:
+            cached.fetched_at = time.monotonic()
+            return cached.text
+        if res.status_code != 200:
+            return cached.text if cached is not None else None
+        try:
+            text = res.json()["text"]
+        except (ValueError, KeyError, TypeError):
+            return cached.text if cached is not None else None
+        self._cache_set(
+            url,
+            CachedText(
+                text=text,
+                fetched_at=time.monotonic(),
+                etag=res.headers.get("ETag"),
+                last_modified=res.headers.get("Last-Modified"),
+            ),
+        )
+        return text
+
+    async def fetch_many(self, urls: list[str]) -> dict[str, str | None]:
+        """Fetches all urls concurrently and returns a mapping of url to text."""
+        urls = list(dict.fromkeys(urls))
+        texts = await asyncio.gather(*[self.fetch(url) for url in urls])
+        return dict(zip(urls, texts))
+
+    def close(self):
+        self.session.close()
+
+
+biography_fetcher = BiographyFetcher(
+    max_concurrency=int(os.environ.get("BIOGRAPHY_MAX_CONCURRENCY", 16)),
+    timeout=float(os.environ.get("BIOGRAPHY_TIMEOUT", 10)),
+    cache_ttl=float(os.environ.get("BIOGRAPHY_CACHE_TTL", 3600)),
+    cache_size=int(os.environ.get("BIOGRAPHY_CACHE_SIZE", 4096)),
+)
+
+# texts that could not be fetched are left out of the responses, the responses of the
+# biography routes are cached shortly so the missing texts are fetched again
+BIOGRAPHY_RESPONSE_EXPIRE = int(os.environ.get("BIOGRAPHY_RESPONSE_EXPIRE", 300))
@@ -0,0 +1,151 @@
+"""Chunked execution of bulk retrieve requests with long ID lists"""
+import asyncio
+from collections import defaultdict
+import logging
+import os
+import time
+import typing
+
+from .count_cache import count_cache_key, get_cached_count, set_cached_count
+from .query_builder import query_params
+from .utils import (
+    ENTITY_RETRIEVAL_MODE,
+    flatten_rdf_data,
+    get_entity_facets,
+    get_paginated_entities_from_triplestore,
+    get_paginated_query_from_triplestore,
+    get_query_from_triplestore_v2,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BulkExecutor:
+    """Splits the IDs of bulk retrieve requests into chunks that are queried concurrently.
+
+    The bulk templates order their results by ID, so the IDs are sorted before they are split:
+    every chunk covers a disjoint range of IDs and the results of the chunks, concatenated in
+    the order of the chunks, are the results of the unchunked query. The count of every chunk
+    is cached like the count of an unchunked query, the total count is their sum. A page
+    (offset `o`, limit `l`) is only queried from the chunks overlapping `[o, o + l)`, each with
+    its own offset and limit. Entities and events are paged by ID first (`_ids_only`), only the
+    entities / events of the page are retrieved.
+
+    Args:
+        chunk_size (int): maximum number of IDs per query, requests with fewer IDs are not split
+        max_concurrency (int): maximum number of chunks of a request queried at the same time
+    """
+
+    def __init__(self, chunk_size: int = 200, max_concurrency: int = 4):
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        # per template: number of chunk queries, their total and maximum latency in seconds
+        self.stats = defaultdict(lambda: {"chunks": 0, "seconds": 0.0, "max_seconds": 0.0})
+
+    def chunks(self, ids: list[str]) -> list[list[str]]:
+        ids = sorted(set(ids))
+        return [ids[i : i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+
+    async def _timed(self, sparql_template: str, params: dict) -> list:
+        started = time.perf_counter()
+        try:
+            return await get_query_from_triplestore_v2(params, sparql_template)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.stats[sparql_template]
+            stats["chunks"] += 1
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            logger.debug("%s: chunk of %d IDs in %.3f s", sparql_template, len(params["ids"]), elapsed)
+
+    async def map(self, sparql_template: str, params: dict, chunks: list[list[str]]) -> list[list]:
+        """Runs the template for every chunk, returns the bindings in the order of the chunks."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(chunk):
+            async with semaphore:
+                return await self._timed(sparql_template, {**params, "ids": chunk})
+
+        return await asyncio.gather(*(run(chunk) for chunk in chunks))
+
+    async def _counts(self, params: dict, sparql_template: str, chunks: list[list[str]], ids_only: bool) -> list[int]:
+        """Returns the count of every chunk, counts that are not cached are queried (with a limit of 1)."""
+        keys = [count_cache_key({**params, "ids": chunk}, sparql_template) for chunk in chunks]
+        counts = list(await asyncio.gather(*(get_cached_count(key) for key in keys)))
+        missing = [idx for idx, count in enumerate(counts) if count is None]
+        if len(missing) == 0:
+            return counts
+        count_params = {**params, "page": 1, "_offset": 0, "limit": 1, "_skip_count": False, "_ids_only": ids_only}
+        results = await self.map(sparql_template, count_params, [chunks[idx] for idx in missing])
+        for idx, res in zip(missing, results):
+            res = flatten_rdf_data(res)
+            counts[idx] = int(res[0]["count"]) if len(res) > 0 else 0
+            if counts[idx] > 0:
+                await set_cached_count(keys[idx], counts[idx])
+        return counts
+
+    async def _page(self, params: dict, sparql_template: str, ids_only: bool) -> tuple[int, list]:
+        offset, limit = params["_offset"], params["limit"]
+        chunks = self.chunks(params["ids"])
+        counts = await self._counts(params, sparql_template, chunks, ids_only)
+        # the part of [offset, offset + limit) covered by every chunk, in local offset / limit
+        parts, start = [], 0
+        for chunk, count in zip(chunks, counts):
+            local_offset = max(offset - start, 0)
+            local_end = min(offset + limit - start, count)
+            if local_end > local_offset:
+                parts.append((chunk, local_offset, local_end - local_offset))
+            start += count
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(chunk, local_offset, local_limit):
+            async with semaphore:
+                chunk_params = {
+                    **params,
+                    "ids": chunk,
+                    "page": 1,
+                    "_offset": local_offset,
+                    "limit": local_limit,
+                    "_skip_count": True,
+                    "_ids_only": ids_only,
+                }
+                return flatten_rdf_data(await self._timed(sparql_template, chunk_params))
+
+        results = await asyncio.gather(*(run(*part) for part in parts))
+        return sum(counts), [row for res in results for row in res]
+
+    async def paginated(self, search: typing.Any, sparql_template: str, id_key: str | None = None) -> tuple[int, list]:
+        """Paginated bulk query, a drop-in replacement of get_paginated_query_from_triplestore
+           (vocabularies, `id_key` None: the limit applies to the result rows) and of
+           get_paginated_entities_from_triplestore (`id_key` "entity") for long ID lists.
+
+        Args:
+            search (typing.Any): the search parameters including `ids`
+            sparql_template (str): name of the template, needs to support `_skip_count` and, with an
+                `id_key`, `_ids_only`
+            id_key (str | None): variable identifying an entity / event
+
+        Returns:
+            tuple[int, list]: total count and the flattened results of the page
+        """
+        params = query_params(search)
+        if len(set(params["ids"])) <= self.chunk_size:
+            if id_key == "entity":
+                return await get_paginated_entities_from_triplestore(params, sparql_template)
+            return await get_paginated_query_from_triplestore(params, sparql_template)
+        if id_key is None:
+            return await self._page(params, sparql_template, ids_only=False)
+        count, rows = await self._page(params, sparql_template, ids_only=True)
+        if id_key == "entity" and ENTITY_RETRIEVAL_MODE == "facets":
+            return count, await get_entity_facets(params, rows)
+        page_ids = list(dict.fromkeys(row[id_key] for row in rows))
+        if len(page_ids) == 0:
+            return count, []
+        page_params = {**params, "ids": page_ids, "page": 1, "_offset": 0, "limit": len(rows), "_skip_count": True}
+        return count, flatten_rdf_data(await self._timed(sparql_template, page_params))
+
+
+bulk_executor = BulkExecutor(
+    chunk_size=int(os.environ.get("BULK_CHUNK_SIZE", 200)),
+    max_concurrency=int(os.environ.get("BULK_MAX_CONCURRENCY", 4)),
+)
@@ -0,0 +1,163 @@
+"""Two tier cache backend: an in-process LRU in front of redis"""
+import asyncio
+from collections import OrderedDict
+import logging
+import sys
+import time
+import uuid
+
+from fastapi_cache.backends import Backend
+from fastapi_cache.backends.redis import RedisBackend
+
+from .timing import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Size bounded LRU cache with a TTL per entry.
+
+    The size of the cached values is tracked in bytes, the least recently used entries are
+    evicted as soon as `max_bytes` is exceeded.
+
+    Args:
+        max_bytes (int): maximum size of all cached values
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[str, tuple[str, float, float | None, int]] = OrderedDict()
+
+    def get(self, key: str) -> tuple[int, str] | None:
+        """Returns (ttl, value) or None. The ttl is the remaining lifetime of the entry
+        in the remote cache, -1 if the remote entry does not expire."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at, remote_expires_at, _ = entry
+        now = time.monotonic()
+        if now >= expires_at:
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        ttl = int(remote_expires_at - now) if remote_expires_at is not None else -1
+        return ttl, value
+
+    def set(self, key: str, value: str, ttl: float, remote_ttl: int | None = None):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        self.delete(key)
+        now = time.monotonic()
+        remote_expires_at = now + remote_ttl if remote_ttl is not None and remote_ttl > 0 else None
+        self._data[key] = (value, now + ttl, remote_expires_at, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, _, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def clear(self, prefix: str | None = None):
+        if prefix is None:
+            self._data.clear()
+            self.size = 0
+            return
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self.delete(key)
+
+
+class TwoTierBackend(Backend):
+    """fastapi-cache backend that serves hits from a local LRU before asking redis.
+
+    Values read from or written to redis are kept locally for at most `local_ttl` seconds
+    (never longer than the remaining TTL in redis). Writes and clears are announced on a
+    redis pub/sub channel, so that the other workers drop their local copies.
+
+    Args:
+        redis (Redis): redis client
+        max_bytes (int): size of the local tier, 0 disables it
+        local_ttl (float): maximum lifetime of an entry in the local tier
+        channel (str): pub/sub channel used for invalidation messages
+    """
+
+    def __init__(
+        self, redis, max_bytes: int = 64 * 1024 * 1024, local_ttl: float = 300, channel: str = "api-cache:invalidate"
+    ):
+        self.redis = redis
+        self.remote = RedisBackend(redis)
+        self.local = LocalCache(max_bytes)
+        self.local_ttl = local_ttl
+        self.channel = channel
+        self._id = uuid.uuid4().hex
+
+    def _local_ttl(self, remote_ttl: int | None) -> float:
+        if remote_ttl is not None and remote_ttl > 0:
+            return min(self.local_ttl, remote_ttl)
+        return self.local_ttl
+
+    async def _lookup(self, key: str) -> tuple[int, str, str]:
+        """Returns (ttl, value, result), result is local_hit, remote_hit or miss."""
+        hit = self.local.get(key)
+        if hit is not None:
+            return (*hit, "local_hit")
+        ttl, value = await self.remote.get_with_ttl(key)
+        if value is None:
+            return ttl, None, "miss"
+        self.local.set(key, value, self._local_ttl(ttl), ttl)
+        return ttl, value, "remote_hit"
+
+    async def get_with_ttl(self, key: str) -> tuple[int, str]:
+        # used by the cache decorator, the result is reported as the cache status of the request and
+        # counted per route in the metrics (intavia_cache_lookups_total)
+        ttl, value, result = await self._lookup(key)
+        record_cache(result)
+        return ttl, value
+
+    async def get(self, key: str) -> str:
+        return (await self._lookup(key))[1]
+
+    async def set(self, key: str, value: str, expire: int = None):
+        self.local.set(key, value, self._local_ttl(expire), expire)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, value, ex=expire)
+            pipe.publish(self.channel, f"{self._id} key {key}")
+            await pipe.execute()
+
+    async def clear(self, namespace: str = None, key: str = None) -> int:
+        if namespace:
+            self.local.clear(f"{namespace}:")
+            await self.redis.publish(self.channel, f"{self._id} namespace {namespace}:")
+        elif key:
+            self.local.delete(key)
+            await self.redis.publish(self.channel, f"{self._id} key {key}")
+        return await self.remote.clear(namespace, key)
+
+    def _invalidate(self, message: str):
+        sender, kind, target = message.split(" ", 2)
+        if sender == self._id:
+            return
+        if kind == "namespace":
+            self.local.clear(target)
+        else:
+            self.local.delete(target)
+
+    async def listen(self):
+        """Applies the invalidation messages of the other workers, reconnects on errors."""
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._invalidate(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("cache invalidation listener failed, local cache is cleared and resubscribed")
+                self.local.clear()
+                await asyncio.sleep(5)
@@ -0,0 +1,86 @@
+"""Canonical cache keys for the dataclass query parameters"""
+import dataclasses
+from enum import Enum
+import hashlib
+import json
+
+from fastapi_cache import FastAPICache
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+# derived from other parameters, e.g. _offset is computed from page and limit
+DERIVED_PARAMS = ("_offset", "_after_entity", "_after_score")
+# filters whose order and duplicates do not change the result, all other lists (e.g. the ids of
+# the bulk endpoints, which are answered in input order) are kept as sent
+SET_PARAMS = ("datasets", "kind")
+_NO_DEFAULT = object()
+
+
+def is_set_param(name: str) -> bool:
+    return name in SET_PARAMS or name.endswith("_id")
+
+
+def normalize(value, as_set: bool = False):
+    """Normalizes a parameter value for use in a cache key: enums are replaced by their
+    values, lists are deduplicated and sorted if `as_set` is True and kept as they are otherwise.
+    Values of dicts are normalized according to their keys, see `is_set_param`."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, set) or (as_set and isinstance(value, (list, tuple))):
+        items = {json.dumps(v, sort_keys=True, default=str): v for v in map(normalize, value)}
+        return [items[k] for k in sorted(items)]
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize(v, is_set_param(k)) for k, v in value.items()}
+    return value
+
+
+def _unwrap(value):
+    # the fields are declared with fastapi.Query(), the actual default is stored on the FieldInfo;
+    # it is also the value of the fields not passed when the dataclass is instantiated directly
+    return value.default if isinstance(value, FieldInfo) else value
+
+
+def _field_default(field: dataclasses.Field):
+    default = field.default
+    if default is dataclasses.MISSING:
+        return _NO_DEFAULT
+    default = _unwrap(default)
+    return _NO_DEFAULT if default is Ellipsis else default
+
+
+def canonical_params(value, name: str = ""):
+    """Returns the canonical representation of the endpoint argument `name`.
+
+    Dataclasses are reduced to the (post-processed) fields that differ from their defaults,
+    pydantic models (e.g. the RequestID body) to their normalized dict.
+    """
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        params = {}
+        for field in dataclasses.fields(value):
+            if field.name in DERIVED_PARAMS:
+                continue
+            as_set = is_set_param(field.name)
+            param = normalize(_unwrap(getattr(value, field.name)), as_set)
+            default = _field_default(field)
+            if default is not _NO_DEFAULT and param == normalize(default, as_set):
+                continue
+            params[field.name] = param
+        return params
+    if isinstance(value, BaseModel):
+        return normalize(value.dict())
+    return normalize(value, is_set_param(name))
+
+
+def canonical_key_builder(func, namespace: str = "", request=None, response=None, args=None, kwargs=None):
+    """Key builder for fastapi-cache that maps semantically identical requests to the same key
+    (`prefix:namespace:module.function:digest`). The route is kept in the key, so the entries of
+    an endpoint can be told apart in redis."""
+    route = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+    material = {
+        "args": [canonical_params(arg) for arg in args or ()],
+        "kwargs": {k: canonical_params(v, k) for k, v in (kwargs or {}).items()},
+    }
+    digest = hashlib.sha1(json.dumps(material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{FastAPICache.get_prefix()}:{namespace}:{route}:{digest}"
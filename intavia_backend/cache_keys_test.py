@@ -0,0 +1,57 @@
+import dataclasses
+
+from fastapi import Query
+
+from .cache_keys import canonical_key_builder, canonical_params, normalize
+from .query_parameters_v2 import DatasetsEnum
+
+
+@dataclasses.dataclass(kw_only=True)
+class FilterQuery:
+    datasets: list[DatasetsEnum] = Query(default=[DatasetsEnum.APIS, DatasetsEnum.BSampo])
+    kind: list[str] = Query(default=None)
+    occupations_id: list[str] = Query(default=None)
+    bin_edges: list[float] = Query(default=None)
+    limit: int = Query(default=50)
+    _offset: int = 0
+
+
+def route():
+    pass
+
+
+def key(**kwargs) -> str:
+    return canonical_key_builder(route, "test", kwargs=kwargs).rsplit(":", 1)[-1]
+
+
+def test_set_params_are_deduplicated_and_sorted():
+    a = FilterQuery(kind=["Person", "Group", "Person"], occupations_id=["b", "a"])
+    b = FilterQuery(kind=["Group", "Person"], occupations_id=["a", "b", "a"])
+    assert canonical_params(a) == canonical_params(b)
+
+
+def test_ordered_lists_are_kept_as_sent():
+    assert canonical_params(FilterQuery(bin_edges=[2.0, 1.0])) != canonical_params(FilterQuery(bin_edges=[1.0, 2.0]))
+
+
+def test_defaults_and_derived_params_are_left_out():
+    query = FilterQuery(datasets=[DatasetsEnum.BSampo, DatasetsEnum.APIS], limit=50, _offset=100)
+    assert canonical_params(query) == {}
+
+
+def test_bulk_ids_keep_order_and_duplicates():
+    assert key(ids=["b", "a"]) != key(ids=["a", "b"])
+    assert key(ids=["a", "b", "a"]) != key(ids=["a", "b"])
+    assert key(ids=["a", "b"]) == key(ids=["a", "b"])
+
+
+def test_normalize():
+    assert normalize([DatasetsEnum.BSampo, DatasetsEnum.APIS]) == [
+        "http://ldf.fi/nbf/data",
+        "http://apis.acdh.oeaw.ac.at/data/v5",
+    ]
+    assert normalize([DatasetsEnum.BSampo, DatasetsEnum.APIS], as_set=True) == [
+        "http://apis.acdh.oeaw.ac.at/data/v5",
+        "http://ldf.fi/nbf/data",
+    ]
+    assert normalize({"kind": ["b", "a", "b"], "id": ["b", "a", "b"]}) == {"kind": ["a", "b"], "id": ["b", "a", "b"]}
@@ -0,0 +1,49 @@
+"""Caches the total count of paginated queries, so that only the first page pays for the COUNT"""
+import hashlib
+import json
+import os
+
+from fastapi_cache import FastAPICache
+
+from .cache_keys import is_set_param, normalize
+from .intavia_cache import CACHING_ENABLED
+
+COUNT_CACHE_EXPIRE = int(os.environ.get("COUNT_CACHE_EXPIRE", 3600))
+PAGINATION_PARAMS = ("page", "limit", "_offset", "_skip_count", "cursor", "_after_entity", "_after_score", "_ids_only")
+
+
+def count_cache_key(params: dict, sparql_template: str) -> str:
+    """Creates the cache key for the total count of a query. All pagination parameters
+    are left out, so every page of the same filter shares the key.
+
+    Args:
+        params (dict): the parameters used to render the template
+        sparql_template (str): name of the template
+
+    Returns:
+        str: the cache key
+    """
+    normalized = {
+        k: normalize(v, is_set_param(k)) for k, v in params.items() if k not in PAGINATION_PARAMS and v is not None
+    }
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{FastAPICache.get_prefix()}:count:{sparql_template}:{digest}"
+
+
+async def get_cached_count(key: str) -> int | None:
+    if not CACHING_ENABLED:
+        return None
+    try:
+        count = await FastAPICache.get_backend().get(key)
+    except Exception:
+        return None
+    return int(count) if count is not None else None
+
+
+async def set_cached_count(key: str, count: int):
+    if not CACHING_ENABLED:
+        return
+    try:
+        await FastAPICache.get_backend().set(key, str(count), COUNT_CACHE_EXPIRE)
+    except Exception:
+        pass
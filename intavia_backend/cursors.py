@@ -0,0 +1,79 @@
+"""Opaque cursors for keyset pagination of the search endpoints"""
+import base64
+import json
+import math
+
+from fastapi import HTTPException
+
+# characters that could end the literal / IRI the cursor is rendered into
+_FORBIDDEN_CHARS = set('"\\<>\n\r')
+
+
+def encode_cursor(entity: str, score: float | None = None, offset: int = 0) -> str:
+    key = {"e": entity}
+    if score is not None:
+        key["s"] = score
+    if offset:
+        key["o"] = offset
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str) -> tuple[str, float | None, int]:
+    """Decodes a cursor to the sort key (id, score) of the last result of the previous page
+    and the number of rows of that id that were already returned.
+
+    Raises:
+        HTTPException: 400 if the cursor is not valid
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        entity, score, offset = key["e"], key.get("s"), key.get("o", 0)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (
+        not isinstance(entity, str)
+        or _FORBIDDEN_CHARS.intersection(entity)
+        or (
+            score is not None
+            and (isinstance(score, bool) or not isinstance(score, (int, float)) or not math.isfinite(score))
+        )
+        or isinstance(offset, bool)
+        or not isinstance(offset, int)
+        or offset < 0
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return entity, score, offset
+
+
+def _sort_key(row: dict, id_key: str) -> tuple:
+    return (row.get("score", 0), str(row[id_key]))
+
+
+def page_cursor(rows: list, id_key: str, limit: int, rows_limited: bool = False) -> str | None:
+    """Creates the cursor of the next page from the flattened results of a page.
+
+    Args:
+        rows (list): flattened results of the page
+        id_key (str): variable identifying an entity / event / vocabulary entry
+        limit (int): page size
+        rows_limited (bool): the LIMIT of the query applies to rows instead of distinct ids
+            (vocabulary queries). The rows of the last id might continue on the next page,
+            the cursor then also stores how many of them were already returned.
+
+    Returns:
+        str | None: the cursor, None for the last page
+    """
+    keyed = [row for row in rows if id_key in row]
+    if len(keyed) == 0:
+        return None
+    # rows merged from facet queries carry no score
+    scored = [row for row in keyed if "score" in row]
+    last = max(scored or keyed, key=lambda row: _sort_key(row, id_key))
+    if rows_limited:
+        if len(rows) < limit:
+            return None
+        offset = sum(1 for row in keyed if row[id_key] == last[id_key])
+        return encode_cursor(str(last[id_key]), offset=offset)
+    if len({row[id_key] for row in keyed}) < limit:
+        return None
+    return encode_cursor(str(last[id_key]), last.get("score"))
@@ -0,0 +1,61 @@
+import base64
+import json
+
+from fastapi import HTTPException
+import pytest
+
+from .cursors import decode_cursor, encode_cursor, page_cursor
+
+
+def raw_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("utf-8")
+
+
+def test_roundtrip():
+    assert decode_cursor(encode_cursor("http://example.org/a")) == ("http://example.org/a", None, 0)
+    assert decode_cursor(encode_cursor("http://example.org/a", 1.5, 3)) == ("http://example.org/a", 1.5, 3)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        raw_cursor([]),
+        raw_cursor({"s": 1}),
+        raw_cursor({"e": 1}),
+        raw_cursor({"e": 'a" } DROP'}),
+        raw_cursor({"e": "a>"}),
+        raw_cursor({"e": "a", "s": "1"}),
+        raw_cursor({"e": "a", "s": True}),
+        raw_cursor({"e": "a", "o": -1}),
+        raw_cursor({"e": "a", "o": 1.5}),
+        base64.urlsafe_b64encode(b'{"e": "a", "s": NaN}').decode("utf-8"),
+        base64.urlsafe_b64encode(b'{"e": "a", "s": Infinity}').decode("utf-8"),
+    ],
+)
+def test_invalid_cursors(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_page_cursor_uses_the_last_sort_key():
+    rows = [
+        {"entity": "b", "score": 2.0},
+        {"entity": "a", "score": 2.0},
+        {"entity": "c", "score": 1.0},
+        # rows of facet queries carry no score
+        {"entity": "c", "label": "C"},
+    ]
+    assert decode_cursor(page_cursor(rows, "entity", 3)) == ("b", 2.0, 0)
+
+
+def test_page_cursor_last_page():
+    assert page_cursor([], "entity", 3) is None
+    assert page_cursor([{"entity": "a"}, {"entity": "b"}], "entity", 3) is None
+
+
+def test_page_cursor_rows_limited():
+    rows = [{"id": "a"}, {"id": "b"}, {"id": "b"}]
+    assert decode_cursor(page_cursor(rows, "id", 3, rows_limited=True)) == ("b", None, 2)
+    assert page_cursor(rows[:2], "id", 3, rows_limited=True) is None
@@ -0,0 +1,149 @@
+"""Histograms of dates (birth / death statistics)
+
+Dates are converted once to decimal astronomical years (1 BCE is year 0, 2 BCE is -1),
+so dates before the year 1 can be binned as well. Bins are half-open [start, end), the
+last bin also contains its end.
+"""
+from bisect import bisect_left, bisect_right
+import datetime
+import math
+
+_CALENDAR_INTERVALS = {"year": 1, "decade": 10, "century": 100}
+_DAYS_BEFORE_MONTH = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+
+def _is_leap(year: int) -> bool:
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def _year_fraction(year: int, month: int, day: int) -> float:
+    leap = _is_leap(year)
+    day_of_year = _DAYS_BEFORE_MONTH[month - 1] + (1 if leap and month > 2 else 0) + day - 1
+    return day_of_year / (366 if leap else 365)
+
+
+# fraction of the year for "MM-DD" in common (False) and leap (True) years
+_FRACTIONS = {
+    (leap, f"{month:02d}-{day:02d}"): _year_fraction(2000 if leap else 2001, month, day)
+    for leap in (False, True)
+    for month in range(1, 13)
+    for day in range(1, 32)
+}
+
+
+def decimal_year(value: str | datetime.datetime) -> float | None:
+    """Converts an xsd:dateTime / xsd:date string (or a datetime) to a decimal year,
+    e.g. "1800-07-02T00:00:00Z" to 1800.5. Returns None if the value can't be parsed."""
+    if isinstance(value, datetime.datetime):
+        return value.year + _year_fraction(value.year, value.month, value.day)
+    if len(value) >= 10 and value[4] == "-" and value[:4].isdigit():
+        # fast path for years 0000-9999
+        year = int(value[:4])
+        fraction = _FRACTIONS.get((year % 4 == 0 and (year % 100 != 0 or year % 400 == 0), value[5:10]))
+        if fraction is not None:
+            return year + fraction
+    sign = 1
+    if value.startswith("-"):
+        sign, value = -1, value[1:]
+    year, _, rest = value.partition("-")
+    try:
+        year = sign * int(year)
+        month = int(rest[0:2]) if len(rest) >= 2 else 1
+        day = int(rest[3:5]) if len(rest) >= 5 else 1
+    except ValueError:
+        return None
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return year + _year_fraction(year, month, day)
+
+
+def from_decimal_year(value: float) -> datetime.datetime | None:
+    """Converts a decimal year back to a (UTC) datetime, None if python can't represent it."""
+    year = math.floor(value)
+    if not datetime.MINYEAR <= year <= datetime.MAXYEAR - 1:
+        return None
+    days = (value - year) * (366 if _is_leap(year) else 365)
+    return datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=days)
+
+
+def date_counts(bindings: list, date_key: str = "date", count_key: str = "count") -> tuple[list[float], list[int]]:
+    """Reads dates and counts from the SPARQL bindings.
+
+    Returns:
+        tuple[list[float], list[int]]: decimal years (sorted) and the cumulative counts
+    """
+    points = []
+    for binding in bindings:
+        if date_key not in binding:
+            continue
+        year = decimal_year(binding[date_key]["value"])
+        if year is None:
+            continue
+        points.append((year, int(binding[count_key]["value"]) if count_key in binding else 1))
+    points.sort()
+    years, cumulative, total = [], [], 0
+    for year, count in points:
+        total += count
+        years.append(year)
+        cumulative.append(total)
+    return years, cumulative
+
+
+def bin_edges(start: float, end: float, bins: int = 10, interval: str | None = None) -> list[float]:
+    """Creates the bin edges between `start` and `end`, either `bins` bins of equal width or
+    bins aligned to the calendar (interval: year, decade or century)."""
+    if interval is not None:
+        step = _CALENDAR_INTERVALS[getattr(interval, "value", interval)]
+        first = math.floor(start / step) * step
+        last = (math.floor(end / step) + 1) * step
+        return [float(edge) for edge in range(first, last + 1, step)]
+    if start == end:
+        start, end = start - 0.5, end + 0.5
+    width = (end - start) / bins
+    return [start + width * i for i in range(bins)] + [end]
+
+
+def _label(edge: float | datetime.datetime) -> str:
+    if isinstance(edge, datetime.datetime):
+        return edge.strftime("%Y")
+    return str(math.floor(edge))
+
+
+def date_histogram(
+    bindings: list, bins: int = 10, interval: str | None = None, edges: list[float] | None = None
+) -> list[dict]:
+    """Counts the dates of the SPARQL bindings (variables `date` and `count`) in bins.
+
+    Args:
+        bindings (list): SPARQL result bindings
+        bins (int): number of bins of equal width between the first and the last date
+        interval (str | None): calendar aligned bins (year, decade, century), overrides `bins`
+        edges (list[float] | None): custom bin edges in (decimal) years, overrides `bins` and `interval`
+
+    Returns:
+        list[dict]: the bins, values are datetimes if all edges can be represented, decimal years otherwise
+    """
+    years, cumulative = date_counts(bindings)
+    if edges is not None:
+        edges = sorted(edges)
+    elif len(years) == 0:
+        return []
+    else:
+        edges = bin_edges(years[0], years[-1], bins, interval)
+
+    def count_before(edge: float, inclusive: bool = False) -> int:
+        idx = bisect_right(years, edge) if inclusive else bisect_left(years, edge)
+        return cumulative[idx - 1] if idx > 0 else 0
+
+    totals = [count_before(edge) for edge in edges[:-1]] + [count_before(edges[-1], inclusive=True)]
+    values = [from_decimal_year(edge) for edge in edges]
+    if any(value is None for value in values):
+        values = edges
+    return [
+        {
+            "values": (values[i], values[i + 1]),
+            "label": f"{_label(values[i])} - {_label(values[i + 1])}",
+            "count": totals[i + 1] - totals[i],
+        }
+        for i in range(len(edges) - 1)
+    ]
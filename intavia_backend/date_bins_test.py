@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from .date_bins import bin_edges, date_histogram, decimal_year, from_decimal_year
+
+
+def binding(date: str, count: int | None = None) -> dict:
+    res = {"date": {"type": "literal", "value": date}}
+    if count is not None:
+        res["count"] = {"type": "literal", "value": str(count)}
+    return res
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1800-01-01T00:00:00Z", 1800.0),
+        ("1800-07-02", 1800 + 182 / 365),
+        ("2000-03-01", 2000 + 60 / 366),
+        ("0001-01-01", 1.0),
+        ("-0001-01-01", -1.0),
+        ("-12000", -12000.0),
+        ("12000-01-01", 12000.0),
+        ("unknown", None),
+        ("1800-13-01", None),
+    ],
+)
+def test_decimal_year(value, expected):
+    if expected is None:
+        assert decimal_year(value) is None
+    else:
+        assert decimal_year(value) == pytest.approx(expected)
+
+
+def test_decimal_year_roundtrip():
+    date = datetime.datetime(1848, 3, 13, tzinfo=datetime.timezone.utc)
+    assert abs(from_decimal_year(decimal_year(date)) - date) < datetime.timedelta(seconds=1)
+    assert from_decimal_year(-500.0) is None
+
+
+def test_calendar_bin_edges():
+    assert bin_edges(1812.5, 1839.0, interval="decade") == [1810.0, 1820.0, 1830.0, 1840.0]
+    assert bin_edges(1800.0, 1800.0, bins=2) == [1799.5, 1800.0, 1800.5]
+
+
+def test_histogram_counts_every_date_once():
+    bindings = [binding("1800-01-01", 2), binding("1810-01-01"), binding("1815-06-01", 3), binding("1820-01-01")]
+    bins = date_histogram(bindings, edges=[1800.0, 1810.0, 1820.0])
+    assert [b["count"] for b in bins] == [2, 5]
+    assert bins[0]["label"] == "1800 - 1810"
+    assert bins[0]["values"][0] == datetime.datetime(1800, 1, 1, tzinfo=datetime.timezone.utc)
+    assert sum(b["count"] for b in date_histogram(bindings, bins=3)) == 7
+
+
+def test_histogram_bce_dates():
+    bins = date_histogram([binding("-0100-01-01"), binding("0050-01-01")], edges=[-200.0, 0.0, 100.0])
+    assert [b["count"] for b in bins] == [1, 1]
+    # datetime can't represent the edges, decimal years are returned
+    assert bins[0]["values"] == (-200.0, 0.0)
+
+
+def test_histogram_without_dates():
+    assert date_histogram([{"count": {"value": "1"}}]) == []
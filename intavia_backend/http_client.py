@@ -0,0 +1,65 @@
+"""Pooled HTTP session that can be awaited from inside the FastAPI handlers"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import typing
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class AsyncSession:
+    """Keep-alive connection pool that runs blocking requests calls on a bounded executor.
+
+    The event loop only awaits the executor future, so a slow upstream never blocks other
+    requests of the worker. `max_concurrency` caps the number of requests in flight at the
+    same time, further calls queue on the executor until a slot is free.
+
+    Args:
+        max_connections (int): size of the keep-alive pool per host
+        max_concurrency (int): maximum number of requests in flight
+        timeout (float | tuple | None): default (connect, read) timeout in seconds
+        auth (tuple | None): credentials used for every request of the session
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_concurrency: int = 32,
+        timeout: float | tuple[float, float] | None = None,
+        auth: tuple[str, str] | None = None,
+        thread_name_prefix: str = "http",
+    ):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if auth is not None:
+            self.session.auth = auth
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=thread_name_prefix)
+
+    async def run(self, func: typing.Callable, *args, **kwargs):
+        """Runs `func(session, *args, **kwargs)` on the executor and awaits the result. The call
+        sees the context variables of the caller (e.g. the timings of the request)."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, func, self.session, *args, **kwargs)
+        )
+
+    async def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return await self.run(lambda session: session.request(method, url, **kwargs))
+
+    async def get(self, url: str, **kwargs) -> requests.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> requests.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
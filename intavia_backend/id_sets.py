@@ -0,0 +1,118 @@
+"""Named sets of IDs, registered once and referred to by a content hash in bulk requests"""
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IdSetTooLarge(ValueError):
+    pass
+
+
+class IdSetStore:
+    """Stores sets of IDs under the hash of their content.
+
+    The handle of a set is the sha1 of its sorted, deduplicated IDs, so registering the same
+    collection twice returns the same handle. With a redis client the sets are shared by all
+    workers and expire `ttl` seconds after their last use, the `local_size` most recently used
+    sets are kept in memory as well. Without redis the sets only live in the memory of the
+    worker.
+
+    Args:
+        redis (redis.asyncio.Redis | None): client for sharing the sets across workers
+        ttl (float): seconds a set is kept after it was last registered or used
+        max_size (int): maximum number of IDs of a set
+        local_size (int): number of sets kept in memory
+        prefix (str): prefix of the redis keys
+    """
+
+    def __init__(
+        self, redis=None, ttl: float = 86400, max_size: int = 100000, local_size: int = 256, prefix: str = "idset"
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_size = max_size
+        self.local_size = local_size
+        self.prefix = prefix
+        self._local: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+
+    @staticmethod
+    def canonical(ids: list[str]) -> list[str]:
+        return sorted(set(ids))
+
+    @staticmethod
+    def handle(ids: list[str]) -> str:
+        """Content hash of a set of IDs (the IDs are expected to be canonical)."""
+        return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+    def _remember(self, handle: str, ids: list[str]):
+        self._local[handle] = (time.monotonic() + self.ttl, ids)
+        self._local.move_to_end(handle)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def put(self, ids: list[str]) -> tuple[str, list[str]]:
+        """Registers a set of IDs.
+
+        Args:
+            ids (list[str]): the IDs, duplicates and order are ignored
+
+        Raises:
+            IdSetTooLarge: the set has more than `max_size` IDs
+
+        Returns:
+            tuple[str, list[str]]: the handle and the canonical IDs
+        """
+        ids = self.canonical(ids)
+        if len(ids) > self.max_size:
+            raise IdSetTooLarge(f"an ID set can have at most {self.max_size} IDs")
+        handle = self.handle(ids)
+        self._remember(handle, ids)
+        if self.redis is not None:
+            try:
+                await self.redis.set(f"{self.prefix}:{handle}", "\n".join(ids), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("ID set could not be stored in redis: %r", e)
+        return handle, ids
+
+    async def get(self, handle: str) -> list[str] | None:
+        """Returns the IDs of a set, None if the handle is unknown or expired."""
+        local = self._local.get(handle)
+        if local is not None and local[0] > time.monotonic():
+            self._local.move_to_end(handle)
+            if self.redis is None:
+                self._local[handle] = (time.monotonic() + self.ttl, local[1])
+            else:
+                try:
+                    await self.redis.expire(f"{self.prefix}:{handle}", int(self.ttl))
+                except Exception:
+                    pass
+            return local[1]
+        self._local.pop(handle, None)
+        if self.redis is None:
+            return None
+        try:
+            stored = await self.redis.get(f"{self.prefix}:{handle}")
+            if stored is not None:
+                await self.redis.expire(f"{self.prefix}:{handle}", int(self.ttl))
+        except Exception as e:
+            logger.warning("ID set could not be read from redis: %r", e)
+            return None
+        if stored is None:
+            return None
+        ids = stored.split("\n") if stored else []
+        self._remember(handle, ids)
+        return ids
+
+
+ID_SET_STORAGE = os.environ.get("ID_SET_STORAGE", "redis")
+ID_SET_CHUNK_SIZE = int(os.environ.get("ID_SET_CHUNK_SIZE", 2000))
+ID_SET_MAX_CONCURRENCY = int(os.environ.get("ID_SET_MAX_CONCURRENCY", 4))
+id_set_store = IdSetStore(
+    ttl=float(os.environ.get("ID_SET_TTL", 86400)),
+    max_size=int(os.environ.get("ID_SET_MAX_SIZE", 100000)),
+    local_size=int(os.environ.get("ID_SET_LOCAL_SIZE", 256)),
+)
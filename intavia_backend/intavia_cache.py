@@ -1,6 +1,14 @@
 """Wrapper around the FastApiCache-2 library"""
+from functools import wraps
+import hashlib
+import inspect
 import os
-from fastapi_cache.decorator import cache
+
+from fastapi import Request, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute, serialize_response
+from fastapi_cache import FastAPICache
+from fastapi_cache.decorator import cache as value_cache
 
 
 def nocache(*args, **kwargs):
@@ -8,8 +16,95 @@ def nocache(*args, **kwargs):
         return func
     return decorator
 
+
+async def encode_response(route: APIRoute, content) -> tuple[str, str]:
+    """Validates and serializes the return value of an endpoint like FastAPI does for the route
+    (response_model, response_model_exclude_none, ..., response_class).
+
+    Returns:
+        tuple[str, str]: media type and body
+    """
+    serialized = await serialize_response(
+        field=route.response_field,
+        response_content=content,
+        include=route.response_model_include,
+        exclude=route.response_model_exclude,
+        by_alias=route.response_model_by_alias,
+        exclude_unset=route.response_model_exclude_unset,
+        exclude_defaults=route.response_model_exclude_defaults,
+        exclude_none=route.response_model_exclude_none,
+    )
+    response_class = route.response_class
+    if isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+    response = response_class(serialized)
+    return response.media_type, response.body.decode("utf-8")
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def response_cache(expire: int | None = None, namespace: str = "response"):
+    """Caches the encoded response of an endpoint instead of its return value.
+
+    On a miss the return value is validated and serialized with the response model of the route
+    once and the body is stored together with its media type and ETag. Hits are returned as
+    `Response` with the stored body, FastAPI neither decodes nor validates them. GET requests
+    get the ETag, a matching `If-None-Match` is answered with 304 Not Modified.
+
+    The request is added to the signature of the endpoint (`_cache_request`) and not passed on.
+
+    Args:
+        expire (int | None): seconds the response is cached, defaults to the expire of FastAPICache
+        namespace (str): namespace of the cache keys
+    """
+
+    def wrapper(func):
+        @wraps(func)
+        async def inner(*args, _cache_request: Request, **kwargs):
+            if _cache_request.headers.get("Cache-Control") == "no-store" or not FastAPICache.get_enable():
+                return await func(*args, **kwargs)
+            backend = FastAPICache.get_backend()
+            key = FastAPICache.get_key_builder()(func, namespace, request=_cache_request, args=args, kwargs=kwargs)
+            _, cached = await backend.get_with_ttl(key)
+            if cached is not None:
+                etag, media_type, body = cached.split("\n", 2)
+            else:
+                ret = await func(*args, **kwargs)
+                if isinstance(ret, Response):
+                    return ret
+                media_type, body = await encode_response(_cache_request.scope["route"], ret)
+                etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+                await backend.set(key, f"{etag}\n{media_type}\n{body}", expire or FastAPICache.get_expire())
+            if _cache_request.method != "GET":
+                return Response(body, media_type=media_type)
+            if etag_matches(_cache_request.headers.get("If-None-Match"), etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            return Response(body, media_type=media_type, headers={"ETag": etag})
+
+        signature = inspect.signature(func)
+        parameters = list(signature.parameters.values())
+        request = inspect.Parameter("_cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        var_keyword = [idx for idx, param in enumerate(parameters) if param.kind == param.VAR_KEYWORD]
+        parameters.insert(var_keyword[0] if var_keyword else len(parameters), request)
+        inner.__signature__ = signature.replace(parameters=parameters)
+        return inner
+
+    return wrapper
+
+
 # I have an .env file, and my get_settings() reads the .env file
-if os.environ.get("APIS_REDIS_CACHING", "True") == "True":
-    cache = cache
+CACHING_ENABLED = os.environ.get("APIS_REDIS_CACHING", "True") == "True"
+# bytes: the encoded responses are cached (response_cache), value: the return values of the
+# endpoints, they are validated against the response model on every hit
+RESPONSE_CACHE_MODE = os.environ.get("RESPONSE_CACHE_MODE", "bytes")
+if not CACHING_ENABLED:
+    cache = nocache
+elif RESPONSE_CACHE_MODE == "bytes":
+    cache = response_cache
 else:
-    cache = nocache
\ No newline at end of file
+    cache = value_cache
@@ -1,14 +1,25 @@
+import asyncio
 import os
 import aioredis
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi_versioning import VersionedFastAPI
 import sentry_sdk
 from .main_v1 import router as router_v1
 from .main_v2 import router as router_v2
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
 from fastapi_cache.decorator import cache
+from .biographies import biography_fetcher
+from .cache_backends import TwoTierBackend
+from .cache_keys import canonical_key_builder
+from .id_sets import ID_SET_STORAGE, id_set_store
+from .query_builder import query_builder
+from .recon import RECON_INDEX_ENABLED, recon_index
+from .statistics_store import STATISTICS_STORE_ENABLED, statistics_store
+from .timing import METRICS_ENABLED, METRICS_STORAGE, Metrics, TimingMiddleware, metrics
+from .tracing import TRACE_BUFFER_SIZE, trace_recorder, trace_sampler
+from .utils import SPARQL_SINGLE_FLIGHT, single_flight, sparql
 
 
 app = FastAPI(
@@ -26,10 +37,9 @@ origins = ["*"]
 
 sentry_sdk.init(
     dsn="https://936a6c77abda4ced81e17cd4e27906a7@o4504360778661888.ingest.sentry.io/4504361556574208",
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    # We recommend adjusting this value in production,
-    traces_sample_rate=1.0,
+    # a share of the requests is traced, slow and erroring requests are always sent, see tracing.TraceSampler
+    traces_sampler=trace_sampler.traces_sampler,
+    before_send_transaction=trace_sampler.before_send_transaction,
 )
 
 
@@ -38,10 +48,43 @@ app = VersionedFastAPI(app, version_format="{major}", prefix_format="/v{major}")
 
 @app.on_event("startup")
 async def startup():
+    query_builder.preload()
     redis = aioredis.from_url(
         f"redis://{os.environ.get('REDIS_HOST', 'localhost')}", encoding="utf8", decode_responses=True, db=1
     )
-    FastAPICache.init(RedisBackend(redis), prefix="api-cache")
+    backend = TwoTierBackend(
+        redis,
+        max_bytes=int(os.environ.get("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024)),
+        local_ttl=float(os.environ.get("CACHE_LOCAL_TTL", 300)),
+    )
+    FastAPICache.init(backend, prefix="api-cache", key_builder=canonical_key_builder)
+    app.state.cache_listener = asyncio.create_task(backend.listen())
+    if SPARQL_SINGLE_FLIGHT == "redis":
+        single_flight.redis = redis
+    if ID_SET_STORAGE == "redis":
+        id_set_store.redis = redis
+    if RECON_INDEX_ENABLED:
+        app.state.recon_index_loader = asyncio.create_task(recon_index.run())
+    if STATISTICS_STORE_ENABLED:
+        app.state.statistics_loader = asyncio.create_task(statistics_store.run())
+    if METRICS_STORAGE == "redis":
+        metrics.redis = redis
+    if METRICS_ENABLED:
+        app.state.metrics_flusher = asyncio.create_task(metrics.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.cache_listener.cancel()
+    if RECON_INDEX_ENABLED:
+        app.state.recon_index_loader.cancel()
+    if STATISTICS_STORE_ENABLED:
+        app.state.statistics_loader.cancel()
+    if METRICS_ENABLED:
+        app.state.metrics_flusher.cancel()
+        await metrics.flush()
+    sparql.close()
+    biography_fetcher.close()
 
 
 app.add_middleware(
@@ -51,3 +94,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+if METRICS_ENABLED or TRACE_BUFFER_SIZE > 0:
+    app.add_middleware(
+        TimingMiddleware,
+        metrics=metrics if METRICS_ENABLED else None,
+        recorder=trace_recorder if TRACE_BUFFER_SIZE > 0 else None,
+    )
+
+if METRICS_ENABLED:
+
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """Prometheus metrics of the request pipeline, see timing.METRICS"""
+        return PlainTextResponse(Metrics.render(await metrics.collect()), media_type="text/plain; version=0.0.4")
+
+
+if TRACE_BUFFER_SIZE > 0:
+
+    @app.get("/debug/traces", include_in_schema=False)
+    async def get_traces(slow: bool = False, route: str | None = None, min_duration_ms: float = 0, limit: int = 50):
+        """Timings of the recent (or the recent slow and erroring) requests of the worker, newest first"""
+        return trace_recorder.summaries(slow=slow, route=route, min_duration=min_duration_ms / 1e3, limit=limit)
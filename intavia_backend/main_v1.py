@@ -1,12 +1,14 @@
 import datetime
 import aioredis
 from tkinter import W
-from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query
+from fastapi.responses import HTMLResponse
 from fastapi_versioning import VersionedFastAPI, version, versioned_api_route
 from .models_v1 import (
     PaginatedResponseEntities,
     PaginatedResponseOccupations,
     ReconResponse,
+    ReconSuggestResponse,
     StatisticsBins,
     StatisticsOccupationReturn,
 )
@@ -15,7 +17,7 @@ import os
 from jinja2 import Environment, FileSystemLoader
 import os.path
 from .conversion import convert_sparql_result
-from .query_parameters import Entity_Retrieve, ReconQueryBatch, Search, SearchVocabs, StatisticsBase
+from .query_parameters import Entity_Retrieve, ReconQueryBatch, ReconTypeEnum, Search, SearchVocabs, StatisticsBase
 import sentry_sdk
 from dataclasses import asdict
 import dateutil
@@ -23,10 +25,14 @@ import dateutil
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 from .intavia_cache import cache
+from .occupation_tree import build_occupation_tree
+from .models_v2 import BASE_URL
+from .recon import RECON_INDEX_ENABLED, RECON_PROPERTIES, preview_html, recon_executor, recon_index
+from .timing import TimedRoute
 from .utils import get_query_from_triplestore
 
 
-router = APIRouter(route_class=versioned_api_route(1, 0))
+router = APIRouter(route_class=versioned_api_route(1, 0, route_class=TimedRoute))
 tags_metadata = [
     {"name": "Query endpoints", "description": "Endpoints used to query and filter the InTaVia Knowledgegraph"}
 ]
@@ -63,7 +69,7 @@ def calculate_date_range(start, end, intv):
         different.",
 )
 async def query_entities(search: Search = Depends()):
-    res = get_query_from_triplestore(search, "search_v3.sparql")
+    res = await get_query_from_triplestore(search, "search_v3.sparql")
     pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
     count = int(res[0]["count"]) if len(res) > 0 else 0
     return {"page": search.page, "count": count, "pages": pages, "results": flatten_rdf_data(res)}
@@ -80,7 +86,7 @@ async def query_entities(search: Search = Depends()):
 )
 @cache()
 async def query_occupations(search: SearchVocabs = Depends()):
-    res = get_query_from_triplestore(search, "occupation_v1.sparql")
+    res = await get_query_from_triplestore(search, "occupation_v1.sparql")
     start = (search.page * search.limit) - search.limit
     end = start + search.limit
     return {"page": search.page, "count": len(res), "pages": math.ceil(len(res) / search.limit), "results": res}
@@ -94,7 +100,7 @@ async def query_occupations(search: SearchVocabs = Depends()):
 )
 @cache()
 async def statistics_birth(search: StatisticsBase = Depends()):
-    res = get_query_from_triplestore(search, "statistics_birthdate_v1.sparql")
+    res = await get_query_from_triplestore(search, "statistics_birthdate_v1.sparql")
     for idx, v in enumerate(res):
         res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
     bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
@@ -114,7 +120,7 @@ async def statistics_birth(search: StatisticsBase = Depends()):
 )
 @cache()
 async def statistics_death(search: StatisticsBase = Depends()):
-    res = get_query_from_triplestore(search, "statistics_deathdate_v1.sparql")
+    res = await get_query_from_triplestore(search, "statistics_deathdate_v1.sparql")
     for idx, v in enumerate(res):
         res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
     bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
@@ -134,30 +140,21 @@ async def statistics_death(search: StatisticsBase = Depends()):
 )
 @cache()
 async def statistics_occupations(search: StatisticsBase = Depends()):
-    res = get_query_from_triplestore(search, "statistics_occupation_v1.sparql")
-    data = res
-    data_fin = {"id": "root", "label": "root", "count": 0, "children": []}
-    data_second = []
-    for idx, occ in enumerate(data):
-        if "broader" not in occ:
-            if isinstance(occ["label"], list):
-                occ["label"] = " / ".join(occ["label"])
-            elif ">>" in occ["label"]:
-                occ["label"] = occ["label"].split(" >> ")[-1]
-            data_fin["children"].append({"id": occ["id"], "label": occ["label"], "count": occ["count"], "children": []})
-        else:
-            data_second.append(occ)
-    while len(data_second) > 0:
-        for idx, occ in enumerate(data_second):
-            for child in data_fin["children"]:
-                if child["id"] == occ["broader"]["id"]:
-                    if isinstance(occ["label"], list):
-                        occ["label"] = " / ".join(occ["label"])
-                    elif ">>" in occ["label"]:
-                        occ["label"] = occ["label"].split(" >> ")[-1]
-                    child["children"].append({"id": occ["id"], "label": occ["label"], "count": occ["count"]})
-                    data_second.pop(idx)
-                    break
+    res = await get_query_from_triplestore(search, "statistics_occupation_v1.sparql")
+    occupations = [
+        {
+            "id": occ["id"],
+            "label": occ["label"],
+            "count": occ["count"],
+            "broader_id": occ["broader"]["id"] if "broader" in occ else None,
+            "broader_label": occ["broader"].get("label") if "broader" in occ else None,
+        }
+        for occ in res
+    ]
+    data_fin = build_occupation_tree(occupations)
+    for child in data_fin["children"]:
+        if child["children"] is None:
+            child["children"] = []
     return {"tree": data_fin}
 
 
@@ -170,13 +167,14 @@ async def statistics_occupations(search: StatisticsBase = Depends()):
 )
 @cache()
 async def retrieve_entity(search: Entity_Retrieve = Depends()):
-    res = get_query_from_triplestore(search, "get_entity_v1.sparql", "search_v3.sparql")
+    res = await get_query_from_triplestore(search, "get_entity_v1.sparql", "search_v3.sparql")
     pages = math.ceil(int(res[0]["_count"]) / search.limit) if len(res) > 0 else 0
     count = int(res[0]["_count"]) if len(res) > 0 else 0
     return {"page": search.page, "count": count, "pages": pages, "results": res}
 
 
 RECON_MAX_BATCH_SIZE = 50
+RECON_SERVICE_URL = f"{BASE_URL}/v1"
 
 
 @router.get(
@@ -184,7 +182,7 @@ RECON_MAX_BATCH_SIZE = 50
     tags=["Reconciliation"],
 )
 async def recon_manifest():
-    return {
+    manifest = {
         "versions": ["0.1"],
         "name": "InTaVia",
         "identifierSpace": "http://www.intavia.eu/idm-core/",
@@ -195,9 +193,78 @@ async def recon_manifest():
             {"id": "Group", "name": "Group"},
             {"id": "Place", "name": "Place"},
         ],
+        "suggest": {
+            "type": {"service_url": RECON_SERVICE_URL, "service_path": "/recon/suggest/type"},
+            "property": {"service_url": RECON_SERVICE_URL, "service_path": "/recon/suggest/property"},
+        },
+    }
+    # entity suggest and preview are served from the name index
+    if RECON_INDEX_ENABLED:
+        manifest["suggest"]["entity"] = {"service_url": RECON_SERVICE_URL, "service_path": "/recon/suggest/entity"}
+        manifest["preview"] = {"url": RECON_SERVICE_URL + "/recon/preview?id={{id}}", "width": 400, "height": 100}
+    return manifest
+
+
+@router.get(
+    "/recon/suggest/entity",
+    response_model=ReconSuggestResponse,
+    response_model_exclude_none=True,
+    tags=["Reconciliation"],
+    description="Type-ahead search for entities, served from the reconciliation name index (RECON_INDEX_ENABLED).",
+)
+async def recon_suggest_entity(
+    prefix: str,
+    type: ReconTypeEnum | None = None,
+    cursor: int = Query(default=0, ge=0),
+    limit: int = Query(default=10, ge=1, le=100),
+):
+    entries = recon_index.suggest(prefix, type, limit=cursor + limit)[cursor:]
+    return {"result": [{"id": e.id, "name": e.names[0], "description": e.description} for e in entries]}
+
+
+@router.get(
+    "/recon/suggest/type",
+    response_model=ReconSuggestResponse,
+    response_model_exclude_none=True,
+    tags=["Reconciliation"],
+)
+async def recon_suggest_type(prefix: str = ""):
+    return {
+        "result": [
+            {"id": t.value, "name": t.value} for t in ReconTypeEnum if t.value.lower().startswith(prefix.lower())
+        ]
+    }
+
+
+@router.get(
+    "/recon/suggest/property",
+    response_model=ReconSuggestResponse,
+    response_model_exclude_none=True,
+    tags=["Reconciliation"],
+    description="Properties that can be used to constrain reconciliation queries.",
+)
+async def recon_suggest_property(prefix: str = ""):
+    return {
+        "result": [
+            {"id": pid, "name": name}
+            for pid, name in RECON_PROPERTIES.items()
+            if pid.lower().startswith(prefix.lower()) or name.lower().startswith(prefix.lower())
+        ]
     }
 
 
+@router.get(
+    "/recon/preview",
+    response_class=HTMLResponse,
+    tags=["Reconciliation"],
+)
+async def recon_preview(id: str):
+    entry = recon_index.get(id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return HTMLResponse(preview_html(entry))
+
+
 @router.post(
     "/recon/reconcile",
     response_model=ReconResponse,
@@ -208,16 +275,5 @@ async def recon_manifest():
 async def recon(payload: ReconQueryBatch = Depends()):
     if len(payload.queries.queries) > RECON_MAX_BATCH_SIZE:
         raise HTTPException(status_code=413, detail="Maximum batch size is " + str(RECON_MAX_BATCH_SIZE))
-    results = []
-    response = {"results": results}
-    for reconQuery in payload.queries.queries:
-        if reconQuery.type.get_rdf_uri() in ["<http://www.intavia.eu/idm-core/Provided_Person>"]:
-            res = get_query_from_triplestore(reconQuery, "recon_provided_person_v1_1.sparql")
-        else:
-            res = get_query_from_triplestore(reconQuery, "recon_crm_v1_1.sparql")
-        batch_results = []
-        for r in res:
-            batch_results.append({"id": r["id"], "name": r["label"], "score": r["score"]})
-        results.append({"candidates": batch_results})
-    print(response)
-    return response
+    candidates = await recon_executor.reconcile(payload.queries.queries)
+    return {"results": [{"candidates": c} for c in candidates]}
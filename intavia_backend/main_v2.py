@@ -1,16 +1,17 @@
-from dataclasses import asdict
-import datetime
+import json
 import math
-import dateutil
-from fastapi import APIRouter, Depends, HTTPException
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from .intavia_cache import cache
-import requests
 
 from fastapi_versioning import version, versioned_api_route
 from intavia_backend.models_v2 import (
     Biography,
     Entity,
     Event,
+    IdSet,
     MediaResource,
     PaginatedResponseBiography,
     PaginatedResponseEntities,
@@ -18,6 +19,7 @@ from intavia_backend.models_v2 import (
     PaginatedResponseMedia,
     PaginatedResponseVocabularyEntries,
     StatisticsBins,
+    StatisticsCombined,
     StatisticsOccupationPrelim,
     StatisticsOccupationPrelimList,
     StatisticsOccupationReturn,
@@ -27,6 +29,8 @@ from intavia_backend.models_v2 import (
 from intavia_backend.query_parameters_v2 import (
     Base,
     Entity_Retrieve,
+    ExportFormatEnum,
+    OccupationTreeQuery,
     QueryBase,
     RequestID,
     Search,
@@ -37,44 +41,147 @@ from intavia_backend.query_parameters_v2 import (
     SearchVocabs,
     StatisticsBase,
     StatisticsBinsQuery,
+    StatisticsFacetsQuery,
+    StatisticsSearch,
+)
+from .biographies import BIOGRAPHY_RESPONSE_EXPIRE, biography_fetcher
+from .bulk import bulk_executor
+from .cursors import page_cursor
+from .date_bins import date_histogram
+from .id_sets import ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY, IdSetTooLarge, id_set_store
+from .occupation_tree import build_occupation_tree
+from .query_builder import query_params
+from .statistics_store import DEATH_DATE_BOUNDS, STATISTICS_STORE_ENABLED, statistics_store, unfiltered
+from .timing import TimedRoute
+from .utils import (
+    ENTITY_RETRIEVAL_MODE,
+    flatten_rdf_data,
+    get_chunked_counts_from_triplestore,
+    get_entity_facets,
+    get_paginated_entities_from_triplestore,
+    get_paginated_query_from_triplestore,
+    get_query_from_triplestore_v2,
+    iter_query_pages,
+    toggle_urls_encoding,
 )
-from .utils import create_bins_from_range, flatten_rdf_data, get_query_from_triplestore_v2, toggle_urls_encoding
 
-router = APIRouter(route_class=versioned_api_route(2, 0))
+router = APIRouter(route_class=versioned_api_route(2, 0, route_class=TimedRoute))
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 500))
+EXPORT_MEDIA_TYPES = {ExportFormatEnum.ndjson: "application/x-ndjson", ExportFormatEnum.json: "application/json"}
+
+
+async def request_ids(
+    ids: RequestID | None = None,
+    idset: str
+    | None = Query(
+        default=None,
+        description="Handle of an ID set registered with `/api/idsets`, used instead of or together with the IDs \
+            of the body.",
+    ),
+) -> list[str]:
+    """Returns the IDs of a bulk request: the IDs of the body and / or of a registered ID set."""
+    if idset is None:
+        if ids is None:
+            raise HTTPException(status_code=422, detail="Either a body with IDs or an idset is required")
+        return ids.id
+    found = await id_set_store.get(idset)
+    if found is None:
+        raise HTTPException(status_code=404, detail="ID set not found")
+    if ids is None:
+        return found
+    return list(dict.fromkeys(found + ids.id))
+
+
+async def stream_export(search, sparql_template, model, id_key, export_format):
+    """Pages through all results of a search and yields them serialized with the same
+    model conversion as the paginated endpoints. Only one chunk is held in memory."""
+    separator = "\n" if export_format == ExportFormatEnum.ndjson else ",\n"
+    first = True
+    if export_format == ExportFormatEnum.json:
+        yield "["
+    async for rows in iter_query_pages(search, sparql_template, EXPORT_CHUNK_SIZE, id_key):
+        chunk = model(**{"results": rows})
+        items = [json.dumps(jsonable_encoder(item, exclude_none=True, by_alias=True)) for item in chunk.results]
+        if not items:
+            continue
+        if export_format == ExportFormatEnum.ndjson:
+            yield separator.join(items) + separator
+        else:
+            yield ("" if first else separator) + separator.join(items)
+        first = False
+    if export_format == ExportFormatEnum.json:
+        yield "]"
 
 
-def create_bins_occupations(res):
+def create_bins_occupations(res, tree: OccupationTreeQuery | None = None):
     res = StatisticsOccupationPrelimList(**{"results": res})
-    data = res.dict()["results"]
-    data_fin = {"id": "root", "label": "root", "count": 0, "children": []}
-    data_second = []
-    for idx, occ in enumerate(data):
-        if occ["broader"] is None:
-            if isinstance(occ["label"], list):
-                occ["label"] = " / ".join(occ["label"])
-            elif ">>" in occ["label"]:
-                occ["label"] = occ["label"].split(" >> ")[-1]
-            if data_fin["children"] is None:
-                data_fin["children"] = []
-            data_fin["children"].append(
-                {"id": occ["id"], "label": occ["label"], "count": occ["count"], "children": None}
-            )
-        else:
-            data_second.append(occ)
-    while len(data_second) > 0:
-        for idx, occ in enumerate(data_second):
-            for child in data_fin["children"]:
-                if child["id"] == occ["broader"][0]["id"]:
-                    if isinstance(occ["label"], list):
-                        occ["label"] = " / ".join(occ["label"])
-                    elif ">>" in occ["label"]:
-                        occ["label"] = occ["label"].split(" >> ")[-1]
-                    if child["children"] is None:
-                        child["children"] = []
-                    child["children"].append({"id": occ["id"], "label": occ["label"], "count": occ["count"]})
-                    data_second.pop(idx)
-                    break
-    return data_fin
+    occupations = [
+        {
+            "id": occ["id"],
+            "label": occ["label"],
+            "count": occ["count"],
+            "broader_id": occ["broader"][0]["id"] if occ["broader"] else None,
+            "broader_label": occ["broader"][0]["label"] if occ["broader"] else None,
+        }
+        for occ in res.dict()["results"]
+    ]
+    if tree is None:
+        return build_occupation_tree(occupations)
+    return build_occupation_tree(occupations, rollup=tree.rollup, min_count=tree.min_count, max_depth=tree.max_depth)
+
+
+async def get_statistics_from_triplestore(search, facets: list, sparql_template: str) -> list:
+    """Returns the bindings of a statistics query. Searches without a filter are answered from
+       the precomputed statistics once they are loaded.
+
+    Args:
+        search: the search parameters
+        facets (list): the facets of the statistics store that answer the query
+        sparql_template (str): name of the template used otherwise
+
+    Returns:
+        list: the SPARQL bindings
+    """
+    if STATISTICS_STORE_ENABLED and statistics_store.ready and unfiltered(search):
+        return statistics_store.bindings(facets, search.datasets)
+    return await get_query_from_triplestore_v2(query_params(search), sparql_template)
+
+
+def combine_statistics(res: list, search: StatisticsFacetsQuery) -> dict:
+    """Splits the bindings of statistics_v2_1.sparql by the `facet` variable and computes
+       the statistics of the requested facets.
+
+    Args:
+        res (list): the SPARQL bindings
+        search (StatisticsFacetsQuery): the requested facets, bins and occupation tree parameters
+
+    Returns:
+        dict: the statistics keyed on the facet
+    """
+    by_facet = {facet.value: [] for facet in search.facets}
+    for binding in res:
+        facet = binding.get("facet", {}).get("value")
+        if facet in by_facet:
+            by_facet[facet].append(binding)
+    statistics = {}
+    if "occupations" in by_facet:
+        statistics["occupations"] = {"tree": create_bins_occupations(flatten_rdf_data(by_facet["occupations"]), search)}
+    for facet in ("birth_dates", "death_dates"):
+        if facet in by_facet:
+            statistics[facet] = {
+                "bins": date_histogram(
+                    by_facet[facet], bins=search.bins, interval=search.bin_interval, edges=search.bin_edges
+                )
+            }
+    if "entity_types" in by_facet:
+        statistics["entity_types"] = {
+            ent["entityTypeLabel"]: ent["count"]
+            for ent in flatten_rdf_data(by_facet["entity_types"])
+            # without matching entities the count of the empty group is returned
+            if "entityTypeLabel" in ent
+        }
+    return statistics
 
 
 @router.get(
@@ -88,11 +195,26 @@ def create_bins_occupations(res):
 )
 @cache()
 async def query_events(search: SearchEvents = Depends()):
-    res = get_query_from_triplestore_v2(search, "search_events_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
-    return {"page": search.page, "count": count, "pages": pages, "results": res}
+    count, res = await get_paginated_query_from_triplestore(search, "search_events_v2_1.sparql")
+    pages = math.ceil(count / search.limit)
+    cursor = page_cursor(res, "event", search.limit)
+    return {"page": search.page, "count": count, "pages": pages, "cursor": cursor, "results": res}
+
+
+@router.get(
+    "/api/events/export",
+    tags=["Events endpoints"],
+    description="Endpoint that streams all events matching the search as NDJSON (one event per line) \
+    or as a JSON array. `page` and `limit` are ignored.",
+)
+async def export_events(
+    search: SearchEvents = Depends(),
+    export_format: ExportFormatEnum = Query(default=ExportFormatEnum.ndjson, alias="format"),
+):
+    return StreamingResponse(
+        stream_export(search, "search_events_v2_1.sparql", PaginatedResponseEvents, "event", export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+    )
 
 
 @router.post(
@@ -104,15 +226,13 @@ async def query_events(search: SearchEvents = Depends()):
 )
 @cache()
 async def bulk_retrieve_events(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_events_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / query.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    count, res = await bulk_executor.paginated(query_dict, "bulk_retrieve_events_v2_1.sparql", id_key="event")
+    pages = math.ceil(count / query.limit)
     return {"page": query.page, "count": count, "pages": pages, "results": res}
 
 
@@ -129,9 +249,9 @@ async def retrieve_event_v2(event_id: str, query: Base = Depends()):
         event_id = toggle_urls_encoding(event_id)
     except:
         raise HTTPException(status_code=404, detail="Item not found")
-    query_dict = asdict(query)
+    query_dict = query_params(query)
     query_dict["event_id"] = event_id
-    res = get_query_from_triplestore_v2(query_dict, "get_event_v2_1.sparql")
+    res = await get_query_from_triplestore_v2(query_dict, "get_event_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -149,11 +269,26 @@ async def retrieve_event_v2(event_id: str, query: Base = Depends()):
 )
 @cache()
 async def query_entities(search: Search = Depends()):
-    res = get_query_from_triplestore_v2(search, "search_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
-    return {"page": search.page, "count": count, "pages": pages, "results": res}
+    count, res = await get_paginated_entities_from_triplestore(search, "search_v2_1.sparql")
+    pages = math.ceil(count / search.limit)
+    cursor = page_cursor(res, "entity", search.limit)
+    return {"page": search.page, "count": count, "pages": pages, "cursor": cursor, "results": res}
+
+
+@router.get(
+    "/api/entities/export",
+    tags=["Entities endpoints"],
+    description="Endpoint that streams all entities matching the search as NDJSON (one entity per line) \
+    or as a JSON array. `page` and `limit` are ignored.",
+)
+async def export_entities(
+    search: Search = Depends(),
+    export_format: ExportFormatEnum = Query(default=ExportFormatEnum.ndjson, alias="format"),
+):
+    return StreamingResponse(
+        stream_export(search, "search_v2_1.sparql", PaginatedResponseEntities, "entity", export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+    )
 
 
 @router.post(
@@ -165,15 +300,13 @@ async def query_entities(search: Search = Depends()):
 )
 @cache()
 async def bulk_retrieve_entities(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_entities_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / query.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    count, res = await bulk_executor.paginated(query_dict, "bulk_retrieve_entities_v2_1.sparql", id_key="entity")
+    pages = math.ceil(count / query.limit)
     return {"page": query.page, "count": count, "pages": pages, "results": res}
 
 
@@ -190,9 +323,14 @@ async def retrieve_entity_v2(entity_id: str, query: Base = Depends()):
         entity_id = toggle_urls_encoding(entity_id)
     except:
         raise HTTPException(status_code=404, detail="Item not found")
-    query_dict = asdict(query)
+    query_dict = query_params(query)
+    if ENTITY_RETRIEVAL_MODE == "facets":
+        res = await get_entity_facets(query_dict, [{"entity": entity_id}], require_core=True)
+        if len(res) == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+        return {"_results": res}
     query_dict["entity_id"] = entity_id
-    res = get_query_from_triplestore_v2(query_dict, "get_entity_v2_1.sparql")
+    res = await get_query_from_triplestore_v2(query_dict, "get_entity_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -208,15 +346,15 @@ async def retrieve_entity_v2(entity_id: str, query: Base = Depends()):
 )
 @cache()
 async def bulk_retrieve_media_objects(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
     # res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_entities_v2_1.sparql")
     # res = flatten_rdf_data(res)
     res = []
-    for url in ids.id:
+    for url in ids:
         id = toggle_urls_encoding(url)
         res.append({"id": id, "url": url})
     pages = math.ceil(len(res) / query.limit) if len(res) > 0 else 0
@@ -253,28 +391,25 @@ async def retrieve_media(media_id: str, query: Base = Depends()):
     tags=["Entities endpoints"],
     description="Endpoint that allows to bulk retrieve biography objects when IDs are known.",
 )
-@cache()
+@cache(expire=BIOGRAPHY_RESPONSE_EXPIRE)
 async def bulk_retrieve_biography_objects(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_biographies_v2_1.sparql")
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    res = await get_query_from_triplestore_v2(query_dict, "bulk_retrieve_biographies_v2_1.sparql")
     res = flatten_rdf_data(res)
+    texts = await biography_fetcher.fetch_many([r[key] for r in res for key in ("bioText", "bioAbstract") if key in r])
     fin = []
     for r in res:
         r_fin = {"id": toggle_urls_encoding(r["bioID"])}
         if "bioText" in r:
-            r1 = requests.get(r["bioText"])
-            if r1.status_code == 200:
-                r_fin["text"] = r1.json()["text"]
+            r_fin["text"] = texts[r["bioText"]]
         elif "biotext" in r:
             r_fin["text"] = r["biotext"]
         if "bioAbstract" in r:
-            r2 = requests.get(r["bioAbstract"])
-            if r2.status_code == 200:
-                r_fin["abstract"] = r2.json()["text"]
+            r_fin["abstract"] = texts[r["bioAbstract"]]
         fin.append(r_fin)
     pages = math.ceil(len(res) / query.limit) if len(res) > 0 else 0
     count = len(res)
@@ -288,30 +423,29 @@ async def bulk_retrieve_biography_objects(
     tags=["Entities endpoints"],
     description="Endpoint that allows to retrive a biography object by id.",
 )
-@cache()
+@cache(expire=BIOGRAPHY_RESPONSE_EXPIRE)
 async def retrieve_biography(biography_id: str, query: Base = Depends()):
     try:
         biography_id_decoded = toggle_urls_encoding(biography_id)
     except:
         raise HTTPException(status_code=404, detail="Item not found")
-    query_dict = asdict(query)
+    query_dict = query_params(query)
     query_dict["bioID"] = biography_id_decoded
-    res = get_query_from_triplestore_v2(query_dict, "get_biography_v2_1.sparql")
+    res = await get_query_from_triplestore_v2(query_dict, "get_biography_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
 
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     fin = {"id": biography_id}
+    texts = await biography_fetcher.fetch_many(
+        [res[0][key]["value"] for key in ("bioText", "bioAbstract") if key in res[0]]
+    )
     if "bioText" in res[0]:
-        r1 = requests.get(res[0]["bioText"]["value"])
-        if r1.status_code == 200:
-            fin["text"] = r1.json()["text"]
+        fin["text"] = texts[res[0]["bioText"]["value"]]
     elif "biotext" in res[0]:
         fin["text"] = res[0]["biotext"]["value"]
     if "bioAbstract" in res[0]:
-        r2 = requests.get(res[0]["bioAbstract"]["value"])
-        if r2.status_code == 200:
-            fin["abstract"] = r2.json()["text"]
+        fin["abstract"] = texts[res[0]["bioAbstract"]["value"]]
     return fin
 
 
@@ -324,11 +458,10 @@ async def retrieve_biography(biography_id: str, query: Base = Depends()):
 )
 @cache()
 async def query_occupations(search: SearchVocabs = Depends()):
-    res = get_query_from_triplestore_v2(search, "occupation_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
-    return {"page": search.page, "count": count, "pages": pages, "results": res}
+    count, res = await get_paginated_query_from_triplestore(search, "occupation_v2_1.sparql")
+    pages = math.ceil(count / search.limit)
+    cursor = page_cursor(res, "vocabulary", search.limit, rows_limited=True)
+    return {"page": search.page, "count": count, "pages": pages, "cursor": cursor, "results": res}
 
 
 @router.get(
@@ -345,9 +478,9 @@ async def retrieve_occupation_v2(occupation_id: str, query: Base = Depends()):
         occupation_id = toggle_urls_encoding(occupation_id)
     except:
         raise HTTPException(status_code=404, detail="Item not found")
-    query_dict = asdict(query)
+    query_dict = query_params(query)
     query_dict["occupation_id"] = occupation_id
-    res = get_query_from_triplestore_v2({"occupation_id": occupation_id}, "occupation_retrieve_v2_1.sparql")
+    res = await get_query_from_triplestore_v2({"occupation_id": occupation_id}, "occupation_retrieve_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -363,15 +496,13 @@ async def retrieve_occupation_v2(occupation_id: str, query: Base = Depends()):
 )
 @cache()
 async def bulk_retrieve_voc_occupations(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_occupations_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / query.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    count, res = await bulk_executor.paginated(query_dict, "bulk_retrieve_occupations_v2_1.sparql")
+    pages = math.ceil(count / query.limit)
     return {"page": query.page, "count": count, "pages": pages, "results": res}
 
 
@@ -384,11 +515,10 @@ async def bulk_retrieve_voc_occupations(
 )
 @cache()
 async def query_event_roles(search: SearchVocabs = Depends()):
-    res = get_query_from_triplestore_v2(search, "event_role_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
-    return {"page": search.page, "count": count, "pages": pages, "results": res}
+    count, res = await get_paginated_query_from_triplestore(search, "event_role_v2_1.sparql")
+    pages = math.ceil(count / search.limit)
+    cursor = page_cursor(res, "vocabulary", search.limit, rows_limited=True)
+    return {"page": search.page, "count": count, "pages": pages, "cursor": cursor, "results": res}
 
 
 @router.get(
@@ -406,9 +536,9 @@ async def retrieve_event_role_v2(event_role_id: str, query: Base = Depends()):
         raise HTTPException(status_code=404, detail="Item not found")
     if event_role_id == "http://www.cidoc-crm.org/cidoc-crm/P7_took_place_at":
         return {"_results": [{"vocabulary": event_role_id, "vocabulary_label": "took place at"}]}
-    query_dict = asdict(query)
+    query_dict = query_params(query)
     query_dict["event_role_id"] = event_role_id
-    res = get_query_from_triplestore_v2(query_dict, "event_role_retrieve_v2_1.sparql")
+    res = await get_query_from_triplestore_v2(query_dict, "event_role_retrieve_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -425,15 +555,13 @@ async def retrieve_event_role_v2(event_role_id: str, query: Base = Depends()):
 )
 @cache()
 async def bulk_retrieve_voc_event_roles(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_event_role_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / query.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    count, res = await bulk_executor.paginated(query_dict, "bulk_retrieve_event_role_v2_1.sparql")
+    pages = math.ceil(count / query.limit)
     return {"page": query.page, "count": count, "pages": pages, "results": res}
 
 
@@ -446,11 +574,10 @@ async def bulk_retrieve_voc_event_roles(
 )
 @cache()
 async def query_event_kind(search: SearchEventKindVocab = Depends()):
-    res = get_query_from_triplestore_v2(search, "event_kind_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / search.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
-    return {"page": search.page, "count": count, "pages": pages, "results": res}
+    count, res = await get_paginated_query_from_triplestore(search, "event_kind_v2_1.sparql")
+    pages = math.ceil(count / search.limit)
+    cursor = page_cursor(res, "vocabulary", search.limit, rows_limited=True)
+    return {"page": search.page, "count": count, "pages": pages, "cursor": cursor, "results": res}
 
 
 @router.get(
@@ -466,9 +593,9 @@ async def retrieve_event_kind_v2(event_kind_id: str, query: Base = Depends()):
         event_kind_id = toggle_urls_encoding(event_kind_id)
     except:
         raise HTTPException(status_code=404, detail="Item not found")
-    query_dict = asdict(query)
+    query_dict = query_params(query)
     query_dict["event_kind_id"] = event_kind_id
-    res = get_query_from_triplestore_v2(query_dict, "event_kind_retrieve_v2_1.sparql")
+    res = await get_query_from_triplestore_v2(query_dict, "event_kind_retrieve_v2_1.sparql")
     # res = FakeList(**{"results": flatten_rdf_data(res)})
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -484,15 +611,13 @@ async def retrieve_event_kind_v2(event_kind_id: str, query: Base = Depends()):
 )
 @cache()
 async def bulk_retrieve_voc_event_kinds(
-    ids: RequestID,
+    ids: list[str] = Depends(request_ids),
     query: QueryBase = Depends(),
 ):
-    query_dict = asdict(query)
-    query_dict["ids"] = ids.id
-    res = get_query_from_triplestore_v2(query_dict, "bulk_retrieve_event_kind_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    pages = math.ceil(int(res[0]["count"]) / query.limit) if len(res) > 0 else 0
-    count = int(res[0]["count"]) if len(res) > 0 else 0
+    query_dict = query_params(query)
+    query_dict["ids"] = ids
+    count, res = await bulk_executor.paginated(query_dict, "bulk_retrieve_event_kind_v2_1.sparql")
+    pages = math.ceil(count / query.limit)
     return {"page": query.page, "count": count, "pages": pages, "results": res}
 
 
@@ -505,9 +630,9 @@ async def bulk_retrieve_voc_event_kinds(
 )
 @cache()
 async def statistics_occupations(search: SearchOccupationsStats = Depends()):
-    res = get_query_from_triplestore_v2(search, "statistics_occupation_v2_1.sparql")
+    res = await get_statistics_from_triplestore(search, ["occupations"], "statistics_occupation_v2_1.sparql")
     res = flatten_rdf_data(res)
-    data_fin = create_bins_occupations(res)
+    data_fin = create_bins_occupations(res, search)
     return {"tree": data_fin}
 
 
@@ -519,10 +644,12 @@ async def statistics_occupations(search: SearchOccupationsStats = Depends()):
     description="Endpoint that returns counts of the occupations for known IDs",
 )
 @cache()
-async def statistics_occupations_bulk(ids: RequestID):
-    res = get_query_from_triplestore_v2({"ids": ids.id}, "statistics_occupation_v2_1.sparql")
+async def statistics_occupations_bulk(ids: list[str] = Depends(request_ids), tree: OccupationTreeQuery = Depends()):
+    res = await get_chunked_counts_from_triplestore(
+        {}, "statistics_occupation_v2_1.sparql", ids, ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY
+    )
     res = flatten_rdf_data(res)
-    data_fin = create_bins_occupations(res)
+    data_fin = create_bins_occupations(res, tree)
     return {"tree": data_fin}
 
 
@@ -535,18 +662,8 @@ async def statistics_occupations_bulk(ids: RequestID):
 )
 @cache()
 async def statistics_death(search: StatisticsBase = Depends()):
-    res = get_query_from_triplestore_v2(search, "statistics_deathdate_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    for idx, v in enumerate(res):
-        if not isinstance(res[idx]["date"], datetime.datetime):
-            res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
-    bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
-    for idx, b in enumerate(bins):
-        for date in res:
-            if b["values"][0] <= date["date"] <= b["values"][1]:
-                b["count"] += date["count"]
-        bins[idx] = b
-    return {"bins": bins}
+    res = await get_statistics_from_triplestore(search, [DEATH_DATE_BOUNDS], "statistics_deathdate_v2_1.sparql")
+    return {"bins": date_histogram(res, bins=search.bins, interval=search.bin_interval, edges=search.bin_edges)}
 
 
 @router.post(
@@ -557,21 +674,13 @@ async def statistics_death(search: StatisticsBase = Depends()):
     description="Endpoint that returns counts in bins for date of death of known IDs",
 )
 @cache()
-async def statistics_death_bulk(ids: RequestID, search: StatisticsBinsQuery = Depends()):
-    res = get_query_from_triplestore_v2({"ids": ids.id}, "statistics_deathdate_v2_1.sparql")
+async def statistics_death_bulk(ids: list[str] = Depends(request_ids), search: StatisticsBinsQuery = Depends()):
+    res = await get_chunked_counts_from_triplestore(
+        {}, "statistics_deathdate_v2_1.sparql", ids, ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY
+    )
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Items not found")
-    res = flatten_rdf_data(res)
-    for idx, v in enumerate(res):
-        if not isinstance(res[idx]["date"], datetime.datetime):
-            res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
-    bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
-    for idx, b in enumerate(bins):
-        for date in res:
-            if b["values"][0] <= date["date"] <= b["values"][1]:
-                b["count"] += date["count"]
-        bins[idx] = b
-    return {"bins": bins}
+    return {"bins": date_histogram(res, bins=search.bins, interval=search.bin_interval, edges=search.bin_edges)}
 
 
 @router.get(
@@ -583,18 +692,8 @@ async def statistics_death_bulk(ids: RequestID, search: StatisticsBinsQuery = De
 )
 @cache()
 async def statistics_birth(search: StatisticsBase = Depends()):
-    res = get_query_from_triplestore_v2(search, "statistics_birthdate_v2_1.sparql")
-    res = flatten_rdf_data(res)
-    for idx, v in enumerate(res):
-        if not isinstance(res[idx]["date"], datetime.datetime):
-            res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
-    bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
-    for idx, b in enumerate(bins):
-        for date in res:
-            if b["values"][0] <= date["date"] <= b["values"][1]:
-                b["count"] += date["count"]
-        bins[idx] = b
-    return {"bins": bins}
+    res = await get_statistics_from_triplestore(search, ["birth_dates"], "statistics_birthdate_v2_1.sparql")
+    return {"bins": date_histogram(res, bins=search.bins, interval=search.bin_interval, edges=search.bin_edges)}
 
 
 @router.post(
@@ -605,21 +704,13 @@ async def statistics_birth(search: StatisticsBase = Depends()):
     description="Endpoint that returns counts in bins for date of birth of known IDs",
 )
 @cache()
-async def statistics_birth_bulk(ids: RequestID, search: StatisticsBinsQuery = Depends()):
-    res = get_query_from_triplestore_v2({"ids": ids.id}, "statistics_birthdate_v2_1.sparql")
+async def statistics_birth_bulk(ids: list[str] = Depends(request_ids), search: StatisticsBinsQuery = Depends()):
+    res = await get_chunked_counts_from_triplestore(
+        {}, "statistics_birthdate_v2_1.sparql", ids, ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY
+    )
     if len(res) == 0:
         raise HTTPException(status_code=404, detail="Items not found")
-    res = flatten_rdf_data(res)
-    for idx, v in enumerate(res):
-        if not isinstance(res[idx]["date"], datetime.datetime):
-            res[idx]["date"] = dateutil.parser.parse(res[idx]["date"][:10])
-    bins = create_bins_from_range(res[0]["date"], res[-1]["date"], search.bins)
-    for idx, b in enumerate(bins):
-        for date in res:
-            if b["values"][0] <= date["date"] <= b["values"][1]:
-                b["count"] += date["count"]
-        bins[idx] = b
-    return {"bins": bins}
+    return {"bins": date_histogram(res, bins=search.bins, interval=search.bin_interval, edges=search.bin_edges)}
 
 
 @router.get(
@@ -631,7 +722,7 @@ async def statistics_birth_bulk(ids: RequestID, search: StatisticsBinsQuery = De
 )
 @cache()
 async def statistics_entity_type(search: Search = Depends()):
-    res = get_query_from_triplestore_v2(search, "statistics_entity_types_v2_1.sparql")
+    res = await get_statistics_from_triplestore(search, ["entity_types"], "statistics_entity_types_v2_1.sparql")
     res = flatten_rdf_data(res)
     res_fin = {}
     for ent in res:
@@ -647,10 +738,74 @@ async def statistics_entity_type(search: Search = Depends()):
     description="Endpoint that returns counts of entity types",
 )
 @cache()
-async def statistics_entity_type_bulk(ids: RequestID):
-    res = get_query_from_triplestore_v2({"ids": ids.id}, "statistics_entity_types_v2_1.sparql")
+async def statistics_entity_type_bulk(ids: list[str] = Depends(request_ids)):
+    res = await get_chunked_counts_from_triplestore(
+        {}, "statistics_entity_types_v2_1.sparql", ids, ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY
+    )
     res = flatten_rdf_data(res)
     res_fin = {}
     for ent in res:
         res_fin[ent["entityTypeLabel"]] = ent["count"]
-    return res_fin
\ No newline at end of file
+    return res_fin
+
+
+@router.get(
+    "/api/statistics/search",
+    response_model=StatisticsCombined,
+    response_model_exclude_none=True,
+    tags=["Statistics"],
+    description="Endpoint that returns the occupation tree, birth and death date bins and entity type counts \
+        of the entities found in one response. The filter is evaluated once for all statistics. The death dates \
+        count the begin of the time-span of a death only, unlike /api/statistics/death_dates/search.",
+)
+@cache()
+async def statistics_combined(search: StatisticsSearch = Depends()):
+    res = await get_statistics_from_triplestore(search, search.facets, "statistics_v2_1.sparql")
+    return combine_statistics(res, search)
+
+
+@router.post(
+    "/api/statistics/bulk",
+    response_model=StatisticsCombined,
+    response_model_exclude_none=True,
+    tags=["Statistics"],
+    description="Endpoint that returns the occupation tree, birth and death date bins and entity type counts \
+        of known IDs in one response.",
+)
+@cache()
+async def statistics_combined_bulk(ids: list[str] = Depends(request_ids), search: StatisticsFacetsQuery = Depends()):
+    res = await get_chunked_counts_from_triplestore(
+        query_params(search), "statistics_v2_1.sparql", ids, ID_SET_CHUNK_SIZE, ID_SET_MAX_CONCURRENCY
+    )
+    return combine_statistics(res, search)
+
+
+@router.post(
+    "/api/idsets",
+    response_model=IdSet,
+    response_model_exclude_none=True,
+    tags=["ID sets"],
+    description="Registers a set of IDs. The returned handle can be passed as `idset` to the bulk retrieve and \
+        statistics endpoints instead of sending the IDs again. The handle is a hash of the IDs, registering the \
+        same IDs returns the same handle.",
+)
+async def register_id_set(ids: RequestID):
+    try:
+        handle, ids = await id_set_store.put(ids.id)
+    except IdSetTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return {"idset": handle, "count": len(ids)}
+
+
+@router.get(
+    "/api/idsets/{idset}",
+    response_model=IdSet,
+    response_model_exclude_none=True,
+    tags=["ID sets"],
+    description="Returns the IDs of a registered ID set.",
+)
+async def retrieve_id_set(idset: str):
+    ids = await id_set_store.get(idset)
+    if ids is None:
+        raise HTTPException(status_code=404, detail="ID set not found")
+    return {"idset": idset, "count": len(ids), "ids": ids}
@@ -421,6 +421,7 @@ class ReconCandidate(BaseModel):
     id: str
     name: str
     score: float
+    match: bool = False
 
 
 class ReconCandidates(BaseModel):
@@ -431,15 +432,11 @@ class ReconResponse(BaseModel):
     results: list[ReconCandidates]
 
 
-class ReconCandidate(BaseModel):
+class ReconSuggestion(BaseModel):
     id: str
     name: str
-    score: float
-
-
-class ReconCandidates(BaseModel):
-    candidates: list[ReconCandidate]
+    description: str | None = None
 
 
-class ReconResponse(BaseModel):
-    results: list[ReconCandidates]
+class ReconSuggestResponse(BaseModel):
+    result: list[ReconSuggestion]
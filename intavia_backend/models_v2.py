@@ -5,8 +5,10 @@ import os
 import re
 import typing
 from geojson_pydantic import Point, Polygon
-from pydantic import BaseModel, Field, HttpUrl, NonNegativeInt, PositiveInt
+from pydantic import BaseModel, Field, HttpUrl, NonNegativeInt, PositiveInt, ValidationError
 from rdf_fastapi_utils.models import FieldConfigurationRDF, RDFUtilsModelBaseClass
+from .binding_decoder import AstronomicalDate
+from .rdf_grouping import RDF_GROUPING_ENGINE, map_data
 
 BASE_URL = os.getenv("BASE_URL", "http://intavia-backend.acdh-dev.oeaw.ac.at")
 
@@ -113,7 +115,12 @@ def pp_label_list(field, item, data):
 
 
 def convert_date_to_iso8601(field, item, data):
-    if isinstance(item, datetime.datetime):
+    if isinstance(item, AstronomicalDate):
+        try:
+            return item.iso_date()
+        except ValueError:
+            return str(item)
+    elif isinstance(item, datetime.datetime):
         return item.isoformat().split("T")[0]
     else:
         return item
@@ -202,6 +209,17 @@ class IntaViaBackendBaseModel(RDFUtilsModelBaseClass):
         RDF_utils_error_field_name = "errors"
         RDF_utils_move_errors_to_top = True
 
+    def __init__(__pydantic_self__, **data: typing.Any) -> None:
+        if RDF_GROUPING_ENGINE == "compiled":
+            try:
+                values = map_data(type(__pydantic_self__), data)
+                BaseModel.__init__(__pydantic_self__, **values)
+                return
+            except ValidationError:
+                # leave invalid data to the error handling of rdf_fastapi_utils
+                pass
+        super().__init__(**data)
+
 
 class LinkedId(IntaViaBackendBaseModel):
     label: str
@@ -241,7 +259,7 @@ class Biography(BaseModel):
     id: str
     title: str | None = None
     abstract: str | None = None
-    text: str
+    text: str | None = Field(None, description="null if the text could not be retrieved from its source")
     citation: str | None = None
 
 
@@ -356,6 +374,7 @@ class PaginatedResponseBase(IntaViaBackendBaseModel):
     count: NonNegativeInt = 0
     page: NonNegativeInt = 0
     pages: NonNegativeInt = 0
+    cursor: str | None = None
 
 
 class PaginatedResponseEntities(PaginatedResponseBase):
@@ -414,9 +433,7 @@ class StatisticsOccupationReturn(BaseModel):
 class Bin(BaseModel):
     label: str
     count: int
-    values: typing.Tuple[
-        typing.Union[int, float, datetime.datetime], typing.Union[int, float, datetime.datetime]
-    ] | None = None
+    values: typing.Tuple[typing.Union[float, datetime.datetime], typing.Union[float, datetime.datetime]] | None = None
     order: PositiveInt | None = None
 
 
@@ -437,6 +454,19 @@ class StatsEntityType(BaseModel):
         allow_population_by_field_name = True
 
 
+class IdSet(BaseModel):
+    idset: str
+    count: int
+    ids: list[str] | None = None
+
+
+class StatisticsCombined(BaseModel):
+    occupations: StatisticsOccupationReturn | None = None
+    birth_dates: StatisticsBins | None = None
+    death_dates: StatisticsBins | None = None
+    entity_types: StatsEntityType | None = None
+
+
 EntityEventRelation.update_forward_refs()
 Event.update_forward_refs()
 Entity.update_forward_refs()
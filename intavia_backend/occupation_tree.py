@@ -0,0 +1,113 @@
+"""Builds the occupation tree of the occupation statistics"""
+import dataclasses
+
+
+@dataclasses.dataclass(eq=False)
+class OccupationNode:
+    id: str
+    label: str
+    count: int = 0
+    broader_id: str | None = None
+    broader_label: str | None = None
+    children: list["OccupationNode"] = dataclasses.field(default_factory=list)
+
+
+def normalize_label(label: str | list) -> str:
+    if isinstance(label, list):
+        return " / ".join(label)
+    if ">>" in label:
+        return label.split(" >> ")[-1]
+    return label
+
+
+def build_occupation_tree(
+    occupations: list[dict], rollup: bool = False, min_count: int = 0, max_depth: int | None = None
+) -> dict:
+    """Builds the occupation tree in one pass over the occupations.
+
+    Occupations without broader occupation are attached to the root. If the broader occupation
+    of an occupation is not part of the results, a node for it (with count 0) is added to the
+    root. Occupations in a cycle of broader occupations are attached to the root as well.
+
+    Args:
+        occupations (list[dict]): occupations with `id`, `label`, `count` and optionally
+            `broader_id` / `broader_label`
+        rollup (bool): add the counts of all descendants to the count of an occupation
+        min_count (int): remove occupations (including their children) with a lower count
+        max_depth (int | None): remove occupations deeper than `max_depth` (the children of
+            the root have depth 1)
+
+    Returns:
+        dict: the tree, nodes have `id`, `label`, `count` and `children` (None for leaves,
+            always a list for the root)
+    """
+    root = OccupationNode(id="root", label="root")
+    nodes: dict[str, OccupationNode] = {}
+    for occ in occupations:
+        if occ["id"] in nodes:
+            continue
+        broader_id = occ.get("broader_id")
+        nodes[occ["id"]] = OccupationNode(
+            id=occ["id"],
+            label=normalize_label(occ["label"]),
+            count=occ["count"],
+            broader_id=broader_id if broader_id != occ["id"] else None,
+            broader_label=occ.get("broader_label"),
+        )
+    for node in list(nodes.values()):
+        if node.broader_id is None:
+            root.children.append(node)
+            continue
+        parent = nodes.get(node.broader_id)
+        if parent is None:
+            # orphan: the broader occupation is not part of the results
+            parent = nodes[node.broader_id] = OccupationNode(
+                id=node.broader_id, label=normalize_label(node.broader_label or node.broader_id)
+            )
+            root.children.append(parent)
+        parent.children.append(node)
+
+    # everything not reachable from the root is part of a cycle
+    reachable = set()
+
+    def mark(start: OccupationNode):
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node.id in reachable:
+                continue
+            reachable.add(node.id)
+            stack.extend(node.children)
+
+    mark(root)
+    for node in nodes.values():
+        if node.id not in reachable:
+            nodes[node.broader_id].children.remove(node)
+            root.children.append(node)
+            mark(node)
+
+    tree = _to_dict(root, rollup, min_count, max_depth)
+    tree["children"] = tree["children"] or []
+    return tree
+
+
+def _to_dict(root: OccupationNode, rollup: bool, min_count: int, max_depth: int | None) -> dict:
+    # iterative post-order, the trees can be deep
+    result = {}
+    stack = [(root, 0, False)]
+    while stack:
+        node, depth, visited = stack.pop()
+        if not visited:
+            stack.append((node, depth, True))
+            if max_depth is None or depth < max_depth or rollup:
+                stack.extend((child, depth + 1, False) for child in reversed(node.children))
+            continue
+        children = [result.pop(id(child)) for child in node.children if id(child) in result]
+        count = node.count
+        if rollup:
+            count += sum(child["count"] for child in children)
+        if max_depth is not None and depth >= max_depth:
+            children = []
+        children = [child for child in children if child["count"] >= min_count]
+        result[id(node)] = {"id": node.id, "label": node.label, "count": count, "children": children or None}
+    return result[id(root)]
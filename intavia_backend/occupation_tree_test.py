@@ -0,0 +1,52 @@
+from .occupation_tree import build_occupation_tree
+
+
+def occ(id: str, count: int, broader_id: str | None = None, label: str | None = None, **kwargs) -> dict:
+    res = {"id": id, "label": label or id, "count": count, **kwargs}
+    if broader_id is not None:
+        res["broader_id"] = broader_id
+    return res
+
+
+def shape(node: dict) -> tuple:
+    return (node["id"], node["count"], tuple(shape(child) for child in node["children"] or ()))
+
+
+def test_tree():
+    tree = build_occupation_tree([occ("c", 1, "b"), occ("b", 2, "a"), occ("a", 3), occ("d", 4)])
+    assert shape(tree) == ("root", 0, (("a", 3, (("b", 2, (("c", 1, ()),)),)), ("d", 4, ())))
+    assert tree["children"][1]["children"] is None
+
+
+def test_orphans_and_cycles_are_attached_to_the_root():
+    tree = build_occupation_tree(
+        [occ("a", 1, "missing", broader_label="Missing"), occ("x", 1, "y"), occ("y", 2, "x"), occ("s", 1, "s")]
+    )
+    assert shape(tree) == (
+        "root",
+        0,
+        (("missing", 0, (("a", 1, ()),)), ("s", 1, ()), ("x", 1, (("y", 2, ()),))),
+    )
+    assert tree["children"][0]["label"] == "Missing"
+
+
+def test_rollup_min_count_and_max_depth():
+    occupations = [occ("a", 1), occ("b", 2, "a"), occ("c", 3, "b")]
+    assert shape(build_occupation_tree(occupations, rollup=True)) == (
+        "root",
+        6,
+        (("a", 6, (("b", 5, (("c", 3, ()),)),)),),
+    )
+    assert shape(build_occupation_tree(occupations, rollup=True, max_depth=1)) == ("root", 6, (("a", 6, ()),))
+    assert shape(build_occupation_tree(occupations, min_count=2)) == ("root", 0, ())
+
+
+def test_deep_tree():
+    occupations = [occ("0", 1)] + [occ(str(i), 1, str(i - 1)) for i in range(1, 5000)]
+    tree = build_occupation_tree(occupations, rollup=True)
+    assert tree["children"][0]["count"] == 5000
+
+
+def test_labels():
+    tree = build_occupation_tree([occ("a", 1, label="Arts >> Painter"), occ("b", 1, label=["Maler", "Painter"])])
+    assert [child["label"] for child in tree["children"]] == ["Painter", "Maler / Painter"]
@@ -0,0 +1,76 @@
+"""Renders the SPARQL templates, templates are compiled once and rendered queries are memoized"""
+from collections import OrderedDict
+import dataclasses
+import hashlib
+import os
+
+from jinja2 import Environment, FileSystemLoader, Template
+
+
+def query_params(search) -> dict:
+    """Returns the parameters of a query dataclass as a dict. Other than dataclasses.asdict
+    the values are not deep-copied, the templates only read them."""
+    if isinstance(search, dict):
+        return dict(search)
+    return {field.name: getattr(search, field.name) for field in dataclasses.fields(search)}
+
+
+class QueryBuilder:
+    """Renders SPARQL queries from the jinja templates in `template_dir`.
+
+    Templates are compiled once (there is no check for changes on disk, restart the
+    workers after changing a template) and the last `cache_size` rendered queries are
+    kept, keyed on the template and the parameters.
+
+    Args:
+        template_dir (str): directory of the templates
+        cache_size (int): number of rendered queries kept, 0 disables the memoization
+    """
+
+    def __init__(self, template_dir: str, cache_size: int = 1024):
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir), autoescape=False, auto_reload=False, cache_size=-1
+        )
+        self.cache_size = cache_size
+        self._templates: dict[str, Template] = {}
+        self._rendered: OrderedDict[tuple[str, str], str] = OrderedDict()
+
+    def preload(self):
+        """Compiles all templates, to be called at startup."""
+        for name in self.env.list_templates(extensions=["sparql"]):
+            self.template(name)
+
+    def template(self, name: str) -> Template:
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = self.env.get_template(name)
+        return template
+
+    def render(self, sparql_template: str, params: dict) -> str:
+        """Renders `sparql_template` with `params`.
+
+        Args:
+            sparql_template (str): name of the template
+            params (dict): the template parameters
+
+        Returns:
+            str: the SPARQL query
+        """
+        if self.cache_size <= 0:
+            return self.template(sparql_template).render(**params)
+        # repr keeps the types apart (e.g. an enum and its value render differently)
+        key = (sparql_template, hashlib.sha1(repr(sorted(params.items())).encode("utf-8")).hexdigest())
+        query = self._rendered.get(key)
+        if query is not None:
+            self._rendered.move_to_end(key)
+            return query
+        query = self._rendered[key] = self.template(sparql_template).render(**params)
+        if len(self._rendered) > self.cache_size:
+            self._rendered.popitem(last=False)
+        return query
+
+
+query_builder = QueryBuilder(
+    os.path.join(os.path.dirname(__file__), "sparql"),
+    cache_size=int(os.environ.get("QUERY_RENDER_CACHE_SIZE", 1024)),
+)
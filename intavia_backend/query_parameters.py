@@ -128,11 +128,18 @@ class ReconTypeEnum(str, Enum):
         return map[self.name]
 
 
+@dataclasses.dataclass(kw_only=True)
+class ReconProperty(Base):
+    pid: str
+    v: typing.Any
+
+
 @dataclasses.dataclass(kw_only=True)
 class ReconQuery(Base):
     query: str
     limit: int
     type: ReconTypeEnum = Query(default=ReconTypeEnum.Person, description="Filter for returned entity type.")
+    properties: list[ReconProperty] | None = None
 
 
 @dataclasses.dataclass(kw_only=True)
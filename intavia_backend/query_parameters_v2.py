@@ -1,11 +1,12 @@
 import dataclasses
 from enum import Enum
 import typing
-from fastapi import Query
+from fastapi import HTTPException, Query
 from pydantic import BaseModel, HttpUrl, PositiveInt
 from dateutil.parser import parse
 import datetime
 import base64
+from .cursors import decode_cursor
 from .models_v2 import EntityType
 
 
@@ -44,6 +45,24 @@ class GenderqueryEnum(str, Enum):
     unknown = "unknown"
 
 
+class ExportFormatEnum(str, Enum):
+    ndjson = "ndjson"
+    json = "json"
+
+
+class BinIntervalEnum(str, Enum):
+    year = "year"
+    decade = "decade"
+    century = "century"
+
+
+class StatisticsFacetEnum(str, Enum):
+    occupations = "occupations"
+    birth_dates = "birth_dates"
+    death_dates = "death_dates"
+    entity_types = "entity_types"
+
+
 class ReconTypeEnum(str, Enum):
     Person = "Person"
     Group = "Group"
@@ -72,6 +91,9 @@ class Base:
         ],
     )
 
+    def __post_init__(self):
+        pass
+
 
 @dataclasses.dataclass(kw_only=True)
 class QueryBase(Base):
@@ -84,6 +106,25 @@ class QueryBase(Base):
             self._offset = (self.page - 1) * self.limit
 
 
+@dataclasses.dataclass(kw_only=True)
+class CursorQueryBase(QueryBase):
+    cursor: str = Query(
+        default=None,
+        max_length=2000,
+        description="Cursor returned with the previous page. When set, the query continues after the last result \
+            of the previous page instead of skipping `page`; deep pages are as fast as the first one.",
+    )
+    _after_entity: str = Query(default=None, include_in_schema=False)
+    _after_score: float = Query(default=None, include_in_schema=False)
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._after_entity = None
+        self._after_score = None
+        if self.cursor is not None:
+            self._after_entity, self._after_score, self._offset = decode_cursor(self.cursor)
+
+
 @dataclasses.dataclass(kw_only=True)
 class SearchEventsBase:
     q: str = Query(
@@ -243,30 +284,37 @@ class ReconQueryBatch(Base):
 
 
 @dataclasses.dataclass(kw_only=True)
-class Search(Search_Base, QueryBase):
+class Search(Search_Base, CursorQueryBase):
     kind: list[EntityType] = Query(
         default=None, description="Limit Query to entity type."
     )
 
 
 @dataclasses.dataclass(kw_only=True)
-class SearchOccupationsStats(Search_Base, QueryBase):
+class OccupationTreeQuery:
+    rollup: bool = Query(default=False, description="Add the counts of all narrower occupations to an occupation.")
+    min_count: int = Query(default=0, ge=0, description="Leave out occupations with a lower count.")
+    max_depth: int = Query(default=None, ge=1, description="Leave out occupations deeper in the tree.")
+
+
+@dataclasses.dataclass(kw_only=True)
+class SearchOccupationsStats(Search_Base, OccupationTreeQuery, QueryBase):
     pass
 
 
 @dataclasses.dataclass(kw_only=True)
-class SearchEvents(SearchEventsBase, QueryBase):
+class SearchEvents(SearchEventsBase, CursorQueryBase):
     pass
 
 @dataclasses.dataclass(kw_only=True)
-class SearchEventKindVocab(QueryBase):
+class SearchEventKindVocab(CursorQueryBase):
     q: str = Query(
         default=None,
         description="Query for a label in the Vocabulary. Matching is done on substring level.",
     )
 
 @dataclasses.dataclass(kw_only=True)
-class SearchVocabs(QueryBase):
+class SearchVocabs(CursorQueryBase):
     q: str = Query(
         default=None,
         description="Query for a label in the Vocabulary. When not using quotes, the query will be wildcarded. When using quotes, \
@@ -289,7 +337,20 @@ class Entity_Retrieve(QueryBase):
 
 @dataclasses.dataclass(kw_only=True)
 class StatisticsBinsQuery(Base):
-    bins: PositiveInt = 10
+    bins: int = Query(default=10, ge=1, le=1000, description="Number of bins of equal width.")
+    bin_interval: BinIntervalEnum = Query(
+        default=None, description="Use bins aligned to the calendar instead of `bins` bins of equal width."
+    )
+    bin_edges: typing.List[float] = Query(
+        default=None,
+        description="Custom bin edges in (decimal) years, e.g. -500, 0, 1500, 1800, 1900. Years before 1 are \
+            astronomical years (0 is 1 BCE). Overrides `bins` and `bin_interval`.",
+    )
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.bin_edges is not None and len(self.bin_edges) < 2:
+            raise HTTPException(status_code=422, detail="bin_edges needs at least two edges")
 
 
 @dataclasses.dataclass(kw_only=True)
@@ -297,6 +358,18 @@ class StatisticsBase(Search_Base, StatisticsBinsQuery):
     pass
 
 
+@dataclasses.dataclass(kw_only=True)
+class StatisticsFacetsQuery(StatisticsBinsQuery, OccupationTreeQuery):
+    facets: list[StatisticsFacetEnum] = Query(
+        default=list(StatisticsFacetEnum), description="Statistics to compute, all of them by default."
+    )
+
+
+@dataclasses.dataclass(kw_only=True)
+class StatisticsSearch(Search_Base, StatisticsFacetsQuery):
+    kind: list[EntityType] = Query(default=None, description="Limit Query to entity type.")
+
+
 # Models for JSON body
 
 
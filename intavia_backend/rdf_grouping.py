@@ -0,0 +1,184 @@
+"""Compiled mapping of flat SPARQL result rows to the nested response models
+
+The `rdfconfig` metadata (FieldConfigurationRDF) of a model is compiled once per model class
+to a plan. Rows are grouped by the anchor of every nested model in one pass per level, the
+values of multi-valued fields are deduplicated with dicts (keeping the order of the rows) and
+the nested models are created with `construct()`, i.e. without validation. Only the top level
+model is validated.
+
+The mapping follows the one of `RDFUtilsModelBaseClass`, set `RDF_GROUPING_ENGINE` to
+`library` to use the (slower) mapping of rdf_fastapi_utils instead.
+"""
+import os
+from typing import Any
+
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+from rdf_fastapi_utils.models import RDFUtilsModelBaseClass
+
+RDF_GROUPING_ENGINE = os.environ.get("RDF_GROUPING_ENGINE", "compiled")
+
+
+class FieldPlan:
+    __slots__ = (
+        "name",
+        "path",
+        "field",
+        "is_list",
+        "nested",
+        "encode_function",
+        "callback_function",
+        "default_dict_key",
+        "bypass_data_mapping",
+    )
+
+    def __init__(self, field: ModelField):
+        conf = field.field_info.extra.get("rdfconfig")
+        self.name = field.name
+        self.path = conf.path if conf is not None and conf.path else field.name
+        self.field = field
+        self.is_list = field.shape != SHAPE_SINGLETON
+        self.nested: ModelPlan | None = None
+        self.encode_function = conf.encode_function if conf is not None else None
+        self.callback_function = conf.callback_function if conf is not None else None
+        self.default_dict_key = conf.default_dict_key if conf is not None else None
+        self.bypass_data_mapping = conf.bypass_data_mapping if conf is not None else False
+
+
+class ModelPlan:
+    __slots__ = ("model", "anchor", "fields")
+
+    def __init__(self, model: type):
+        self.model = model
+        self.anchor: str | None = None
+        self.fields: list[FieldPlan] = []
+
+
+_plans: dict[type, ModelPlan] = {}
+_MISSING = object()
+
+
+def _anchor(model: type) -> str | None:
+    for field in model.__fields__.values():
+        conf = field.field_info.extra.get("rdfconfig")
+        if conf is not None and conf.anchor:
+            return conf.path or field.name
+    return None
+
+
+def compile_model(model: type) -> ModelPlan:
+    """Returns the (cached) plan of a model class.
+
+    Fields typed with a model that has an anchor field are mapped as nested models, all other
+    fields as values.
+    """
+    plan = _plans.get(model)
+    if plan is not None:
+        return plan
+    plan = _plans[model] = ModelPlan(model)
+    plan.anchor = _anchor(model)
+    for field in model.__fields__.values():
+        field_plan = FieldPlan(field)
+        if (
+            isinstance(field.type_, type)
+            and issubclass(field.type_, RDFUtilsModelBaseClass)
+            and _anchor(field.type_) is not None
+        ):
+            field_plan.nested = compile_model(field.type_)
+        plan.fields.append(field_plan)
+    return plan
+
+
+def _distinct(rows: list, path: str) -> list:
+    try:
+        values = dict.fromkeys([row.get(path, _MISSING) for row in rows])
+        values.pop(_MISSING, None)
+        return list(values)
+    except TypeError:
+        # unhashable values
+        values = []
+        for row in rows:
+            if path in row and row[path] not in values:
+                values.append(row[path])
+        return values
+
+
+def _group(rows: list, anchor: str) -> dict[Any, list]:
+    groups: dict[Any, list] = {}
+    for row in rows:
+        if anchor in row:
+            key = row[anchor]
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [row]
+            else:
+                group.append(row)
+    return groups
+
+
+def _nested(field_plan: FieldPlan, rows: list):
+    plan = field_plan.nested
+    construct = plan.model.construct
+    callback = field_plan.callback_function
+    objects = []
+    for group in _group(rows, plan.anchor).values():
+        if callback is not None:
+            group = [callback(field_plan.field, dict(row), group) for row in group]
+        objects.append(construct(**map_rows(plan, group)))
+    if not field_plan.is_list:
+        return objects[0] if objects else None
+    return objects
+
+
+def map_rows(plan: ModelPlan, rows: list) -> dict:
+    """Maps the rows of one object (all rows share the value of the anchor) to field values."""
+    values = {}
+    for field_plan in plan.fields:
+        if field_plan.nested is not None:
+            value = _nested(field_plan, rows)
+            if value is not None and value != []:
+                values[field_plan.name] = value
+            continue
+        found = _distinct(rows, field_plan.path)
+        if not found:
+            continue
+        if field_plan.default_dict_key is not None:
+            found = [{field_plan.default_dict_key: value} for value in found]
+        if field_plan.is_list or (
+            field_plan.callback_function is not None and not field_plan.bypass_data_mapping and len(found) > 1
+        ):
+            value = found
+        else:
+            value = found[0]
+        if field_plan.encode_function is not None:
+            value = field_plan.encode_function(value)
+        if field_plan.callback_function is not None:
+            value = field_plan.callback_function(field_plan.field, value, rows)
+        values[field_plan.name] = value
+    return values
+
+
+def map_data(model: type, data: dict) -> dict:
+    """Maps the keyword arguments of a model to field values.
+
+    `_results` holds the rows of a single object. Otherwise lists of rows are grouped for the
+    nested model fields (e.g. `results` of the paginated responses) and everything else is
+    passed as is.
+    """
+    plan = compile_model(model)
+    if "_results" in data:
+        return map_rows(plan, data["_results"])
+    values = {}
+    for field_plan in plan.fields:
+        value = data.get(field_plan.path, data.get(field_plan.name))
+        if field_plan.path not in data and field_plan.name not in data:
+            continue
+        if (
+            field_plan.nested is not None
+            and field_plan.path in data
+            and isinstance(value, list)
+            and value
+            and isinstance(value[0], dict)
+        ):
+            value = _nested(field_plan, value)
+        values[field_plan.name] = value
+    return values
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from . import models_v2
+from .binding_decoder import decode_bindings
+from .models_v2 import Entity, Event, PaginatedResponseEntities, PaginatedResponseEvents
+
+# bindings of get_entity_v2_1.sparql / get_event_v2_1.sparql, recorded from the triplestore
+# stand-in of the benchmarks (benchmarks/triplestore.py) loaded with the TTL fixtures
+with open(os.path.join(os.path.dirname(__file__), "rdf_grouping_test_bindings.json")) as f:
+    RECORDED = json.load(f)
+
+
+def mapped(monkeypatch, engine: str, model: type, data: dict) -> dict:
+    monkeypatch.setattr(models_v2, "RDF_GROUPING_ENGINE", engine)
+    return json.loads(model(**data).json(exclude_none=True))
+
+
+def assert_same_mapping(monkeypatch, model: type, data: dict):
+    compiled = mapped(monkeypatch, "compiled", model, data)
+    assert compiled == mapped(monkeypatch, "library", model, data)
+    return compiled
+
+
+@pytest.mark.parametrize("entity_id", list(RECORDED["entities"]))
+def test_entity(monkeypatch, entity_id):
+    res = assert_same_mapping(monkeypatch, Entity, {"_results": decode_bindings(RECORDED["entities"][entity_id])})
+    assert res["id"] == models_v2.pp_base64(entity_id)
+
+
+@pytest.mark.parametrize("event_id", list(RECORDED["events"]))
+def test_event(monkeypatch, event_id):
+    res = assert_same_mapping(monkeypatch, Event, {"_results": decode_bindings(RECORDED["events"][event_id])})
+    assert res["id"] == models_v2.pp_base64(event_id)
+
+
+def test_paginated_entities(monkeypatch):
+    rows = decode_bindings([row for rows in RECORDED["entities"].values() for row in rows])
+    res = assert_same_mapping(monkeypatch, PaginatedResponseEntities, {"page": 1, "count": 3, "results": rows})
+    assert len(res["results"]) == len(RECORDED["entities"])
+
+
+def test_paginated_events(monkeypatch):
+    rows = decode_bindings([row for rows in RECORDED["events"].values() for row in rows])
+    res = assert_same_mapping(monkeypatch, PaginatedResponseEvents, {"page": 1, "count": 2, "results": rows})
+    assert len(res["results"]) == len(RECORDED["events"])
@@ -0,0 +1,417 @@
+"""Reconciliation service (OpenRefine reconciliation API)
+
+Reconciliation queries are answered by the full-text search of the triplestore. With
+RECON_INDEX_ENABLED, reconciliation, suggest and preview are served from an in-process name
+index of the provided persons, groups and places instead. The index is loaded from the
+triplestore at startup and refreshed periodically, until it is loaded the reconciliation
+queries use the triplestore. Every worker loads and holds its own copy of the full index.
+"""
+import asyncio
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+import dataclasses
+import heapq
+import html
+import logging
+import os
+import re
+import time
+import unicodedata
+
+import requests
+
+from .query_parameters import ReconQuery, ReconTypeEnum
+from .utils import flatten_rdf_data, get_query_from_triplestore, get_query_from_triplestore_v2
+
+logger = logging.getLogger(__name__)
+
+RECON_PROPERTIES = {
+    "birthYear": "Year of birth",
+    "deathYear": "Year of death",
+    "occupation": "Occupation",
+}
+
+_NON_WORD = re.compile(r"[\W_]+")
+_YEAR = re.compile(r"^\s*(-?\d{1,4})")
+
+
+def normalize_name(name: str) -> str:
+    """Lower case, without diacritics and punctuation, e.g. "Gyldén, Eva" to "gylden eva"."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(token for token in _NON_WORD.split(name.casefold()) if token)
+
+
+def trigrams(normalized: str) -> set[str]:
+    """Trigrams of the (padded) tokens, independent of the order of the tokens."""
+    grams = set()
+    for token in normalized.split():
+        padded = f" {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def parse_year(value) -> int | None:
+    match = _YEAR.match(str(value))
+    return int(match.group(1)) if match else None
+
+
+@dataclasses.dataclass
+class IndexEntry:
+    id: str
+    type: str
+    names: list[str]
+    birth: int | None = None
+    death: int | None = None
+    occupations: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def description(self) -> str | None:
+        parts = []
+        if self.birth is not None or self.death is not None:
+            parts.append(
+                f"{self.birth if self.birth is not None else '?'}–{self.death if self.death is not None else '?'}"
+            )
+        parts.extend(self.occupations[:3])
+        return ", ".join(parts) or None
+
+
+class NameIndex:
+    """Name index of the entities of one type.
+
+    Prefix search runs on a sorted list of the name tokens (a flattened prefix trie), fuzzy
+    matching on an inverted index of the trigrams of the names.
+
+    Args:
+        entries (list[IndexEntry]): the entities
+        max_postings (int): trigrams occuring in more names are not used to collect candidates
+    """
+
+    def __init__(self, entries: list[IndexEntry], max_postings: int = 50000):
+        self.entries = entries
+        self.max_postings = max_postings
+        self.by_id = {entry.id: idx for idx, entry in enumerate(entries)}
+        self.names: list[str] = []
+        self.name_entry = array("I")
+        postings: dict[str, array] = {}
+        tokens = []
+        for idx, entry in enumerate(entries):
+            for normalized in dict.fromkeys(normalize_name(name) for name in entry.names):
+                if not normalized:
+                    continue
+                name_idx = len(self.names)
+                self.names.append(normalized)
+                self.name_entry.append(idx)
+                tokens.extend((token, name_idx) for token in set(normalized.split()))
+                for gram in trigrams(normalized):
+                    posting = postings.get(gram)
+                    if posting is None:
+                        posting = postings[gram] = array("I")
+                    posting.append(name_idx)
+        tokens.sort()
+        self.tokens = [token for token, _ in tokens]
+        self.token_names = array("I", (name_idx for _, name_idx in tokens))
+        self.postings = postings
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, entity_id: str) -> IndexEntry | None:
+        idx = self.by_id.get(entity_id)
+        return self.entries[idx] if idx is not None else None
+
+    def suggest(self, prefix: str, limit: int = 10, scan_limit: int = 5000) -> list[tuple[IndexEntry, str]]:
+        """Entities with a name containing tokens that start with the tokens of `prefix`.
+
+        Names starting with the prefix come first, then shorter names.
+
+        Returns:
+            list[tuple[IndexEntry, str]]: entity and the matched (normalized) name
+        """
+        query_tokens = normalize_name(prefix).split()
+        if not query_tokens:
+            return []
+        last = query_tokens[-1]
+        lo = bisect_left(self.tokens, last)
+        hi = bisect_left(self.tokens, last + "\uffff", lo)
+        normalized = " ".join(query_tokens)
+        best: dict[int, tuple] = {}
+        for pos in range(lo, min(hi, lo + scan_limit)):
+            name_idx = self.token_names[pos]
+            name = self.names[name_idx]
+            name_tokens = name.split()
+            if not all(any(token.startswith(q) for token in name_tokens) for q in query_tokens[:-1]):
+                continue
+            entry_idx = self.name_entry[name_idx]
+            rank = (not name.startswith(normalized), len(name), name)
+            if entry_idx not in best or rank < best[entry_idx]:
+                best[entry_idx] = rank
+        ranked = heapq.nsmallest(limit, best.items(), key=lambda item: item[1])
+        return [(self.entries[entry_idx], rank[2]) for entry_idx, rank in ranked]
+
+    def match(self, query: str, limit: int = 10, pool: int = 50) -> list[tuple[IndexEntry, float]]:
+        """Entities with names similar to `query` (Dice coefficient of the trigrams).
+
+        Returns:
+            list[tuple[IndexEntry, float]]: entity and similarity (0-1), best first
+        """
+        grams = trigrams(normalize_name(query))
+        if not grams:
+            return []
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        selective = [posting for posting in lists if len(posting) <= self.max_postings]
+        counts = Counter()
+        for posting in selective or sorted(lists, key=len)[:1]:
+            counts.update(posting)
+        scores: dict[int, float] = {}
+        for name_idx, _ in counts.most_common(max(pool, limit)):
+            name_grams = trigrams(self.names[name_idx])
+            score = 2 * len(grams & name_grams) / (len(grams) + len(name_grams))
+            entry_idx = self.name_entry[name_idx]
+            if score > scores.get(entry_idx, 0):
+                scores[entry_idx] = score
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.entries[entry_idx], score) for entry_idx, score in ranked]
+
+
+def property_score(entry: IndexEntry, properties: list) -> float:
+    """Adjusts the score for the property constraints of a query: a matching year (+-1) or
+    occupation adds 10, a conflicting value subtracts 30. Unknown values are ignored."""
+    adjust = 0.0
+    for prop in properties or []:
+        pid, value = prop.pid, prop.v
+        if pid in ("birthYear", "deathYear"):
+            known = entry.birth if pid == "birthYear" else entry.death
+            year = parse_year(value)
+            if known is None or year is None:
+                continue
+            adjust += 10 if abs(known - year) <= 1 else -30
+        elif pid == "occupation" and entry.occupations:
+            wanted = normalize_name(str(value))
+            if any(wanted in normalize_name(occupation) for occupation in entry.occupations):
+                adjust += 10
+            else:
+                adjust -= 30
+    return adjust
+
+
+class ReconIndex:
+    """Holds the name indices (one per ReconTypeEnum) and refreshes them periodically.
+
+    Args:
+        refresh_interval (float): seconds between two loads of the index
+        page_size (int): rows fetched per query while loading
+    """
+
+    def __init__(self, refresh_interval: float = 86400, page_size: int = 50000):
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self.indices: dict[str, NameIndex] | None = None
+        self.loaded_at: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.indices is not None
+
+    async def _fetch(self, recon_type: ReconTypeEnum, facet: str) -> list[dict]:
+        rows, offset = [], 0
+        while True:
+            params = {"type": recon_type, "facet": facet, "limit": self.page_size, "offset": offset}
+            page = flatten_rdf_data(await get_query_from_triplestore_v2(params, "recon_index_v1_1.sparql"))
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    async def load_entries(self, recon_type: ReconTypeEnum) -> list[IndexEntry]:
+        entries: dict[str, IndexEntry] = {}
+        for row in await self._fetch(recon_type, "labels"):
+            entry = entries.get(row["id"])
+            if entry is None:
+                entry = entries[row["id"]] = IndexEntry(id=row["id"], type=recon_type.value, names=[])
+            entry.names.append(str(row["label"]))
+        if recon_type == ReconTypeEnum.Person:
+            for row in await self._fetch(recon_type, "dates"):
+                entry = entries.get(row["id"])
+                if entry is not None:
+                    entry.birth = parse_year(row["birth"]) if "birth" in row else None
+                    entry.death = parse_year(row["death"]) if "death" in row else None
+            for row in await self._fetch(recon_type, "occupations"):
+                entry = entries.get(row["id"])
+                if entry is not None and row["occupationLabel"] not in entry.occupations:
+                    entry.occupations.append(str(row["occupationLabel"]))
+        return list(entries.values())
+
+    async def refresh(self):
+        """Loads the entities from the triplestore and swaps in the new indices."""
+        started = time.monotonic()
+        indices = {}
+        for recon_type in ReconTypeEnum:
+            entries = await self.load_entries(recon_type)
+            indices[recon_type.value] = await asyncio.to_thread(NameIndex, entries)
+        self.indices = indices
+        self.loaded_at = time.monotonic()
+        logger.info(
+            "reconciliation index loaded in %.1f s: %s",
+            self.loaded_at - started,
+            {key: len(index) for key, index in indices.items()},
+        )
+
+    async def run(self):
+        """Refreshes the index every `refresh_interval` seconds, retries failed loads after a minute."""
+        while True:
+            try:
+                await self.refresh()
+                await asyncio.sleep(self.refresh_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("loading the reconciliation index failed")
+                await asyncio.sleep(60)
+
+    def get(self, entity_id: str) -> IndexEntry | None:
+        for index in (self.indices or {}).values():
+            entry = index.get(entity_id)
+            if entry is not None:
+                return entry
+        return None
+
+    def suggest(self, prefix: str, recon_type: ReconTypeEnum | None = None, limit: int = 10) -> list[IndexEntry]:
+        if self.indices is None:
+            return []
+        types = [recon_type.value] if recon_type is not None else list(self.indices)
+        found = [hit for key in types for hit in self.indices[key].suggest(prefix, limit)]
+        found.sort(key=lambda hit: (not hit[1].startswith(normalize_name(prefix)), len(hit[1])))
+        return [entry for entry, _ in found[:limit]]
+
+    def match(self, query: ReconQuery) -> list[dict]:
+        """Candidates of a reconciliation query, scores are 0-100. A candidate is marked as
+        match if it scores at least 90 and leads the next candidate by at least 10."""
+        hits = self.indices[query.type.value].match(query.query, limit=max(query.limit * 3, query.limit))
+        candidates = []
+        for entry, similarity in hits:
+            score = min(100.0, max(0.0, similarity * 100 + property_score(entry, query.properties)))
+            candidates.append({"id": entry.id, "name": entry.names[0], "score": round(score, 2), "match": False})
+        candidates.sort(key=lambda candidate: candidate["score"], reverse=True)
+        candidates = candidates[: query.limit]
+        if candidates and candidates[0]["score"] >= 90:
+            if len(candidates) == 1 or candidates[0]["score"] - candidates[1]["score"] >= 10:
+                candidates[0]["match"] = True
+        return candidates
+
+
+def preview_html(entry: IndexEntry) -> str:
+    """HTML snippet shown by OpenRefine when hovering over a candidate."""
+    lines = [f'<a href="{html.escape(entry.id)}" target="_blank"><strong>{html.escape(entry.names[0])}</strong></a>']
+    lines.append(
+        f"<div>{html.escape(entry.type)}{' · ' + html.escape(entry.description) if entry.description else ''}</div>"
+    )
+    if len(entry.names) > 1:
+        lines.append(f"<div>Also known as: {html.escape('; '.join(entry.names[1:6]))}</div>")
+    return '<div style="font-family: sans-serif; font-size: 12px">' + "".join(lines) + "</div>"
+
+
+def recon_template(query: ReconQuery) -> str:
+    if query.type.get_rdf_uri() in ["<http://www.intavia.eu/idm-core/Provided_Person>"]:
+        return "recon_provided_person_v1_1.sparql"
+    return "recon_crm_v1_1.sparql"
+
+
+class ReconExecutor:
+    """Runs the queries of a reconciliation batch concurrently.
+
+    Queries are sent to the triplestore, or answered from the name index if it is enabled and
+    loaded. Identical queries (query, type, limit, properties) of a batch are executed once.
+    The candidates of the triplestore are cached across batches for `cache_ttl` seconds.
+    Queries that fail or time out return no candidates instead of failing the batch, they are
+    not cached.
+
+    Args:
+        index (ReconIndex): the name index
+        max_concurrency (int): maximum number of queries of a batch in flight
+        timeout (float): timeout per query in seconds
+        cache_ttl (float): seconds the candidates of a query are reused
+        cache_size (int): maximum number of queries kept in the cache
+    """
+
+    def __init__(
+        self,
+        index: ReconIndex,
+        max_concurrency: int = 8,
+        timeout: float = 10,
+        cache_ttl: float = 3600,
+        cache_size: int = 4096,
+    ):
+        self.index = index
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, tuple[list[dict], float]] = OrderedDict()
+
+    @staticmethod
+    def query_key(query: ReconQuery) -> tuple:
+        properties = tuple((prop.pid, str(prop.v)) for prop in query.properties or [])
+        return (query.query, query.type.value, query.limit, properties)
+
+    def _cache_get(self, key: tuple) -> list[dict] | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        candidates, fetched_at = entry
+        if time.monotonic() - fetched_at >= self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return candidates
+
+    def _cache_set(self, key: tuple, candidates: list[dict]):
+        self._cache[key] = (candidates, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def run(self, query: ReconQuery, semaphore: asyncio.Semaphore) -> list[dict]:
+        """Returns the candidates of a single query."""
+        if self.index.ready:
+            return self.index.match(query)
+        key = self.query_key(query)
+        candidates = self._cache_get(key)
+        if candidates is not None:
+            return candidates
+        async with semaphore:
+            try:
+                res = await asyncio.wait_for(
+                    get_query_from_triplestore(query, recon_template(query), timeout=self.timeout), self.timeout
+                )
+            except (asyncio.TimeoutError, requests.RequestException) as e:
+                logger.warning("reconciliation query %r failed: %r", query.query, e)
+                return []
+        candidates = [{"id": r["id"], "name": r["label"], "score": r["score"]} for r in res]
+        self._cache_set(key, candidates)
+        return candidates
+
+    async def reconcile(self, queries: list[ReconQuery]) -> list[list[dict]]:
+        """Returns the candidates of every query of a batch, in the order of the queries."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        unique = {self.query_key(query): query for query in queries}
+        candidates = await asyncio.gather(*[self.run(query, semaphore) for query in unique.values()])
+        by_key = dict(zip(unique, candidates))
+        return [by_key[self.query_key(query)] for query in queries]
+
+
+# opt-in: every worker builds and holds its own copy of the full index
+RECON_INDEX_ENABLED = os.environ.get("RECON_INDEX_ENABLED", "False") == "True"
+
+recon_index = ReconIndex(
+    refresh_interval=float(os.environ.get("RECON_INDEX_REFRESH", 86400)),
+    page_size=int(os.environ.get("RECON_INDEX_PAGE_SIZE", 50000)),
+)
+recon_executor = ReconExecutor(
+    recon_index,
+    max_concurrency=int(os.environ.get("RECON_MAX_CONCURRENCY", 8)),
+    timeout=float(os.environ.get("RECON_TIMEOUT", 10)),
+    cache_ttl=float(os.environ.get("RECON_CACHE_TTL", 3600)),
+    cache_size=int(os.environ.get("RECON_CACHE_SIZE", 4096)),
+)
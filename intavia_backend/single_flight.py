@@ -0,0 +1,114 @@
+"""Coalesces identical triplestore queries that are in flight at the same time"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import typing
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Identical calls (same key) that overlap in time share one execution.
+
+    The first caller starts the call as a task, later callers await the same task. Cancelling
+    a caller does not cancel the shared call. All callers get the same result object, it must
+    not be modified.
+
+    With a redis client the calls are also coalesced across workers: the worker that gets the
+    lock of a key executes the call and stores the result for `result_ttl` seconds, the other
+    workers poll for the result. If the lock expires or is released without a result, the
+    waiting workers execute the call themselves.
+
+    Args:
+        redis (redis.asyncio.Redis | None): client for coalescing across workers
+        lock_ttl (float): seconds a worker holds the lock of a key at most
+        result_ttl (float): seconds the result is kept in redis for the waiting workers
+        poll_interval (float): seconds between two polls of the waiting workers
+        prefix (str): prefix of the redis keys
+    """
+
+    def __init__(
+        self,
+        redis=None,
+        lock_ttl: float = 180,
+        result_ttl: float = 10,
+        poll_interval: float = 0.05,
+        prefix: str = "single-flight",
+    ):
+        self.redis = redis
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self.coalesced = 0
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._id = uuid.uuid4().hex
+
+    @staticmethod
+    def key(value: str) -> str:
+        return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, func: typing.Callable[[], typing.Awaitable]):
+        """Returns the result of `func()`, shared with all identical calls in flight."""
+        task = self._in_flight.get(key)
+        if task is None:
+            call = self._remote(key, func) if self.redis is not None else func()
+            task = self._in_flight[key] = asyncio.ensure_future(call)
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # the exception is raised to the callers, mark it as retrieved for the case all of them are gone
+            task.exception()
+
+    async def _wait(self, lock_key: str, result_key: str) -> str | None:
+        """Polls for the result of the worker holding the lock, None if the lock is gone."""
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            cached = await self.redis.get(result_key)
+            if cached is not None:
+                return cached
+            if not await self.redis.exists(lock_key):
+                return None
+        return None
+
+    async def _remote(self, key: str, func: typing.Callable[[], typing.Awaitable]):
+        lock_key, result_key = f"{self.prefix}:lock:{key}", f"{self.prefix}:result:{key}"
+        try:
+            cached = await self.redis.get(result_key)
+            locked = False
+            if cached is None:
+                locked = await self.redis.set(lock_key, self._id, nx=True, px=int(self.lock_ttl * 1000))
+                if not locked:
+                    cached = await self._wait(lock_key, result_key)
+                    if cached is not None:
+                        self.coalesced += 1
+            if cached is not None:
+                return json.loads(cached)
+        except Exception as e:
+            logger.warning("single-flight via redis failed, the query is executed without it: %r", e)
+            locked = False
+        if not locked:
+            return await func()
+        try:
+            result = await func()
+            try:
+                await self.redis.set(result_key, json.dumps(result), px=int(self.result_ttl * 1000))
+            except Exception as e:
+                logger.warning("single-flight result could not be stored: %r", e)
+            return result
+        finally:
+            try:
+                if await self.redis.get(lock_key) == self._id:
+                    await self.redis.delete(lock_key)
+            except Exception:
+                pass
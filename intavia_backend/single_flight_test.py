@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from .single_flight import SingleFlight
+
+
+class FakeRedis:
+    """In-memory stand-in for the few redis commands used by SingleFlight (expiry is ignored)"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def counting_call(result, delay: float = 0.01):
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return func, calls
+
+
+def test_identical_calls_share_one_execution():
+    async def run():
+        flight = SingleFlight()
+        func, calls = counting_call({"rows": [1]})
+        results = await asyncio.gather(*[flight.do("a", func) for _ in range(5)], flight.do("b", func))
+        return flight, results, calls
+
+    flight, results, calls = asyncio.run(run())
+    assert len(calls) == 2
+    assert flight.coalesced == 4
+    assert all(res is results[0] for res in results)
+    assert flight._in_flight == {}
+
+
+def test_calls_after_completion_execute_again():
+    async def run():
+        flight = SingleFlight()
+        func, calls = counting_call(1, delay=0)
+        await flight.do("a", func)
+        await flight.do("a", func)
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_exceptions_are_raised_to_every_caller():
+    async def run():
+        flight = SingleFlight()
+        func, calls = counting_call(ValueError("failed"))
+        return await asyncio.gather(flight.do("a", func), flight.do("a", func), return_exceptions=True), calls
+
+    results, calls = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(res, ValueError) for res in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def run():
+        flight = SingleFlight()
+        func, calls = counting_call(1, delay=0.05)
+        first = asyncio.ensure_future(flight.do("a", func))
+        second = asyncio.ensure_future(flight.do("a", func))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled(), calls
+
+    result, cancelled, calls = asyncio.run(run())
+    assert (result, cancelled, len(calls)) == (1, True, 1)
+
+
+def test_calls_are_coalesced_across_workers():
+    async def run():
+        redis = FakeRedis()
+        workers = [SingleFlight(redis=redis, poll_interval=0.005) for _ in range(3)]
+        func, calls = counting_call({"rows": [1]}, delay=0.05)
+        results = await asyncio.gather(*[worker.do("a", func) for worker in workers])
+        return redis, results, calls
+
+    redis, results, calls = asyncio.run(run())
+    assert len(calls) == 1
+    assert results == [{"rows": [1]}] * 3
+    # the lock is released, the result is kept for result_ttl
+    assert list(redis.data) == ["single-flight:result:a"]
+
+
+@pytest.mark.parametrize("failing", ["get", "set"])
+def test_redis_errors_fall_back_to_local_execution(failing):
+    async def fail(*args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    async def run():
+        redis = FakeRedis()
+        setattr(redis, failing, fail)
+        func, calls = counting_call(1)
+        return await SingleFlight(redis=redis).do("a", func), calls
+
+    result, calls = asyncio.run(run())
+    assert (result, len(calls)) == (1, 1)
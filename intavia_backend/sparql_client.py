@@ -0,0 +1,63 @@
+"""Async SPARQL client used to query the triplestore"""
+import requests
+
+from .http_client import AsyncSession
+from .timing import observe_query
+
+
+class SPARQLClient:
+    """Sends SPARQL queries via POST and returns the decoded JSON results.
+
+    Every call builds its own request, so concurrent queries never share state. The HTTP
+    work (including JSON decoding of large result sets) runs on the pooled session.
+
+    Args:
+        endpoint (str): URL of the SPARQL endpoint
+        user (str | None): user for HTTP basic auth
+        password (str | None): password for HTTP basic auth
+        max_connections (int): size of the keep-alive pool
+        max_concurrency (int): maximum number of queries in flight per worker
+        timeout (float | None): read timeout per query in seconds
+        connect_timeout (float): timeout for establishing a connection in seconds
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        user: str | None = None,
+        password: str | None = None,
+        max_connections: int = 32,
+        max_concurrency: int = 32,
+        timeout: float | None = 180,
+        connect_timeout: float = 10,
+    ):
+        self.endpoint = endpoint
+        self.session = AsyncSession(
+            max_connections=max_connections,
+            max_concurrency=max_concurrency,
+            timeout=(connect_timeout, timeout),
+            auth=(user, password) if user is not None else None,
+            thread_name_prefix="sparql",
+        )
+
+    def _query(self, session: requests.Session, query: str, timeout=None) -> dict:
+        res = session.post(
+            self.endpoint,
+            data={"query": query},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=timeout or self.session.timeout,
+        )
+        res.raise_for_status()
+        observe_query("bytes", len(res.content))
+        return res.json()
+
+    async def query(self, query: str, timeout: float | None = None) -> dict:
+        """Executes the query and returns the SPARQL JSON results (`head` and `results`)."""
+        return await self.session.run(self._query, query, timeout=timeout)
+
+    def query_sync(self, query: str, timeout: float | None = None) -> dict:
+        """Blocking variant for scripts and code that does not run in the event loop."""
+        return self._query(self.session.session, query, timeout=timeout)
+
+    def close(self):
+        self.session.close()
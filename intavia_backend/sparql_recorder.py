@@ -0,0 +1,122 @@
+"""Records the responses of the triplestore and replays them for load tests"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from .timing import observe_query
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMiss(KeyError):
+    """The query was not recorded."""
+
+
+class QueryRecorder:
+    """Wraps a SPARQLClient: in `record` mode the queries are sent to the triplestore and every
+    response is written to `path` together with its latency, in `replay` mode the recorded
+    responses are returned without contacting the triplestore.
+
+    The responses are stored per rendered query (sha1 of the query) as gzipped JSON, one file
+    per query, so several workers can record at the same time and a recording can be copied
+    and replayed elsewhere. Replayed responses are decoded from JSON on every call like the
+    responses of the triplestore, so the timings of the Python side stay comparable.
+
+    Args:
+        client (SPARQLClient): the client used in `record` mode
+        mode (str): `record` or `replay`
+        path (str): directory of the recording
+        latency (str): in `replay` mode, `none` answers immediately, `recorded` waits the
+            recorded latency and a number waits that many seconds
+    """
+
+    def __init__(self, client, mode: str, path: str, latency: str = "none"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown recording mode {mode}")
+        self.client = client
+        self.mode = mode
+        self.path = path
+        self.latency = latency
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        # sha1 -> (JSON of the response, recorded latency in seconds), filled on first use
+        self._loaded: dict[str, tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+        # fails early on an invalid latency
+        self._fixed_delay = None if latency in ("none", "recorded") else float(latency)
+        if mode == "record":
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(query: str) -> str:
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json.gz")
+
+    def _write(self, query: str, res: dict, latency: float):
+        path = self._file(self.key(query))
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"query": query, "latency": latency, "response": res}, f)
+        os.replace(tmp, path)
+        with self._lock:
+            self.recorded += 1
+
+    def _load(self, query: str) -> tuple[bytes, float]:
+        key = self.key(query)
+        found = self._loaded.get(key)
+        if found is None:
+            try:
+                with gzip.open(self._file(key), "rt", encoding="utf-8") as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                with self._lock:
+                    self.misses += 1
+                logger.warning("query %s was not recorded", key)
+                raise ReplayMiss(key) from None
+            found = self._loaded[key] = (json.dumps(record["response"]).encode("utf-8"), record["latency"])
+        with self._lock:
+            self.replayed += 1
+        return found
+
+    def _delay(self, recorded: float) -> float:
+        if self._fixed_delay is not None:
+            return self._fixed_delay
+        return recorded if self.latency == "recorded" else 0.0
+
+    async def query(self, query: str, timeout: float | None = None) -> dict:
+        loop = asyncio.get_running_loop()
+        if self.mode == "record":
+            started = time.perf_counter()
+            res = await self.client.query(query, timeout=timeout)
+            await loop.run_in_executor(None, self._write, query, res, time.perf_counter() - started)
+            return res
+        raw, recorded = await loop.run_in_executor(None, self._load, query)
+        delay = self._delay(recorded)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        observe_query("bytes", len(raw))
+        return await loop.run_in_executor(None, json.loads, raw)
+
+    def query_sync(self, query: str, timeout: float | None = None) -> dict:
+        if self.mode == "record":
+            started = time.perf_counter()
+            res = self.client.query_sync(query, timeout=timeout)
+            self._write(query, res, time.perf_counter() - started)
+            return res
+        raw, recorded = self._load(query)
+        delay = self._delay(recorded)
+        if delay > 0:
+            time.sleep(delay)
+        return json.loads(raw)
+
+    def close(self):
+        self.client.close()
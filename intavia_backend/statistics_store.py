@@ -0,0 +1,239 @@
+"""Precomputed statistics of the unfiltered entities, per dataset
+
+Dashboards mostly request the statistics of all entities of some datasets. The occupation,
+birth / death date and entity type counts are computed once per dataset (at startup and every
+`refresh_interval` seconds), kept in memory and written to a gzipped JSON file. Requests
+without a filter are answered by summing the counts of the requested datasets.
+
+Occupations and dates are counted per proxy, a proxy belongs to one dataset, so the counts
+of several datasets add up. Entity types are counted per provided entity, which can have
+proxies in several datasets: they are stored per combination of datasets an entity is found
+in and every combination overlapping the requested datasets is counted once. The death dates
+of /api/statistics/death_dates are counted once for all datasets: like its template, they do not
+depend on the requested datasets.
+"""
+import asyncio
+import dataclasses
+import gzip
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+from .query_parameters_v2 import DatasetsEnum, Search_Base
+from .utils import get_query_from_triplestore_v2
+
+logger = logging.getLogger(__name__)
+
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+DATE_FACETS = ("birth_dates", "death_dates")
+# the death dates of statistics_deathdate_v2_1.sparql (/api/statistics/death_dates), which match the
+# begin and the end of the time-span, the death_dates facet of statistics_v2_1.sparql only the begin
+DEATH_DATE_BOUNDS = "death_date_bounds"
+FORMAT_VERSION = 2
+
+_FILTER_FIELDS = [field.name for field in dataclasses.fields(Search_Base)] + ["kind"]
+
+
+def unfiltered(search) -> bool:
+    """True if the only parameters of a search restricting the entities are the datasets."""
+    return not any(getattr(search, name, None) for name in _FILTER_FIELDS)
+
+
+def _literal(value) -> dict:
+    return {"type": "literal", "value": str(value)}
+
+
+def _count(value: int) -> dict:
+    return {"type": "literal", "value": str(value), "datatype": XSD_INTEGER}
+
+
+def _day(value: str) -> str:
+    return value.partition("T")[0]
+
+
+class StatisticsStore:
+    """Holds the precomputed statistics of every dataset.
+
+    Args:
+        path (str): gzipped JSON file the statistics are persisted to
+        refresh_interval (float): seconds between two computations
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 86400):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.data: dict | None = None
+        self.computed_at: float | None = None
+        self.mtime: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.data is not None
+
+    async def compute_dataset(self, dataset: DatasetsEnum) -> dict:
+        params = {"datasets": [dataset], "facets": ["occupations", *DATE_FACETS]}
+        res = await get_query_from_triplestore_v2(params, "statistics_v2_1.sparql")
+        occupations, dates = [], {facet: Counter() for facet in DATE_FACETS}
+        for binding in res:
+            facet, count = binding["facet"]["value"], int(binding["count"]["value"])
+            if facet == "occupations":
+                occupations.append(
+                    [
+                        binding["occupation"]["value"],
+                        binding["occupationLabel"]["value"],
+                        binding["broaderUri"]["value"] if "broaderUri" in binding else None,
+                        binding["broaderLabel"]["value"] if "broaderLabel" in binding else None,
+                        count,
+                    ]
+                )
+            elif "date" in binding:
+                dates[facet][_day(binding["date"]["value"])] += count
+        return {"occupations": occupations, **{facet: sorted(counts.items()) for facet, counts in dates.items()}}
+
+    async def compute_entity_types(self) -> list:
+        res = await get_query_from_triplestore_v2({"datasets": list(DatasetsEnum)}, "statistics_datasets_v2_1.sparql")
+        counts = Counter()
+        for binding in res:
+            graphs = tuple(sorted(set(binding["graphs"]["value"].split())))
+            counts[(binding["entityTypeLabel"]["value"], graphs)] += int(binding["count"]["value"])
+        return [[label, list(graphs), count] for (label, graphs), count in counts.items()]
+
+    async def compute_death_date_bounds(self) -> list:
+        # the template does not restrict the entities to the datasets, the counts are not split up either
+        res = await get_query_from_triplestore_v2({"datasets": list(DatasetsEnum)}, "statistics_deathdate_v2_1.sparql")
+        counts = Counter()
+        for binding in res:
+            counts[_day(binding["date"]["value"])] += int(binding["count"]["value"])
+        return sorted(counts.items())
+
+    async def compute(self) -> dict:
+        datasets = {}
+        for dataset in DatasetsEnum:
+            datasets[dataset.value] = await self.compute_dataset(dataset)
+        return {
+            "version": FORMAT_VERSION,
+            "datasets": datasets,
+            "entity_types": await self.compute_entity_types(),
+            DEATH_DATE_BOUNDS: await self.compute_death_date_bounds(),
+        }
+
+    def load(self) -> bool:
+        """Loads the statistics from `path` if another worker (or an earlier run) wrote them
+        less than half of `refresh_interval` ago."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime or time.time() - mtime > self.refresh_interval / 2:
+                return False
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != FORMAT_VERSION:
+            return False
+        if set(data.get("datasets", {})) != {dataset.value for dataset in DatasetsEnum}:
+            return False
+        self.data = data
+        self.mtime = mtime
+        self.computed_at = time.monotonic()
+        return True
+
+    def save(self, data: dict):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.mtime = os.path.getmtime(self.path)
+
+    async def refresh(self):
+        """Computes the statistics and writes them to `path`, unless another worker just did."""
+        if await asyncio.to_thread(self.load):
+            logger.info("precomputed statistics loaded from %s", self.path)
+            return
+        started = time.monotonic()
+        data = await self.compute()
+        self.data = data
+        self.computed_at = time.monotonic()
+        try:
+            await asyncio.to_thread(self.save, data)
+        except OSError as e:
+            logger.warning("precomputed statistics could not be written to %s: %r", self.path, e)
+        logger.info("statistics precomputed in %.1f s", self.computed_at - started)
+
+    async def run(self):
+        """Refreshes the statistics every `refresh_interval` seconds, retries failed computations
+        after a minute."""
+        while True:
+            try:
+                await self.refresh()
+                await asyncio.sleep(self.refresh_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("precomputing the statistics failed")
+                await asyncio.sleep(60)
+
+    def bindings(self, facets: list, datasets: list) -> list[dict]:
+        """Returns the statistics of the unfiltered entities of `datasets` in the format of the
+        bindings of statistics_v2_1.sparql.
+
+        Args:
+            facets (list): occupations, birth_dates, death_dates, death_date_bounds and / or entity_types
+            datasets (list): the datasets (DatasetsEnum)
+
+        Returns:
+            list[dict]: SPARQL result bindings
+        """
+        selected = [self.data["datasets"][dataset.value] for dataset in dict.fromkeys(datasets)]
+        facets = {getattr(facet, "value", facet) for facet in facets}
+        res = []
+        if "occupations" in facets:
+            occupations = Counter()
+            for stats in selected:
+                for occupation, label, broader, broader_label, count in stats["occupations"]:
+                    occupations[(occupation, label, broader, broader_label)] += count
+            for (occupation, label, broader, broader_label), count in occupations.items():
+                binding = {
+                    "facet": _literal("occupations"),
+                    "occupation": {"type": "uri", "value": occupation},
+                    "occupationLabel": _literal(label),
+                    "count": _count(count),
+                }
+                if broader is not None:
+                    binding["broaderUri"] = {"type": "uri", "value": broader}
+                if broader_label is not None:
+                    binding["broaderLabel"] = _literal(broader_label)
+                res.append(binding)
+        for facet in DATE_FACETS:
+            if facet in facets:
+                dates = Counter()
+                for stats in selected:
+                    dates.update(dict(stats[facet]))
+                res.extend(
+                    {"facet": _literal(facet), "date": _literal(date), "count": _count(count)}
+                    for date, count in dates.items()
+                )
+        if DEATH_DATE_BOUNDS in facets:
+            res.extend(
+                {"facet": _literal(DEATH_DATE_BOUNDS), "date": _literal(date), "count": _count(count)}
+                for date, count in self.data[DEATH_DATE_BOUNDS]
+            )
+        if "entity_types" in facets:
+            requested = {dataset.value for dataset in datasets}
+            entity_types = Counter()
+            for label, graphs, count in self.data["entity_types"]:
+                if requested.intersection(graphs):
+                    entity_types[label] += count
+            res.extend(
+                {"facet": _literal("entity_types"), "entityTypeLabel": _literal(label), "count": _count(count)}
+                for label, count in entity_types.items()
+            )
+        return res
+
+
+STATISTICS_STORE_ENABLED = os.environ.get("STATISTICS_STORE_ENABLED", "True") == "True"
+statistics_store = StatisticsStore(
+    path=os.environ.get("STATISTICS_STORE_PATH", "statistics.json.gz"),
+    refresh_interval=float(os.environ.get("STATISTICS_STORE_REFRESH", 86400)),
+)
@@ -0,0 +1,313 @@
+"""Per request timing of the pipeline stages, Server-Timing headers and Prometheus metrics"""
+import asyncio
+import bisect
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import json
+import logging
+import os
+import time
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+ROWS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTES = (1000, 10000, 100000, 1000000, 10000000, 100000000)
+# name -> (type, buckets, help)
+METRICS = {
+    "intavia_request_seconds": ("histogram", SECONDS, "Duration of the requests of the API routes"),
+    "intavia_request_stage_seconds": (
+        "histogram",
+        SECONDS,
+        "Time per request spent in a stage (render, triplestore, flatten, model), summed over the queries",
+    ),
+    "intavia_response_bytes": ("histogram", BYTES, "Size of the response bodies"),
+    "intavia_cache_lookups_total": ("counter", None, "Lookups of the response cache by result"),
+    "intavia_query_render_seconds": ("histogram", SECONDS, "Time spent rendering a SPARQL template"),
+    "intavia_query_triplestore_seconds": ("histogram", SECONDS, "Time spent waiting for the triplestore per query"),
+    "intavia_query_rows": ("histogram", ROWS, "Number of bindings returned per query"),
+    "intavia_query_response_bytes": ("histogram", BYTES, "Size of the triplestore responses"),
+}
+# per query observations of RequestTimings.queries -> metric
+QUERY_METRICS = {
+    "render": "intavia_query_render_seconds",
+    "triplestore": "intavia_query_triplestore_seconds",
+    "rows": "intavia_query_rows",
+    "bytes": "intavia_query_response_bytes",
+}
+
+
+class RequestTimings:
+    """Timings of one request, filled by the stages while the request is handled.
+
+    The stages of concurrent queries overlap, their durations are summed up.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route: str | None = None
+        self.stages: dict[str, float] = defaultdict(float)
+        # (template, observation, value), see QUERY_METRICS
+        self.queries: list[tuple[str, str, float]] = []
+        self.cache: str | None = None
+        self.endpoint_done: float | None = None
+
+    def server_timing(self) -> str:
+        """Value of the Server-Timing header (durations in milliseconds)."""
+        entries = [f"{stage};dur={seconds * 1e3:.1f}" for stage, seconds in self.stages.items()]
+        queries = sum(1 for _, name, _ in self.queries if name == "triplestore")
+        if queries > 0:
+            rows = sum(value for _, name, value in self.queries if name == "rows")
+            size = sum(value for _, name, value in self.queries if name == "bytes")
+            entries.append(f'sparql;desc="{queries} queries, {int(rows)} rows, {int(size)} bytes"')
+        if self.cache is not None:
+            entries.append(f'cache;desc="{self.cache}"')
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1e3:.1f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+_template: ContextVar[str | None] = ContextVar("sparql_template", default=None)
+
+
+@contextmanager
+def timed(stage: str, sparql_template: str | None = None):
+    """Adds the time spent in the block to `stage` of the current request. With a template the
+    duration is also recorded per query (render, triplestore) and the template is available to
+    observe_query within the block. Outside of requests (e.g. the background loaders) only the
+    per query metrics are recorded."""
+    token = _template.set(sparql_template) if sparql_template is not None else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if token is not None:
+            _template.reset(token)
+        timings = _current.get()
+        if timings is not None:
+            timings.stages[stage] += elapsed
+        if sparql_template is not None and stage in QUERY_METRICS:
+            observe_query(stage, elapsed, sparql_template)
+
+
+def observe_query(name: str, value: float, sparql_template: str | None = None):
+    """Records an observation of a query (see QUERY_METRICS), by default for the template of
+    the enclosing `timed` block."""
+    sparql_template = sparql_template or _template.get()
+    if sparql_template is None:
+        return
+    timings = _current.get()
+    if timings is not None:
+        timings.queries.append((sparql_template, name, value))
+    elif METRICS_ENABLED:
+        metrics.observe(QUERY_METRICS[name], {"route": "background", "template": sparql_template}, value)
+
+
+def record_cache(result: str):
+    """Records the result of the response cache lookup of the current request."""
+    timings = _current.get()
+    if timings is not None:
+        timings.cache = result
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that labels the timings of the request with the route and records the time
+    spent after the endpoint returned (validation and serialization of the response model)
+    as stage `model`."""
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+
+            @functools.wraps(call)
+            async def endpoint(*args, **kwargs):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    timings = _current.get()
+                    if timings is not None:
+                        timings.endpoint_done = time.perf_counter()
+
+            self.dependant.call = endpoint
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _current.get()
+            if timings is None:
+                return await handler(request)
+            timings.route = request.scope.get("root_path", "") + self.path_format
+            response = await handler(request)
+            if timings.endpoint_done is not None:
+                timings.stages["model"] += time.perf_counter() - timings.endpoint_done
+            return response
+
+        return timed_handler
+
+
+class TimingMiddleware:
+    """ASGI middleware that collects the timings of every request, adds them as Server-Timing
+    header to the responses of the API routes and records them in `metrics` and `recorder`.
+
+    Args:
+        app (ASGIApp): the wrapped application
+        metrics (Metrics | None): the registry the timings are recorded in
+        recorder (tracing.TraceRecorder | None): recorder of the recent requests
+    """
+
+    def __init__(self, app, metrics: "Metrics | None" = None, recorder=None):
+        self.app = app
+        self.metrics = metrics
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status, size = 500, 0
+
+        async def send_timed(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings.route is not None:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _current.reset(token)
+            if timings.route is not None:
+                elapsed = time.perf_counter() - timings.started
+                if self.metrics is not None:
+                    self.metrics.record_request(timings, scope["method"], status, size, elapsed)
+                if self.recorder is not None:
+                    self.recorder.record(timings, scope, status, elapsed)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Prometheus metrics (METRICS) aggregated across the workers.
+
+    The observations are aggregated in the worker and added to a redis hash every
+    `flush_interval` seconds, so the metrics endpoint of any worker reports the totals of all
+    workers (up to the last flush of the others). Without redis only the observations of the
+    worker are reported. Histogram buckets are stored per bucket and made cumulative when
+    rendered.
+
+    Args:
+        redis (redis.asyncio.Redis | None): client for aggregating across workers
+        flush_interval (float): seconds between two flushes to redis
+        key (str): the redis hash
+    """
+
+    def __init__(self, redis=None, flush_interval: float = 10, key: str = "metrics"):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self.key = key
+        # "name|labels|bucket, sum, count or total" -> value, not yet flushed
+        self._pending: dict[str, float] = defaultdict(float)
+        # totals of the worker, without redis
+        self._totals: dict[str, float] = defaultdict(float)
+
+    @staticmethod
+    def _prefix(name: str, labels: dict) -> str:
+        return f"{name}|{json.dumps(labels, sort_keys=True)}|"
+
+    def observe(self, name: str, labels: dict, value: float):
+        buckets = METRICS[name][1]
+        idx = bisect.bisect_left(buckets, value)
+        prefix = self._prefix(name, labels)
+        self._pending[prefix + (_format(buckets[idx]) if idx < len(buckets) else "+Inf")] += 1
+        self._pending[prefix + "sum"] += value
+        self._pending[prefix + "count"] += 1
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        self._pending[self._prefix(name, labels) + "total"] += value
+
+    def record_request(self, timings: RequestTimings, method: str, status: int, size: int, elapsed: float):
+        route = {"route": timings.route}
+        self.observe("intavia_request_seconds", {**route, "method": method, "status": str(status)}, elapsed)
+        for stage, seconds in timings.stages.items():
+            self.observe("intavia_request_stage_seconds", {**route, "stage": stage}, seconds)
+        self.observe("intavia_response_bytes", route, size)
+        if timings.cache is not None:
+            self.inc("intavia_cache_lookups_total", {**route, "result": timings.cache})
+        for sparql_template, name, value in timings.queries:
+            self.observe(QUERY_METRICS[name], {**route, "template": sparql_template}, value)
+
+    async def flush(self):
+        pending, self._pending = self._pending, defaultdict(float)
+        if self.redis is None:
+            for field, value in pending.items():
+                self._totals[field] += value
+            return
+        if len(pending) == 0:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for field, value in pending.items():
+                    pipe.hincrbyfloat(self.key, field, value)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("metrics could not be flushed to redis: %r", e)
+            for field, value in pending.items():
+                self._pending[field] += value
+
+    async def run(self):
+        """Flushes the observations every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def collect(self) -> dict[str, float]:
+        await self.flush()
+        if self.redis is None:
+            return dict(self._totals)
+        return {field: float(value) for field, value in (await self.redis.hgetall(self.key)).items()}
+
+    @staticmethod
+    def render(samples: dict[str, float]) -> str:
+        """Renders the samples in the Prometheus text format."""
+        by_metric = defaultdict(lambda: defaultdict(dict))
+        for field, value in samples.items():
+            name, labels, suffix = field.split("|", 2)
+            by_metric[name][labels][suffix] = value
+        lines = []
+        for name, (kind, buckets, description) in METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for labels, values in sorted(by_metric[name].items()):
+                pairs = [f'{key}="{_escape(value)}"' for key, value in json.loads(labels).items()]
+                if kind == "counter":
+                    lines.append(f"{name}{{{','.join(pairs)}}} {_format(values.get('total', 0))}")
+                    continue
+                cumulative = 0.0
+                for le in [_format(bucket) for bucket in buckets] + ["+Inf"]:
+                    cumulative += values.get(le, 0)
+                    bucket_pairs = pairs + [f'le="{le}"']
+                    lines.append(f"{name}_bucket{{{','.join(bucket_pairs)}}} {_format(cumulative)}")
+                lines.append(f"{name}_sum{{{','.join(pairs)}}} {_format(values.get('sum', 0))}")
+                lines.append(f"{name}_count{{{','.join(pairs)}}} {_format(values.get('count', 0))}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+# redis: the metrics endpoint reports the totals of all workers, local: of the answering worker
+METRICS_STORAGE = os.environ.get("METRICS_STORAGE", "redis")
+metrics = Metrics(flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 10)))
@@ -0,0 +1,206 @@
+"""Adaptive sampling of the Sentry traces and an in-process recorder of recent requests"""
+from collections import deque
+import datetime
+import os
+import random
+import time
+
+import sentry_sdk
+
+
+class TraceSampler:
+    """Decides which transactions are recorded and sent to Sentry.
+
+    The head decision (`traces_sampler`) is taken when the request starts: requests of other
+    paths than the API routes (docs, metrics, debug endpoints) are not traced, the others are
+    recorded at `sample_rate`. Only these requests pay for the transaction and its spans. The
+    tail decision (`before_send_transaction`) is taken when the transaction is finished: slow
+    (`slow_threshold`) and erroring (status >= 500) requests are always sent, fast requests at
+    `fast_rate` and fast cache hits at `cache_hit_rate`. Slow and erroring requests that were
+    not recorded at the head are promoted after the fact (`promote`) from the timings collected
+    for every request by the TraceRecorder, so they are sent as well.
+
+    Args:
+        sample_rate (float): share of the requests recorded
+        slow_threshold (float): seconds from which a request is always sent
+        fast_rate (float): share of the other requests sent
+        cache_hit_rate (float): share of the other requests answered from the response cache sent
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.1,
+        slow_threshold: float = 1.0,
+        fast_rate: float = 0.01,
+        cache_hit_rate: float = 0.001,
+    ):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.fast_rate = fast_rate
+        self.cache_hit_rate = cache_hit_rate
+        self.sent = 0
+        self.dropped = 0
+
+    @staticmethod
+    def traced(path: str) -> bool:
+        return path.startswith(("/v1/", "/v2/"))
+
+    def traces_sampler(self, sampling_context: dict) -> float:
+        if sampling_context.get("parent_sampled") is not None:
+            return float(sampling_context["parent_sampled"])
+        scope = sampling_context.get("asgi_scope")
+        if scope is not None and not self.traced(scope.get("path", "")):
+            return 0.0
+        return self.sample_rate
+
+    def always_kept(self, duration: float, status: int) -> bool:
+        return status >= 500 or duration >= self.slow_threshold
+
+    def keep(self, duration: float, status: int, cache: str | None) -> bool:
+        if self.always_kept(duration, status):
+            return True
+        rate = self.cache_hit_rate if cache in ("local_hit", "remote_hit") else self.fast_rate
+        return random.random() < rate
+
+    def before_send_transaction(self, event: dict, hint: dict) -> dict | None:
+        tags = event.get("tags") or {}
+        try:
+            duration = _seconds(event["timestamp"]) - _seconds(event["start_timestamp"])
+        except (KeyError, TypeError, ValueError):
+            duration = float("inf")
+        # no status: the request failed before the response was started
+        status = int(tags.get("http.status_code", 500))
+        if self.keep(duration, status, tags.get("cache")):
+            self.sent += 1
+            return event
+        self.dropped += 1
+        return None
+
+    def promote(self, timings, summary: dict, status: int, duration: float):
+        """Sends the transaction of a request that was not recorded at the head, rebuilt from its
+        timings (timing.RequestTimings): one span per stage, starting with the request. The
+        stages of concurrent queries are summed up, so their spans do not show when the queries
+        ran. The summary (TraceRecorder.summary) with the timings per SPARQL template is added
+        as context."""
+        end = datetime.datetime.now(datetime.timezone.utc)
+        start = end - datetime.timedelta(seconds=duration)
+        transaction = sentry_sdk.start_transaction(
+            name=timings.route, op="http.server", source="route", sampled=True, start_timestamp=start
+        )
+        for stage, seconds in timings.stages.items():
+            span = transaction.start_child(op=stage, start_timestamp=start)
+            span.finish(end_timestamp=start + datetime.timedelta(seconds=seconds))
+        transaction.set_http_status(status)
+        transaction.set_tag("promoted", "true")
+        if timings.cache is not None:
+            transaction.set_tag("cache", timings.cache)
+        transaction.set_context("timings", summary)
+        transaction.finish(end_timestamp=end)
+
+
+def _seconds(value) -> float:
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    return float(value)
+
+
+class TraceRecorder:
+    """Keeps the timings (timing.RequestTimings) of the recent requests of the worker in ring
+    buffers, the summaries are only built when they are requested. Slow and erroring requests
+    are kept in a second buffer as well, so they are not pushed out by the fast ones. The cache
+    status is added as tag to the Sentry transaction of the request for the tail sampling, slow
+    and erroring requests without a recorded transaction are promoted by the sampler.
+
+    Args:
+        size (int): number of recent requests kept
+        slow_size (int): number of slow or erroring requests kept
+        slow_threshold (float): seconds from which a request is kept as slow
+        sampler (TraceSampler | None): sampler that promotes the slow and erroring requests
+    """
+
+    def __init__(
+        self, size: int = 1000, slow_size: int = 200, slow_threshold: float = 1.0, sampler: TraceSampler | None = None
+    ):
+        self.slow_threshold = slow_threshold
+        self.sampler = sampler
+        self.recent = deque(maxlen=size)
+        self.slow = deque(maxlen=slow_size)
+
+    def record(self, timings, scope: dict, status: int, duration: float):
+        span = sentry_sdk.get_current_span()
+        transaction = span.containing_transaction if span is not None else None
+        entry = (time.time(), scope["method"], scope["path"], status, duration, timings)
+        if transaction is not None and transaction.sampled:
+            if timings.cache is not None:
+                transaction.set_tag("cache", timings.cache)
+        elif (
+            self.sampler is not None
+            and self.sampler.traced(scope["path"])
+            and self.sampler.always_kept(duration, status)
+        ):
+            self.sampler.promote(timings, self.summary(entry), status, duration)
+        self.recent.append(entry)
+        if status >= 500 or duration >= self.slow_threshold:
+            self.slow.append(entry)
+
+    @staticmethod
+    def summary(entry: tuple) -> dict:
+        timestamp, method, path, status, duration, timings = entry
+        queries = {}
+        for sparql_template, name, value in timings.queries:
+            query = queries.setdefault(sparql_template, {"template": sparql_template, "queries": 0})
+            if name == "triplestore":
+                query["queries"] += 1
+            key = f"{name}_ms" if name in ("render", "triplestore") else name
+            query[key] = query.get(key, 0) + (value * 1e3 if key.endswith("_ms") else value)
+        return {
+            "timestamp": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(),
+            "method": method,
+            "path": path,
+            "route": timings.route,
+            "status": status,
+            "duration_ms": duration * 1e3,
+            "cache": timings.cache,
+            "stages_ms": {stage: seconds * 1e3 for stage, seconds in timings.stages.items()},
+            "queries": sorted(queries.values(), key=lambda query: -query.get("triplestore_ms", 0)),
+        }
+
+    def summaries(
+        self, slow: bool = False, route: str | None = None, min_duration: float = 0, limit: int = 50
+    ) -> list[dict]:
+        """Summaries of the recorded requests, newest first.
+
+        Args:
+            slow (bool): only the slow or erroring requests
+            route (str | None): only requests of the route (e.g. /v2/api/entities/search)
+            min_duration (float): only requests that took at least that many seconds
+            limit (int): maximum number of summaries
+
+        Returns:
+            list[dict]: the summaries
+        """
+        res = []
+        for entry in reversed(self.slow if slow else self.recent):
+            if (route is None or entry[5].route == route) and entry[4] >= min_duration:
+                res.append(self.summary(entry))
+                if len(res) >= limit:
+                    break
+        return res
+
+
+TRACES_SLOW_THRESHOLD = float(os.environ.get("TRACES_SLOW_THRESHOLD", 1.0))
+trace_sampler = TraceSampler(
+    sample_rate=float(os.environ.get("TRACES_SAMPLE_RATE", 0.1)),
+    slow_threshold=TRACES_SLOW_THRESHOLD,
+    fast_rate=float(os.environ.get("TRACES_FAST_SAMPLE_RATE", 0.01)),
+    cache_hit_rate=float(os.environ.get("TRACES_CACHE_HIT_SAMPLE_RATE", 0.001)),
+)
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 1000))
+trace_recorder = TraceRecorder(
+    size=TRACE_BUFFER_SIZE,
+    slow_size=int(os.environ.get("TRACE_SLOW_BUFFER_SIZE", 200)),
+    slow_threshold=TRACES_SLOW_THRESHOLD,
+    sampler=trace_sampler,
+)
@@ -1,9 +1,8 @@
+import asyncio
 import base64
 from dataclasses import asdict
-import datetime
 import os
 from urllib.parse import quote, unquote
-from SPARQLWrapper import SPARQLWrapper, JSON
 from intavia_backend.query_parameters import Search
 from intavia_backend.query_parameters_v2 import (
     QueryBase,
@@ -14,8 +13,15 @@ from intavia_backend.query_parameters_v2 import (
     SearchVocabs,
     StatisticsBase,
 )
-from jinja2 import Environment, FileSystemLoader
+from .binding_decoder import decode_bindings
 from .conversion import convert_sparql_result
+from .count_cache import count_cache_key, get_cached_count, set_cached_count
+from .cursors import decode_cursor, page_cursor
+from .query_builder import query_builder, query_params
+from .single_flight import SingleFlight
+from .sparql_client import SPARQLClient
+from .sparql_recorder import QueryRecorder
+from .timing import observe_query, timed
 from SPARQLTransformer import pre_process
 
 config = {
@@ -67,26 +73,55 @@ config = {
     "recon_crm_v1_1.sparql": {"id": "?id", "score": "?score", "label": "?label"},
 }
 
-jinja_env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "sparql")), autoescape=False)
 sparql_endpoint = os.environ.get("SPARQL_ENDPOINT")
-sparql = SPARQLWrapper(sparql_endpoint)
-sparql.setMethod("POST")
-sparql.setReturnFormat(JSON)
-if not sparql_endpoint.startswith("http://127.0.0.1:8080"):
-    sparql.setHTTPAuth("BASIC")
-    sparql.setCredentials(user=os.environ.get("SPARQL_USER"), passwd=os.environ.get("SPARQL_PASSWORD"))
-
-
-def get_query_from_triplestore(search: Search, sparql_template: str, proto_config: str | None = None):
-    query_template = jinja_env.get_template(sparql_template).render(**asdict(search))
-    sparql.setQuery(query_template)
-    res = sparql.queryAndConvert()
+sparql_credentials = {}
+# in replay mode the triplestore is not contacted and the endpoint can be left out
+if sparql_endpoint is not None and not sparql_endpoint.startswith("http://127.0.0.1:8080"):
+    sparql_credentials = {"user": os.environ.get("SPARQL_USER"), "password": os.environ.get("SPARQL_PASSWORD")}
+sparql = SPARQLClient(
+    sparql_endpoint,
+    max_connections=int(os.environ.get("SPARQL_MAX_CONNECTIONS", 32)),
+    max_concurrency=int(os.environ.get("SPARQL_MAX_CONCURRENCY", 32)),
+    timeout=float(os.environ.get("SPARQL_TIMEOUT", 180)),
+    **sparql_credentials,
+)
+# record: the responses of the triplestore are written to SPARQL_RECORDING_PATH, replay: the
+# recorded responses are returned instead of querying the triplestore
+SPARQL_RECORDING_MODE = os.environ.get("SPARQL_RECORDING_MODE", "off")
+if SPARQL_RECORDING_MODE != "off":
+    sparql = QueryRecorder(
+        sparql,
+        SPARQL_RECORDING_MODE,
+        os.environ.get("SPARQL_RECORDING_PATH", "sparql_recording"),
+        latency=os.environ.get("SPARQL_REPLAY_LATENCY", "none"),
+    )
+
+# off: every query is sent to the triplestore, local: identical queries in flight are
+# coalesced within the worker, redis: also across the workers
+SPARQL_SINGLE_FLIGHT = os.environ.get("SPARQL_SINGLE_FLIGHT", "local")
+single_flight = SingleFlight(
+    lock_ttl=float(os.environ.get("SPARQL_TIMEOUT", 180)),
+    result_ttl=float(os.environ.get("SINGLE_FLIGHT_RESULT_TTL", 10)),
+)
+# "facets" retrieves the multi-valued properties of a page of entities with one query per facet,
+# "joined" with a single query joining all of them
+ENTITY_RETRIEVAL_MODE = os.environ.get("ENTITY_RETRIEVAL_MODE", "facets")
+ENTITY_FACETS = ("core", "labels", "occupations", "linkedIds", "events", "media", "biographies")
+
+
+async def get_query_from_triplestore(
+    search: Search, sparql_template: str, proto_config: str | None = None, timeout: float | None = None
+):
+    with timed("render", sparql_template):
+        query_template = query_builder.render(sparql_template, asdict(search))
+    with timed("triplestore", sparql_template):
+        res = await sparql.query(query_template, timeout=timeout)
     rq, proto, opt = pre_process({"proto": config[sparql_template] if proto_config is None else config[proto_config]})
     res = convert_sparql_result(res, proto, {"is_json_ld": False, "langTag": "hide", "voc": "PROTO"})
     return res
 
 
-def get_query_from_triplestore_v2(search: Search | QueryBase | SearchEvents, sparql_template: str):
+async def get_query_from_triplestore_v2(search: Search | QueryBase | SearchEvents, sparql_template: str):
     """creates the query from the template and the search parameters and returns the json
        from the triplestore. This is v2 and doesnt need the proto config anymore
 
@@ -106,47 +141,195 @@ def get_query_from_triplestore_v2(search: Search | QueryBase | SearchEvents, spa
         or isinstance(search, StatisticsBase)
         or isinstance(search, SearchOccupationsStats)
     ):
-        search = asdict(search)
-    query_template = jinja_env.get_template(sparql_template).render(**search)
-    sparql.setQuery(query_template)
-    res = sparql.queryAndConvert()
+        search = query_params(search)
+    with timed("render", sparql_template):
+        query_template = query_builder.render(sparql_template, search)
+    with timed("triplestore", sparql_template):
+        if SPARQL_SINGLE_FLIGHT == "off":
+            res = await sparql.query(query_template)
+        else:
+            res = await single_flight.do(single_flight.key(query_template), lambda: sparql.query(query_template))
+    observe_query("rows", len(res["results"]["bindings"]), sparql_template)
     return res["results"]["bindings"]
 
 
-def flatten_rdf_data(data: dict) -> list:
-    """Flatten the RDF data to a list of dicts.
+def merge_counts(bindings: list, count_key: str = "count") -> list:
+    """Merges the bindings of several queries that counted disjoint sets of entities: the counts
+       of bindings with the same values of all other variables are summed up.
+
+    Args:
+        bindings (list): SPARQL result bindings
+        count_key (str): the variable holding the count
+
+    Returns:
+        list: the merged bindings
+    """
+    merged = {}
+    for binding in bindings:
+        key = tuple(sorted((k, v["value"]) for k, v in binding.items() if k != count_key))
+        found = merged.get(key)
+        if found is None:
+            merged[key] = dict(binding)
+        elif count_key in binding:
+            total = int(found[count_key]["value"]) + int(binding[count_key]["value"])
+            found[count_key] = {**found[count_key], "value": str(total)}
+    return list(merged.values())
+
+
+async def get_chunked_counts_from_triplestore(
+    params: dict, sparql_template: str, ids: list[str], chunk_size: int, max_concurrency: int = 4
+) -> list:
+    """Runs a counting query for a large list of IDs in chunks of `chunk_size` IDs (the `ids`
+       parameter of the template) and merges the counts of the chunks.
+
+    Args:
+        params (dict): the other parameters of the template
+        sparql_template (str): name of the template
+        ids (list[str]): the IDs, duplicates are removed
+        chunk_size (int): maximum number of IDs per query
+        max_concurrency (int): maximum number of chunks queried at the same time
+
+    Returns:
+        list: the merged SPARQL bindings
+    """
+    ids = list(dict.fromkeys(ids))
+    if len(ids) <= chunk_size:
+        return await get_query_from_triplestore_v2({**params, "ids": ids}, sparql_template)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(chunk):
+        async with semaphore:
+            return await get_query_from_triplestore_v2({**params, "ids": chunk}, sparql_template)
+
+    results = await asyncio.gather(*(run(ids[i : i + chunk_size]) for i in range(0, len(ids), chunk_size)))
+    return merge_counts([binding for res in results for binding in res])
+
+
+async def get_paginated_query_from_triplestore(search: QueryBase | dict, sparql_template: str) -> tuple[int, list]:
+    """runs a paginated query and returns the total count together with the flattened results.
+       The total count is cached across pages, on a cache hit the template is rendered
+       without the %count_set subquery.
+
+    Args:
+        search (QueryBase | dict): the search parameters
+        sparql_template (str): name of the template, needs to support `_skip_count`
+
+    Returns:
+        tuple[int, list]: total count and the flattened results of the page
+    """
+    params = query_params(search)
+    key = count_cache_key(params, sparql_template)
+    count = await get_cached_count(key)
+    params["_skip_count"] = count is not None
+    res = flatten_rdf_data(await get_query_from_triplestore_v2(params, sparql_template))
+    if count is None:
+        count = int(res[0]["count"]) if len(res) > 0 else 0
+        if len(res) > 0:
+            await set_cached_count(key, count)
+    return count, res
+
+
+async def get_entity_facets(search: QueryBase | dict, rows: list, require_core: bool = False) -> list:
+    """retrieves the facets (ENTITY_FACETS) of the entities in `rows` with one query per facet.
+       The queries run concurrently, their results are merged per entity. The number of rows
+       is the sum of the facet cardinalities instead of their product.
+
+    Args:
+        search (QueryBase | dict): the search parameters (datasets, kind)
+        rows (list): flattened rows with at least `entity`, e.g. the results of an `_ids_only` query
+        require_core (bool): leave out entities the core facet returned no row for, i.e. entities
+            that do not exist (in the requested datasets / kinds)
+
+    Returns:
+        list: `rows` followed by the rows of the facets, ordered by the first occurence of the entity in `rows`
+    """
+    params = query_params(search)
+    by_entity = {}
+    for row in rows:
+        by_entity.setdefault(row["entity"], []).append(row)
+    if len(by_entity) == 0:
+        return rows
+    params["ids"] = list(by_entity)
+    results = await asyncio.gather(
+        *(
+            get_query_from_triplestore_v2({**params, "facet": facet}, "retrieve_entity_facets_v2_1.sparql")
+            for facet in ENTITY_FACETS
+        )
+    )
+    facet_rows = {entity: [] for entity in by_entity}
+    found = set()
+    for facet, res in zip(ENTITY_FACETS, results):
+        for row in flatten_rdf_data(res):
+            if row.get("entity") in facet_rows:
+                facet_rows[row["entity"]].append(row)
+                if facet == "core":
+                    found.add(row["entity"])
+    if require_core:
+        by_entity = {entity: entity_rows for entity, entity_rows in by_entity.items() if entity in found}
+    return [row for entity in by_entity for row in by_entity[entity]] + [
+        row for entity in by_entity for row in facet_rows[entity]
+    ]
+
+
+async def get_paginated_entities_from_triplestore(search: QueryBase | dict, sparql_template: str) -> tuple[int, list]:
+    """paginated entity query, depending on ENTITY_RETRIEVAL_MODE the page of entity ids is
+       retrieved first (`_ids_only`) and their properties with get_entity_facets.
 
     Args:
-        data (dict): The RDF data
+        search (QueryBase | dict): the search parameters
+        sparql_template (str): name of the template, needs to support `_skip_count` and `_ids_only`
+
+    Returns:
+        tuple[int, list]: total count and the flattened results of the page
+    """
+    if ENTITY_RETRIEVAL_MODE != "facets":
+        return await get_paginated_query_from_triplestore(search, sparql_template)
+    params = query_params(search)
+    params["_ids_only"] = True
+    count, res = await get_paginated_query_from_triplestore(params, sparql_template)
+    return count, await get_entity_facets(search, res)
+
+
+async def iter_query_pages(search: QueryBase | dict, sparql_template: str, chunk_size: int, id_key: str):
+    """pages through all results of a search, `page`, `limit` and `cursor` of the search
+       are ignored. Chunks are retrieved with keyset pagination and without the count subquery.
+
+    Args:
+        search (QueryBase | dict): the search parameters
+        sparql_template (str): name of the template, needs to support `_skip_count` and `_after_entity`
+        chunk_size (int): number of entities / events fetched per query
+        id_key (str): variable identifying an entity / event
+
+    Yields:
+        list: the flattened results of every chunk
+    """
+    params = query_params(search)
+    params.update(
+        {"limit": chunk_size, "page": 1, "_offset": 0, "_skip_count": True, "_after_entity": None, "_after_score": None}
+    )
+    while True:
+        res = flatten_rdf_data(await get_query_from_triplestore_v2(params, sparql_template))
+        if len(res) == 0:
+            return
+        yield res
+        cursor = page_cursor(res, id_key, chunk_size)
+        if cursor is None:
+            return
+        params["_after_entity"], params["_after_score"], params["_offset"] = decode_cursor(cursor)
+
+
+def flatten_rdf_data(data: list) -> list:
+    """Flatten the RDF data to a list of dicts. Typed literals are converted to python
+       values, xsd:dateTime / xsd:date to AstronomicalDate. The data is not modified.
+
+    Args:
+        data (list): The SPARQL bindings
 
     Returns:
         list: A list of dicts
     """
-    flattened_data = []
-    for ent in data:
-        d_res = {}
-        for k, v in ent.items():
-            if isinstance(v, dict):
-                if "value" in v:
-                    if "datatype" in v:
-                        if v["datatype"] == "http://www.w3.org/2001/XMLSchema#dateTime":
-                            try:
-                                v["value"] = datetime.datetime.fromisoformat(str(v["value"]).replace("Z", "+00:00"))
-                            except ValueError:
-                                continue  # FIXME: this is removing dates before 0, should be fixed
-                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#integer":
-                            v["value"] = int(v["value"])
-                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#boolean":
-                            v["value"] = bool(v["value"])
-                        elif v["datatype"] == "http://www.w3.org/2001/XMLSchema#float":
-                            v["value"] = float(v["value"])
-                    d_res[k] = v["value"]
-                else:
-                    d_res[k] = v
-            else:
-                d_res[k] = v
-        flattened_data.append(d_res)
-    return flattened_data
+    with timed("flatten"):
+        return decode_bindings(data)
 
 
 def toggle_urls_encoding(url):
@@ -162,24 +345,3 @@ def toggle_urls_encoding(url):
         return base64.urlsafe_b64encode(url.encode("utf-8")).decode("utf-8")
     else:
         return base64.urlsafe_b64decode(url.encode("utf-8")).decode("utf-8")
-
-
-def calculate_date_range(start, end, intv):
-    diff = (end - start) / intv
-    for i in range(intv):
-        yield (start + diff * i)
-    yield end
-
-
-def create_bins_from_range(start, end, intv):
-    bins = list(calculate_date_range(start, end, intv))
-    bins_fin = []
-    for i in range(0, intv):
-        bins_fin.append(
-            {
-                "values": (bins[i], bins[i + 1]),
-                "label": f"{bins[i].strftime('%Y')} - {bins[i+1].strftime('%Y')}",
-                "count": 0,
-            }
-        )
-    return bins_fin